@@ -0,0 +1,133 @@
+import heapq
+import numpy as np
+from geo import haversine_km
+
+# Interval algorithms over connection histories. Intervals are (start, end) pairs of
+# anything ordered (datetimes, epoch numbers); both ends are inclusive, as in the queries.
+
+
+def interval_join(left, right):
+    # Sweep line over two lists of intervals sorted by start: yields (i, j, start, end) for
+    # every left[i] overlapping right[j], in O((n + m) log(n + m) + pairs)
+    events = [(start, 0, i) for i, (start, _) in enumerate(left)] + \
+             [(start, 1, j) for j, (start, _) in enumerate(right)]
+    events.sort(key=lambda event: event[0])
+    active = ([], [])  # per side, heaps of (end, index)
+    sides = (left, right)
+    for start, side, index in events:
+        end = sides[side][index][1]
+        other = active[1 - side]
+        while other and other[0][0] < start:
+            heapq.heappop(other)
+        for other_end, other_index in other:
+            pair = (index, other_index) if side == 0 else (other_index, index)
+            yield pair[0], pair[1], start, min(end, other_end)
+        heapq.heappush(active[side], (end, index))
+
+
+def merge_intervals(intervals):
+    # Sorted (start, end) intervals with the overlapping or touching ones coalesced
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def co_locations(target_by_cell, others_by_cell, window_start=None, window_end=None):
+    # target_by_cell: {cell_id: [(start, end), ...]} of the target phone's intervals that
+    # count for that cell; others_by_cell: {cell_id: [(phone_number, start, end), ...]}.
+    # Returns {phone_number: {"overlap", "encounters", "cells", "first_seen", "last_seen"}}
+    # where overlap is the summed overlap (clipped to the window) and every overlapping
+    # pair of connections is one encounter.
+    found = {}
+    for cell_id, others in others_by_cell.items():
+        targets = sorted(target_by_cell.get(cell_id, ()))
+        if not targets:
+            continue
+        others = sorted(others, key=lambda other: other[1])
+        intervals = [(start, end) for _, start, end in others]
+        for _, j, start, end in interval_join(targets, intervals):
+            if window_start is not None and start < window_start:
+                start = window_start
+            if window_end is not None and end > window_end:
+                end = window_end
+            if end < start:
+                continue
+            phone_number = others[j][0]
+            entry = found.get(phone_number)
+            if entry is None:
+                entry = found[phone_number] = {"overlap": end - start, "encounters": 0, "cells": set(),
+                                               "first_seen": start, "last_seen": end}
+            else:
+                entry["overlap"] += end - start
+            entry["encounters"] += 1
+            entry["cells"].add(cell_id)
+            entry["first_seen"] = min(entry["first_seen"], start)
+            entry["last_seen"] = max(entry["last_seen"], end)
+    return found
+
+
+class Trajectory:
+    # A phone's route as stops (runs of consecutive connections to the same cell) and the
+    # legs between them. Times are epoch milliseconds as int64 arrays, one row per stop;
+    # legs[i] goes from stop i to stop i + 1.
+    #   leg_km        great-circle distance between the two cells
+    #   leg_seconds   time between leaving stop i and reaching stop i + 1 (0 if they overlap)
+    #   speed_kmh     distance beyond the cell tolerance over that time (inf for no time)
+    #   impossible    speed_kmh above max_speed_kmh: the SIM was in two places at once
+    def __init__(self, cell_ids, latitudes, longitudes, start_ms, end_ms, max_speed_kmh=300, tolerance_km=2):
+        cell_ids = np.asarray(cell_ids, dtype=object)
+        start_ms = np.asarray(start_ms, dtype=np.int64)
+        end_ms = np.asarray(end_ms, dtype=np.int64)
+        if len(cell_ids):
+            first = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+        else:
+            first = np.empty(0, dtype=np.int64)
+        self.cell_ids = cell_ids[first]
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)[first]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[first]
+        self.start_ms = start_ms[first]
+        self.end_ms = np.maximum.reduceat(end_ms, first) if len(first) else end_ms
+        self.connections = np.diff(np.r_[first, len(cell_ids)])
+        self.dwell_seconds = (self.end_ms - self.start_ms) / 1000.0
+        self.max_speed_kmh = max_speed_kmh
+
+        self.leg_km = haversine_km(self.latitudes[:-1], self.longitudes[:-1], self.latitudes[1:], self.longitudes[1:])
+        self.leg_seconds = np.maximum(self.start_ms[1:] - self.end_ms[:-1], 0) / 1000.0
+        moved = np.maximum(self.leg_km - tolerance_km, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.speed_kmh = np.where(moved > 0, moved / (self.leg_seconds / 3600.0), 0.0)
+        self.impossible = self.speed_kmh > max_speed_kmh
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    @property
+    def total_km(self):
+        return float(self.leg_km.sum())
+
+    def stops(self):
+        return [{"cell_id": self.cell_ids[i],
+                 "latitude": float(self.latitudes[i]),
+                 "longitude": float(self.longitudes[i]),
+                 "start_at": _from_ms(self.start_ms[i]),
+                 "end_at": _from_ms(self.end_ms[i]),
+                 "dwell_seconds": float(self.dwell_seconds[i]),
+                 "connections": int(self.connections[i])} for i in range(len(self))]
+
+    def impossible_jumps(self):
+        return [{"from_cell": self.cell_ids[i],
+                 "to_cell": self.cell_ids[i + 1],
+                 "left_at": _from_ms(self.end_ms[i]),
+                 "arrived_at": _from_ms(self.start_ms[i + 1]),
+                 "km": float(self.leg_km[i]),
+                 "seconds": float(self.leg_seconds[i]),
+                 "speed_kmh": float(self.speed_kmh[i])} for i in np.flatnonzero(self.impossible)]
+
+
+def _from_ms(value):
+    return np.datetime64(int(value), "ms").astype(object)
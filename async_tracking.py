@@ -0,0 +1,381 @@
+import asyncio
+import random
+from db_connection import with_async_database
+from criminal_tracking import CriminalTrackingApp, group_by_cell, spread_targets, colocated_rows
+from data_retrieval import chunked
+from temporal import to_datetime, to_instant, day_bounds
+from location_matrix import LocationMatrix
+from analysis import co_locations, Trajectory
+from queries import window_parameters, near_parameters
+from cell_index import CellIndex
+from geocoding import ReverseGeocodeCache, OfflineComuneResolver
+import columnar_export
+import queries
+import events
+
+# asyncio versions of DataRetrievalApp and CriminalTrackingApp on the async Neo4j driver,
+# running the same queries (queries.py). Method names, arguments and return values are
+# those of the synchronous apps; every method is a coroutine (iter_* are async
+# generators), so independent lookups can be awaited together with asyncio.gather.
+# Not carried over: the query cache (cache=) and the interval cache (interval_cache_size=).
+# The export_* methods collect the rows in memory before encoding them.
+
+
+async def gather_bounded(coroutines, limit=10):
+    # asyncio.gather with at most `limit` coroutines running at once; results keep input order
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+
+async def map_bounded(function, items, limit=10):
+    # [await function(item) for item in items], with up to `limit` calls in flight
+    return await gather_bounded((function(item) for item in items), limit)
+
+
+@with_async_database
+class AsyncDataRetrievalApp:
+    async def get_person_by_phone(self, phone_number):
+        result = await self.connector.execute_query(queries.PERSON_BY_PHONE, {"phone_number": phone_number})
+        return dict(result[0]) if result else None
+
+    async def get_phone_by_name(self, name):
+        result = await self.connector.execute_query(queries.PHONE_BY_NAME, {"name": name})
+        return result[0]['phone_number'] if result else None
+
+    async def get_phones_by_names(self, names):
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        result = await self.connector.execute_query(queries.PHONES_BY_NAMES, {"names": names})
+        return {record['name']: record['phone_number'] for record in result or []}
+
+    async def get_people_by_phones(self, phone_numbers):
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        if not phone_numbers:
+            return {}
+        result = await self.connector.execute_query(queries.PEOPLE_BY_PHONES, {"phone_numbers": phone_numbers})
+        return {record['phone_number']: record['name'] for record in result or []}
+
+    async def iter_all_people(self, fetch_size=1000):
+        async for record in self.connector.stream_query(queries.ALL_PEOPLE, fetch_size=fetch_size):
+            yield record['name']
+
+    async def iter_people_phones(self, fetch_size=1000):
+        async for record in self.connector.stream_query(queries.PEOPLE_PHONES, fetch_size=fetch_size):
+            yield record['name'], record['phone_number']
+
+    async def iter_all_phone_numbers(self, fetch_size=1000):
+        async for record in self.connector.stream_query(queries.ALL_PHONE_NUMBERS, fetch_size=fetch_size):
+            yield record['number']
+
+    async def iter_all_cells(self, fetch_size=1000):
+        async for record in self.connector.stream_query(queries.ALL_CELLS, fetch_size=fetch_size):
+            yield queries.cell_row(record)
+
+    async def iter_all_connections(self, fetch_size=1000):
+        async for record in self.connector.stream_query(queries.ALL_CONNECTIONS, fetch_size=fetch_size):
+            yield queries.connection_row(record, phone_number=record["phone_number"], cell_id=record["cell_id"])
+
+    async def iter_connection_epochs(self, fetch_size=10000):
+        async for record in self.connector.stream_query(queries.CONNECTION_EPOCHS, fetch_size=fetch_size):
+            yield record["phone_number"], record["cell_id"], record["start_ms"], record["end_ms"]
+
+    async def export_connections_columnar(self):
+        return columnar_export.connection_columns([row async for row in self.iter_connection_epochs()])
+
+    async def export_cells_columnar(self):
+        return columnar_export.cell_columns(await self.get_all_cells())
+
+    async def export_people_columnar(self):
+        return columnar_export.people_columns([row async for row in self.iter_people_phones()])
+
+    async def export_snapshot(self, directory, parquet=True):
+        connections, cells, people = await asyncio.gather(
+            self.export_connections_columnar(), self.export_cells_columnar(), self.export_people_columnar())
+        await asyncio.to_thread(columnar_export.write_snapshot, directory, connections, cells, parquet, people)
+
+    async def get_all_people(self):
+        return [name async for name in self.iter_all_people()]
+
+    async def get_all_phone_numbers(self):
+        return [number async for number in self.iter_all_phone_numbers()]
+
+    async def get_all_cells(self):
+        return [cell async for cell in self.iter_all_cells()]
+
+    async def get_all_connections(self):
+        return [connection async for connection in self.iter_all_connections()]
+
+    async def get_people_page(self, after=None, limit=100):
+        after_name, after_id = after if after else (None, None)
+        result = await self.connector.execute_query(queries.PEOPLE_PAGE, {"after_name": after_name, "after_id": after_id, "limit": limit}) or []
+        return queries.people_page(result, limit)
+
+    async def get_phone_numbers_page(self, after=None, limit=100):
+        result = await self.connector.execute_query(queries.PHONE_NUMBERS_PAGE, {"after": after, "limit": limit}) or []
+        return queries.phone_numbers_page(result, limit)
+
+    async def get_cells_page(self, after=None, limit=100):
+        result = await self.connector.execute_query(queries.CELLS_PAGE, {"after": after, "limit": limit}) or []
+        return queries.cells_page(result, limit)
+
+    async def get_connections_page(self, after=None, limit=100):
+        after_start, after_id = after if after else (None, None)
+        result = await self.connector.execute_query(queries.CONNECTIONS_PAGE, {"after_start": after_start, "after_id": after_id, "limit": limit}) or []
+        return queries.connections_page(result, limit)
+
+    async def get_connections_by_phone(self, phone_number):
+        result = await self.connector.execute_query(queries.CONNECTIONS_BY_PHONE, {"phone_number": phone_number})
+        return [queries.connection_row(record, cell_id=record["cell_id"]) for record in result or []]
+
+    async def get_connection_history(self, phone_number):
+        result = await self.connector.execute_query(queries.CONNECTION_HISTORY, {"phone_number": phone_number})
+        return [queries.history_row(record) for record in result or []]
+
+    async def get_connection_dates(self, phone_number):
+        result = await self.connector.execute_query(queries.CONNECTION_DATES, {"phone_number": phone_number})
+        return queries.date_pairs(result or [])
+
+    async def get_connection_times(self, phone_number, date):
+        day_start, day_end = day_bounds(date)
+        result = await self.connector.execute_query(queries.CONNECTION_TIMES, {"phone_number": phone_number, "day_start": day_start, "day_end": day_end})
+        return queries.time_pairs(result or [])
+
+    async def get_connection_coordinates(self, phone_number, date, time):
+        result = await self.connector.execute_query(queries.CONNECTION_COORDINATES, {"phone_number": phone_number, "at": to_datetime(date, time)})
+        return [(record['latitude'], record['longitude']) for record in result or []]
+
+    async def get_cell_for_person_at_time(self, phone_number, date, time):
+        if not phone_number:
+            return None
+        result = await self.connector.execute_query(queries.CELL_AT_TIME, {"phone_number": phone_number, "at": to_datetime(date, time)})
+        return result[0]['cell_id'] if result and result[0] else None
+
+
+@with_async_database
+class AsyncCriminalTrackingApp(AsyncDataRetrievalApp):
+    # Geocoding stays on geopy/sqlite, so those calls run in worker threads;
+    # geocode_concurrency bounds how many are in flight (Nominatim allows little parallelism)
+    reverse_geocode_comune = CriminalTrackingApp.reverse_geocode_comune
+    resolve_comune = CriminalTrackingApp.resolve_comune
+
+    def __init__(self, use_cell_index=False, offline_geocoding=False, geocode_cache_path=None,
+                 geocode_concurrency=1):
+        super().__init__()
+        self.geolocator = None  # Nominatim, created on the first online lookup
+        self.comune_resolver = OfflineComuneResolver() if offline_geocoding else None
+        self.geocode_cache = None
+        if not offline_geocoding and geocode_cache_path is not False:
+            self.geocode_cache = ReverseGeocodeCache(geocode_cache_path)
+        self.geocode_concurrency = geocode_concurrency
+        self.cell_index = None
+        if use_cell_index:
+            self.enable_cell_index()
+
+    def enable_cell_index(self):
+        # The index is filled by `await refresh_cell_index()` (done lazily by the lookups below)
+        if self.cell_index is None:
+            self.cell_index = CellIndex(None)
+            events.subscribe(events.CELLS_CHANGED, self.cell_index.mark_stale)
+        return self.cell_index
+
+    async def refresh_cell_index(self):
+        if self.cell_index is not None:
+            self.cell_index.load(await self.get_all_cells())
+
+    async def _ready_cell_index(self):
+        index = self.enable_cell_index()
+        if index.stale:
+            await self.refresh_cell_index()
+        return index
+
+    async def find_cells_near(self, latitude, longitude, radius):
+        if self.cell_index is not None:
+            index = await self._ready_cell_index()
+            return [cell_id for cell_id, _ in index.within(latitude, longitude, radius)]
+        result = await self.connector.execute_query(queries.CELLS_NEAR, near_parameters(latitude, longitude, radius))
+        return [record['cell_id'] for record in result or []]
+
+    async def find_nearest_cells(self, latitude, longitude, k=5):
+        return (await self._ready_cell_index()).nearest(latitude, longitude, k)
+
+    async def find_person_cell(self, name, date, time):
+        phone_number = await self.get_phone_by_name(name)
+        if phone_number:
+            return await self.get_cell_for_person_at_time(phone_number, date, time)
+        return None
+
+    async def locate_phones_at(self, phone_numbers, instants, batch_size=500):
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        return await self._locate(LocationMatrix(phone_numbers, phone_numbers, [to_instant(i) for i in instants]), batch_size)
+
+    async def find_people_cells(self, names, instants, batch_size=500):
+        names = list(dict.fromkeys(names))
+        phones = await self.get_phones_by_names(names)
+        matrix = LocationMatrix(names, [phones.get(name) for name in names], [to_instant(i) for i in instants])
+        return await self._locate(matrix, batch_size)
+
+    async def _locate(self, matrix, batch_size):
+        # The batches run concurrently
+        rows = {}
+        for i, phone_number in enumerate(matrix.phone_numbers):
+            if phone_number:
+                rows.setdefault(phone_number, []).append(i)
+        if not rows or not matrix.instants:
+            return matrix
+        parameters = {"instants": matrix.instants, "first": min(matrix.instants), "last": max(matrix.instants)}
+        results = await asyncio.gather(*(
+            self.connector.execute_query(queries.LOCATE_PHONES, {**parameters, "phone_numbers": batch})
+            for batch in chunked(rows, batch_size)))
+        for result in results:
+            for record in result or []:
+                for i in rows[record['phone_number']]:
+                    matrix.set(i, record['column'], record['cell_id'])
+        return matrix
+
+    async def find_colocated_phones(self, phone_number, start, end, radius=0, min_overlap_seconds=0):
+        start, end = to_instant(start), to_instant(end)
+        history = await self._window_history(phone_number, start, end)
+        if not history:
+            return []
+        target_cells = group_by_cell(history)
+        near_cells = {}
+        if radius:
+            nearby = await asyncio.gather(*(self.find_cells_near(cell["latitude"], cell["longitude"], radius)
+                                            for cell in target_cells.values()))
+            near_cells = dict(zip(target_cells, nearby))
+        target_by_cell = spread_targets(target_cells, near_cells)
+
+        others_by_cell = await self._cell_window_connections(list(target_by_cell), start, end, phone_number)
+        found = co_locations(target_by_cell, others_by_cell, start, end)
+        return colocated_rows(found, await self.get_people_by_phones(found), min_overlap_seconds)
+
+    async def _window_history(self, phone_number, start, end):
+        result = await self.connector.execute_query(queries.WINDOW_HISTORY, {"phone_number": phone_number, "start": start, "end": end})
+        return [queries.history_row(record) for record in result or []]
+
+    async def _cell_window_connections(self, cell_ids, start, end, phone_number):
+        result = await self.connector.execute_query(queries.CELL_WINDOW_CONNECTIONS, {
+            **window_parameters(window=(start, end)), "cell_ids": cell_ids, "phone_number": phone_number
+        })
+        return queries.window_connections(result)
+
+    async def get_trajectory(self, phone_number, start=None, end=None, max_speed_kmh=300, tolerance_km=2):
+        result = await self.connector.execute_query(queries.TRAJECTORY, {
+            "phone_number": phone_number,
+            "start": to_instant(start) if start is not None else None,
+            "end": to_instant(end) if end is not None else None
+        }) or []
+        return Trajectory([record['cell_id'] for record in result],
+                          [record['latitude'] for record in result],
+                          [record['longitude'] for record in result],
+                          [record['start_ms'] for record in result],
+                          [record['end_ms'] for record in result],
+                          max_speed_kmh, tolerance_km)
+
+    async def find_person_location(self, name, date, time):
+        phone_number = await self.get_phone_by_name(name)
+        if phone_number:
+            return await self.get_connection_coordinates(phone_number, date, time)
+        return []
+
+    async def get_location_info(self, latitude, longitude, radius=1):
+        return await asyncio.to_thread(CriminalTrackingApp.get_location_info, self, latitude, longitude, radius)
+
+    async def get_locations_info(self, coordinates, radius=1):
+        distinct = list(dict.fromkeys(coordinates))
+        infos = await map_bounded(lambda point: self.get_location_info(point[0], point[1], radius),
+                                  distinct, self.geocode_concurrency)
+        resolved = dict(zip(distinct, infos))
+        return [resolved[coordinate] for coordinate in coordinates]
+
+    async def find_suspects_in_cell(self, cell_id, date=None, time=None, window=None):
+        parameters = window_parameters(date, time, window)
+        result = await self.connector.execute_query(queries.SUSPECTS_IN_CELL, {**parameters, "cell_id": cell_id})
+        return queries.suspects(result)
+
+    async def find_suspects_in_cells(self, cell_ids, date=None, time=None, window=None):
+        if not cell_ids:
+            return []
+        parameters = window_parameters(date, time, window)
+        result = await self.connector.execute_query(queries.SUSPECTS_IN_CELLS, {**parameters, "cell_ids": list(cell_ids)})
+        return queries.suspects(result)
+
+    async def find_suspects_near_location(self, latitude, longitude, date=None, time=None, radius=1, window=None):
+        if self.cell_index is not None:
+            cell_ids = await self.find_cells_near(latitude, longitude, radius)
+            return await self.find_suspects_in_cells(cell_ids, date, time, window)
+        result = await self.connector.execute_query(queries.SUSPECTS_NEAR_LOCATION, {
+            **window_parameters(date, time, window), **near_parameters(latitude, longitude, radius)
+        })
+        return queries.suspects(result)
+
+    async def locate_phones(self, phone_numbers, date, time, limit=10):
+        # {phone_number: cell_id or None} for many phones, at most `limit` queries in flight
+        phone_numbers = list(phone_numbers)
+        cells = await map_bounded(lambda phone: self.get_cell_for_person_at_time(phone, date, time), phone_numbers, limit)
+        return dict(zip(phone_numbers, cells))
+
+    async def investigate(self, name, date, time, radius=1):
+        # Everything an investigation screen shows for one person, with the independent
+        # lookups running concurrently
+        phone_number = await self.get_phone_by_name(name)
+        if not phone_number:
+            return None
+        history, cell_id, coordinates = await asyncio.gather(
+            self.get_connection_history(phone_number),
+            self.get_cell_for_person_at_time(phone_number, date, time),
+            self.get_connection_coordinates(phone_number, date, time),
+        )
+        suspects, places = await asyncio.gather(
+            self.find_suspects_in_cell(cell_id, date, time) if cell_id else asyncio.sleep(0, []),
+            self.get_locations_info(coordinates, radius),
+        )
+        return {"name": name,
+                "phone_number": phone_number,
+                "history": history,
+                "cell_id": cell_id,
+                "coordinates": coordinates,
+                "places": places,
+                "co_located": [suspect for suspect in suspects if suspect[1] != phone_number]}
+
+
+async def main():
+    async with AsyncCriminalTrackingApp() as app:
+        people, cells = await asyncio.gather(app.get_all_people(), app.get_all_cells())
+        print(f"{len(people)} people, {len(cells)} cells")
+        if not people:
+            return
+
+        name = random.choice(people)
+        phone_number = await app.get_phone_by_name(name)
+        dates = await app.get_connection_dates(phone_number)
+        if not dates:
+            print(f"No connection dates found for {name}")
+            return
+        start_date = random.choice(dates)[0]
+        times = await app.get_connection_times(phone_number, start_date)
+        if not times:
+            print(f"No connection times found for {name} on {start_date}")
+            return
+        start_time = random.choice(times)[0]
+
+        report = await app.investigate(name, start_date, start_time)
+        print(f"{name} ({phone_number}) on {start_date} at {start_time}: cell {report['cell_id']}, "
+              f"{len(report['history'])} connections in total, places {report['places']}")
+        for suspect_name, suspect_phone in report["co_located"]:
+            print(f"- {suspect_name} (Phone: {suspect_phone})")
+
+        phone_numbers = await app.get_all_phone_numbers()
+        sample = random.sample(phone_numbers, min(len(phone_numbers), 100))
+        located = await app.locate_phones(sample, start_date, start_time, limit=20)
+        print(f"{sum(cell is not None for cell in located.values())}/{len(sample)} phones connected at that time")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+from criminal_tracking import CriminalTrackingApp
+from data_cleaner import DataCleaner
+from data_creation import UserCreationApp, CellCreationApp, ConnectionCreationApp
+from name_search import NameIndex, scan_matches
+
+# Seeds the database at each scale with the project's own generators and times the
+# ingestion paths and the investigation queries. Results are written as JSON so runs
+# (before/after a change) can be compared. Seeding wipes the database, hence --reset.
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+CONNECTIONS_PER_PERSON = 100
+CELLS = 1500
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(latencies, elapsed):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(latencies):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "count": int(len(latencies)),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(latencies.max()),
+        "throughput_per_s": len(latencies) / elapsed if elapsed > 0 else None,
+    }
+
+
+def time_calls(function, cases):
+    # One timed call per case; stdout is silenced so chatty methods don't skew the timings
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for args in cases:
+            call_started = time.perf_counter()
+            function(*args)
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed)
+
+
+def time_ingest(function, rows):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+    return {"rows": rows, "seconds": elapsed, "rows_per_second": rows / elapsed if elapsed > 0 else None}
+
+
+def seed(connections, per_row_sample):
+    # Cells, then people and connections: a small sample through the per-row generators
+    # (generate_fake_people / generate_fake_connections, timed), the rest in bulk
+    people = max(connections // CONNECTIONS_PER_PERSON, 10)
+    results = {"people": people, "connections": connections}
+    with UserCreationApp() as users, CellCreationApp(seed=1) as cells, \
+            CriminalTrackingApp(cache=False) as retrieval, ConnectionCreationApp(retrieval) as links:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            cells.generate_cells_for_italy(total_cells=CELLS, cities=None)
+
+        sample = min(per_row_sample, people)
+        results["generate_fake_people"] = time_ingest(lambda: users.generate_fake_people(sample), sample)
+        results["generate_fake_people_bulk"] = time_ingest(
+            lambda: users.generate_fake_people_bulk(people - sample), people - sample)
+
+        sample = min(per_row_sample, connections)
+        results["generate_fake_connections"] = time_ingest(lambda: links.generate_fake_connections(sample), sample)
+        results["generate_fake_connections_bulk"] = time_ingest(
+            lambda: links.generate_fake_connections_bulk(connections - sample), connections - sample)
+    return results
+
+
+def query_cases(app, count, rng):
+    # Investigation inputs taken from real connections: an instant inside a random
+    # connection of a random phone, its cell, the owner's name and the cell position
+    phones = app.get_all_phone_numbers()
+    names = app.get_people_by_phones(rng.sample(phones, min(len(phones), count * 2)))
+    cells = {cell["id"]: cell for cell in app.get_all_cells()}
+    cases = []
+    for phone_number, name in names.items():
+        history = app.get_connection_history(phone_number)
+        if not history:
+            continue
+        connection = rng.choice(history)
+        at = connection["start_at"] + (connection["end_at"] - connection["start_at"]) / 2
+        cell = cells[connection["cell_id"]]
+        cases.append({"name": name, "cell_id": cell["id"], "latitude": cell["latitude"],
+                      "longitude": cell["longitude"], "date": str(at.date()), "time": str(at.time().replace(microsecond=0))})
+        if len(cases) == count:
+            break
+    return cases
+
+
+def name_queries(people, count, rng):
+    # Substrings (regex path) and misspelt names (fuzzy fallback), half and half
+    queries = []
+    for i in range(count):
+        name = rng.choice(people)
+        if i % 2 == 0:
+            start = rng.randrange(max(len(name) - 4, 1))
+            queries.append(name[start:start + rng.randint(3, 6)])
+        else:
+            position = rng.randrange(len(name))
+            queries.append(name[:position] + "x" + name[position + 1:])
+    return queries
+
+
+def run_queries(count, radius, rng, name_baseline=False):
+    results = {}
+    with CriminalTrackingApp(cache=False, geocode_cache_path=False) as app:
+        cases = query_cases(app, count, rng)
+        results["find_person_cell"] = time_calls(
+            app.find_person_cell, [(c["name"], c["date"], c["time"]) for c in cases])
+        results["find_suspects_in_cell"] = time_calls(
+            app.find_suspects_in_cell, [(c["cell_id"], c["date"], c["time"]) for c in cases])
+        results["find_suspects_near_location"] = time_calls(
+            app.find_suspects_near_location,
+            [(c["latitude"], c["longitude"], c["date"], c["time"], radius) for c in cases])
+        # The name search main.py runs: index build (one load of every person), then the searches
+        index = NameIndex(app.get_all_people)
+        results["name_index_build"] = time_calls(index.refresh, [()])
+        people = index.names
+        queries = name_queries(people, count, rng)
+        results["name_index_search"] = time_calls(index.search, [(query,) for query in queries])
+        if name_baseline:
+            results["scan_matches"] = time_calls(scan_matches, [(query, people) for query in queries])
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(scales=DEFAULT_SCALES, queries=200, per_row_sample=1000, radius=2, seed_value=42, reset=False,
+                  name_baseline=False):
+    rng = random.Random(seed_value)
+    random.seed(seed_value)
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "queries_per_operation": queries,
+        "scales": {},
+    }
+    for scale in scales:
+        print(f"Scale {scale} connections")
+        entry = {}
+        if scale:
+            cleaner = DataCleaner()
+            if not reset:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    existing = cleaner.verify_empty_database()
+                if existing:
+                    cleaner.connector.close()
+                    raise SystemExit("The database is not empty: pass --reset to let the benchmark wipe it.")
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                cleaner.delete_all_data()
+            cleaner.connector.close()
+            entry["ingest"] = seed(scale, per_row_sample)
+            reset = True
+        entry["queries"] = run_queries(queries, radius, rng, name_baseline)
+        entry["peak_rss_mb"] = peak_rss_mb()
+        for operation, stats in {**entry.get("ingest", {}), **entry["queries"]}.items():
+            if isinstance(stats, dict) and stats.get("p50_ms") is not None:
+                print(f"  {operation}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+                      f"p99 {stats['p99_ms']:.2f} ms")
+            elif isinstance(stats, dict) and stats.get("rows_per_second"):
+                print(f"  {operation}: {stats['rows']} rows, {stats['rows_per_second']:.0f} rows/s")
+        report["scales"][str(scale)] = entry
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and investigation queries")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="connection counts to seed; 0 benchmarks the current data without seeding")
+    parser.add_argument("--queries", type=int, default=200, help="timed calls per query operation")
+    parser.add_argument("--per-row-sample", type=int, default=1000,
+                        help="rows written through the per-row generators at each scale")
+    parser.add_argument("--radius", type=float, default=2, help="km for find_suspects_near_location")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="allow wiping a non-empty database")
+    parser.add_argument("--name-baseline", action="store_true",
+                        help="also time the full-scan name search NameIndex replaced")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.scales, args.queries, args.per_row_sample, args.radius, args.seed, args.reset,
+                           args.name_baseline)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,92 @@
+import threading
+import numpy as np
+from geo import bounding_box, haversine_km, KM_PER_DEGREE_LAT
+
+
+class CellIndex:
+    # Array-backed grid index of cell coordinates. Cells are bucketed by
+    # (floor(lat / grid_degrees), floor(lon / grid_degrees)); a radius query only
+    # looks at the buckets overlapping its bounding box and then filters by exact distance.
+    def __init__(self, loader, grid_degrees=0.05):
+        self.loader = loader
+        self.grid_degrees = grid_degrees
+        self._lock = threading.Lock()
+        self._stale = True
+        self.ids = np.empty(0, dtype=object)
+        self.types = np.empty(0, dtype=object)
+        self.latitudes = np.empty(0, dtype=np.float64)
+        self.longitudes = np.empty(0, dtype=np.float64)
+        self._buckets = {}
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.ids)
+
+    def mark_stale(self, **changes):
+        self._stale = True
+
+    @property
+    def stale(self):
+        return self._stale
+
+    def refresh(self):
+        cells = self.loader() or []
+        self.load(cells)
+
+    def load(self, cells):
+        ids = np.array([cell["id"] for cell in cells], dtype=object)
+        types = np.array([cell.get("type") for cell in cells], dtype=object)
+        latitudes = np.array([cell["latitude"] for cell in cells], dtype=np.float64)
+        longitudes = np.array([cell["longitude"] for cell in cells], dtype=np.float64)
+
+        buckets = {}
+        if len(ids):
+            keys = np.stack([np.floor(latitudes / self.grid_degrees), np.floor(longitudes / self.grid_degrees)], axis=1).astype(np.int64)
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            order = np.argsort(inverse.ravel(), kind="stable")
+            bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(unique_keys) + 1))
+            for i, (row, col) in enumerate(unique_keys):
+                buckets[(int(row), int(col))] = order[bounds[i]:bounds[i + 1]]
+
+        with self._lock:
+            self.ids, self.types = ids, types
+            self.latitudes, self.longitudes = latitudes, longitudes
+            self._buckets = buckets
+            self._stale = False
+
+    def _ensure_loaded(self):
+        if self._stale:
+            self.refresh()
+
+    def _candidates(self, latitude, longitude, radius_km):
+        min_lat, min_lon, max_lat, max_lon = bounding_box(latitude, longitude, radius_km)
+        rows = range(int(np.floor(min_lat / self.grid_degrees)), int(np.floor(max_lat / self.grid_degrees)) + 1)
+        cols = range(int(np.floor(min_lon / self.grid_degrees)), int(np.floor(max_lon / self.grid_degrees)) + 1)
+        if len(rows) * len(cols) > len(self._buckets):
+            return np.arange(len(self.ids))
+        found = [self._buckets[(row, col)] for row in rows for col in cols if (row, col) in self._buckets]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def within(self, latitude, longitude, radius_km):
+        # [(cell_id, distance_km)] for every cell within radius_km, nearest first
+        self._ensure_loaded()
+        candidates = self._candidates(latitude, longitude, radius_km)
+        if not len(candidates):
+            return []
+        distances = haversine_km(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        keep = distances <= radius_km
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return [(self.ids[i], float(d)) for i, d in zip(candidates[order], distances[order])]
+
+    def nearest(self, latitude, longitude, k=5):
+        # Grows the search radius until it holds k cells: the k nearest of those are the global k nearest
+        self._ensure_loaded()
+        if not len(self.ids):
+            return []
+        radius_km = self.grid_degrees * KM_PER_DEGREE_LAT
+        while True:
+            found = self.within(latitude, longitude, radius_km)
+            if len(found) >= k or radius_km > 20038:
+                return found[:k]
+            radius_km *= 2
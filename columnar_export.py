@@ -0,0 +1,144 @@
+import os
+from array import array
+import numpy as np
+
+# Columnar snapshots of the graph for offline analysis. Connections become
+# dictionary-encoded phone/cell codes plus int64 epoch-millisecond intervals,
+# cells become float64 coordinates; both are written as Arrow IPC files that can be
+# memory-mapped back, with optional Parquet copies for other tools. People (name and
+# phone number, one row per Person) make the snapshot complete enough for storage.MemoryStore.
+
+CONNECTIONS_FILE = "connections"
+CELLS_FILE = "cells"
+PEOPLE_FILE = "people"
+
+
+class DictionaryEncoder:
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def code_of(self, value):
+        # The value's code, None if it was never encoded
+        return self._codes.get(value)
+
+
+def connection_columns(rows):
+    # rows: iterable of (phone_number, cell_id, start_ms, end_ms), consumed one at a time
+    phones, cells = DictionaryEncoder(), DictionaryEncoder()
+    phone_codes, cell_codes = array("i"), array("i")
+    starts, ends = array("q"), array("q")
+    for phone_number, cell_id, start_ms, end_ms in rows:
+        phone_codes.append(phones.encode(phone_number))
+        cell_codes.append(cells.encode(cell_id))
+        starts.append(start_ms)
+        ends.append(end_ms)
+    return {
+        "phone_code": np.frombuffer(phone_codes, dtype=np.int32),
+        "cell_code": np.frombuffer(cell_codes, dtype=np.int32),
+        "start_ms": np.frombuffer(starts, dtype=np.int64),
+        "end_ms": np.frombuffer(ends, dtype=np.int64),
+        "phone_dictionary": phones.values,
+        "cell_dictionary": cells.values,
+    }
+
+
+def cell_columns(rows):
+    # rows: iterable of cell dicts as returned by DataRetrievalApp.iter_all_cells
+    ids, types = [], DictionaryEncoder()
+    type_codes = array("i")
+    latitudes, longitudes = array("d"), array("d")
+    for cell in rows:
+        ids.append(cell["id"])
+        type_codes.append(types.encode(cell["type"]))
+        latitudes.append(cell["latitude"])
+        longitudes.append(cell["longitude"])
+    return {
+        "id": ids,
+        "type_code": np.frombuffer(type_codes, dtype=np.int32),
+        "latitude": np.frombuffer(latitudes, dtype=np.float64),
+        "longitude": np.frombuffer(longitudes, dtype=np.float64),
+        "type_dictionary": types.values,
+    }
+
+
+def people_columns(rows):
+    # rows: iterable of (name, phone_number or None)
+    names, phone_numbers = [], []
+    for name, phone_number in rows:
+        names.append(name)
+        phone_numbers.append(phone_number)
+    return {"name": names, "phone_number": phone_numbers}
+
+
+def _dictionary_array(pa, codes, dictionary):
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(dictionary, type=pa.string()))
+
+
+def connections_table(columns):
+    import pyarrow as pa
+    return pa.table({
+        "phone_number": _dictionary_array(pa, columns["phone_code"], columns["phone_dictionary"]),
+        "cell_id": _dictionary_array(pa, columns["cell_code"], columns["cell_dictionary"]),
+        "start_at": pa.array(columns["start_ms"], type=pa.timestamp("ms")),
+        "end_at": pa.array(columns["end_ms"], type=pa.timestamp("ms")),
+    })
+
+
+def cells_table(columns):
+    import pyarrow as pa
+    return pa.table({
+        "id": pa.array(columns["id"], type=pa.string()),
+        "type": _dictionary_array(pa, columns["type_code"], columns["type_dictionary"]),
+        "latitude": pa.array(columns["latitude"], type=pa.float64()),
+        "longitude": pa.array(columns["longitude"], type=pa.float64()),
+    })
+
+
+def people_table(columns):
+    import pyarrow as pa
+    return pa.table({
+        "name": pa.array(columns["name"], type=pa.string()),
+        "phone_number": pa.array(columns["phone_number"], type=pa.string()),
+    })
+
+
+def write_table(table, directory, name, parquet=True):
+    import pyarrow as pa
+    os.makedirs(directory, exist_ok=True)
+    with pa.OSFile(os.path.join(directory, f"{name}.arrow"), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    if parquet:
+        import pyarrow.parquet as pq
+        pq.write_table(table, os.path.join(directory, f"{name}.parquet"))
+
+
+def write_snapshot(directory, connections, cells, parquet=True, people=None):
+    write_table(connections_table(connections), directory, CONNECTIONS_FILE, parquet)
+    write_table(cells_table(cells), directory, CELLS_FILE, parquet)
+    if people is not None:
+        write_table(people_table(people), directory, PEOPLE_FILE, parquet)
+
+
+def load_table(directory, name):
+    # Zero-copy: the returned table reads straight from the memory-mapped Arrow file
+    import pyarrow as pa
+    source = pa.memory_map(os.path.join(directory, f"{name}.arrow"), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def load_snapshot(directory):
+    # "people" only for snapshots written with it
+    snapshot = {"connections": load_table(directory, CONNECTIONS_FILE), "cells": load_table(directory, CELLS_FILE)}
+    if os.path.exists(os.path.join(directory, f"{PEOPLE_FILE}.arrow")):
+        snapshot["people"] = load_table(directory, PEOPLE_FILE)
+    return snapshot
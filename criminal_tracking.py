@@ -1,15 +1,110 @@
 from db_connection import with_database
 from data_retrieval import DataRetrievalApp
+from temporal import to_datetime, to_instant
+from location_matrix import LocationMatrix
+from analysis import co_locations, merge_intervals, Trajectory
+from data_retrieval import chunked
+from cell_index import CellIndex
+from interval_cache import PhoneIntervalCache
+from geocoding import ReverseGeocodeCache, OfflineComuneResolver, MISSING
+from queries import window_parameters, near_parameters
+import queries
+import events
 from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from geopy.distance import distance
 import random
 
+
+def group_by_cell(history):
+    # {cell_id: {"latitude", "longitude", "intervals": [(start_at, end_at)]}} of a window history
+    cells = {}
+    for connection in history:
+        cell = cells.setdefault(connection['cell_id'], {"latitude": connection['latitude'],
+                                                       "longitude": connection['longitude'], "intervals": []})
+        cell["intervals"].append((connection['start_at'], connection['end_at']))
+    return cells
+
+
+def spread_targets(target_cells, near_cells):
+    # Intervals of the target that count for each cell: its own, plus those of the target
+    # cells that have it in near_cells ({cell_id: [cell ids within the radius]}). Intervals
+    # brought in from several cells overlap, so each list is merged before the join
+    target_by_cell = {}
+    for cell_id, cell in target_cells.items():
+        for near_id in {cell_id, *near_cells.get(cell_id, ())}:
+            target_by_cell.setdefault(near_id, []).extend(cell["intervals"])
+    return {cell_id: merge_intervals(intervals) for cell_id, intervals in target_by_cell.items()}
+
+
+def colocated_rows(found, names, min_overlap_seconds=0):
+    # co_locations() output as find_colocated_phones rows, longest overlap first
+    colocated = [{"phone_number": number,
+                  "name": names.get(number),
+                  "overlap_seconds": entry["overlap"].total_seconds(),
+                  "encounters": entry["encounters"],
+                  "cells": sorted(entry["cells"]),
+                  "first_seen": entry["first_seen"],
+                  "last_seen": entry["last_seen"]}
+                 for number, entry in found.items() if entry["overlap"].total_seconds() >= min_overlap_seconds]
+    colocated.sort(key=lambda entry: (-entry["overlap_seconds"], entry["phone_number"]))
+    return colocated
+
+
 @with_database
 class CriminalTrackingApp(DataRetrievalApp):
-    def __init__(self):
-        super().__init__()
-        self.geolocator = Nominatim(user_agent="criminal_tracking_app")
+    def __init__(self, use_cell_index=False, interval_cache_size=None,
+                 offline_geocoding=False, geocode_cache_path=None, cache=None):
+        super().__init__(cache)
+        self.geolocator = None  # Nominatim, created on the first online lookup
+        # offline_geocoding resolves comuni from the local centroid table instead of Nominatim;
+        # online lookups go through a persistent cache (geocode_cache_path=False disables it),
+        # whose file is only created by the first lookup
+        self.comune_resolver = OfflineComuneResolver() if offline_geocoding else None
+        self.geocode_cache = None
+        if not offline_geocoding and geocode_cache_path is not False:
+            self.geocode_cache = ReverseGeocodeCache(geocode_cache_path)
+        self.cell_index = None
+        if use_cell_index:
+            self.enable_cell_index()
+        # interval_cache_size: max number of cached connections across all phones
+        self.interval_cache = None
+        if interval_cache_size:
+            self.interval_cache = PhoneIntervalCache(self.get_connection_history, interval_cache_size)
+            events.subscribe(events.CONNECTIONS_CHANGED, self.interval_cache.invalidate)
+
+    def enable_cell_index(self):
+        # Cells are loaded lazily on first use and reloaded after any cells_changed event
+        if self.cell_index is None:
+            self.cell_index = CellIndex(self.get_all_cells)
+            events.subscribe(events.CELLS_CHANGED, self.cell_index.mark_stale)
+        return self.cell_index
+
+    def refresh_cell_index(self):
+        if self.cell_index is not None:
+            self.cell_index.refresh()
+
+    def find_cells_near(self, latitude, longitude, radius):
+        if self.cell_index is not None:
+            return [cell_id for cell_id, _ in self.cell_index.within(latitude, longitude, radius)]
+        result = self.connector.execute_query(queries.CELLS_NEAR, near_parameters(latitude, longitude, radius))
+        return [record['cell_id'] for record in result or []]
+
+    def find_nearest_cells(self, latitude, longitude, k=5):
+        return self.enable_cell_index().nearest(latitude, longitude, k)
+
+    def get_cell_for_person_at_time(self, phone_number, date, time):
+        if self.interval_cache is None or not phone_number:
+            return super().get_cell_for_person_at_time(phone_number, date, time)
+        intervals = self.interval_cache.get(phone_number)
+        matches = intervals.at(to_datetime(date, time))
+        return intervals.cell_ids[matches[0]] if matches else None
+
+    def get_connection_coordinates(self, phone_number, date, time):
+        if self.interval_cache is None:
+            return super().get_connection_coordinates(phone_number, date, time)
+        intervals = self.interval_cache.get(phone_number)
+        return [(intervals.latitudes[i], intervals.longitudes[i]) for i in intervals.at(to_datetime(date, time))]
 
     def find_person_cell(self, name, date, time):
         phone_number = self.get_phone_by_name(name)
@@ -19,56 +114,162 @@ class CriminalTrackingApp(DataRetrievalApp):
         return None
 
 
+    def locate_phones_at(self, phone_numbers, instants, batch_size=500):
+        # Cells of every phone at every instant as a LocationMatrix: one query per
+        # batch_size phones, each phone's connections expanded once for all instants
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        return self._locate(LocationMatrix(phone_numbers, phone_numbers, [to_instant(i) for i in instants]), batch_size)
+
+    def find_people_cells(self, names, instants, batch_size=500):
+        # Bulk find_person_cell: phones are resolved once for all names, rows are the names
+        names = list(dict.fromkeys(names))
+        phones = self.get_phones_by_names(names)
+        matrix = LocationMatrix(names, [phones.get(name) for name in names], [to_instant(i) for i in instants])
+        return self._locate(matrix, batch_size)
+
+    def _locate(self, matrix, batch_size):
+        rows = {}
+        for i, phone_number in enumerate(matrix.phone_numbers):
+            if phone_number:
+                rows.setdefault(phone_number, []).append(i)
+        if not rows or not matrix.instants:
+            return matrix
+
+        if self.interval_cache is not None:
+            for phone_number, indexes in rows.items():
+                intervals = self.interval_cache.get(phone_number)
+                for column, instant in enumerate(matrix.instants):
+                    found = intervals.at(instant)
+                    if found:
+                        for i in indexes:
+                            matrix.set(i, column, intervals.cell_ids[found[0]])
+            return matrix
+
+        parameters = {"instants": matrix.instants, "first": min(matrix.instants), "last": max(matrix.instants)}
+        for batch in chunked(rows, batch_size):
+            result = self.connector.execute_query(queries.LOCATE_PHONES, {**parameters, "phone_numbers": batch})
+            for record in result or []:
+                for i in rows[record['phone_number']]:
+                    matrix.set(i, record['column'], record['cell_id'])
+        return matrix
+
+    def find_colocated_phones(self, phone_number, start, end, radius=0, min_overlap_seconds=0):
+        # Who was with the target between start and end: every other phone connected to one
+        # of the target's cells (or, with radius in km, a cell that close to it) while the
+        # target was. Two queries fetch the intervals; the join runs as a sweep line per cell.
+        start, end = to_instant(start), to_instant(end)
+        history = self._window_history(phone_number, start, end)
+        if not history:
+            return []
+        target_cells = group_by_cell(history)
+
+        near_cells = {cell_id: self.find_cells_near(cell["latitude"], cell["longitude"], radius) if radius else []
+                      for cell_id, cell in target_cells.items()}
+        target_by_cell = spread_targets(target_cells, near_cells)
+        others_by_cell = self._cell_window_connections(list(target_by_cell), start, end, phone_number)
+        found = co_locations(target_by_cell, others_by_cell, start, end)
+        return colocated_rows(found, self.get_people_by_phones(found), min_overlap_seconds)
+
+    def _window_history(self, phone_number, start, end):
+        # The phone's connections overlapping [start, end], with their cell coordinates
+        result = self.connector.execute_query(queries.WINDOW_HISTORY, {"phone_number": phone_number, "start": start, "end": end})
+        return [queries.history_row(record) for record in result or []]
+
+    def _cell_window_connections(self, cell_ids, start, end, phone_number):
+        # {cell_id: [(phone_number, start_at, end_at)]} of every other phone in the cells during [start, end]
+        result = self.connector.execute_query(queries.CELL_WINDOW_CONNECTIONS, {
+            **window_parameters(window=(start, end)), "cell_ids": cell_ids, "phone_number": phone_number
+        })
+        return queries.window_connections(result)
+
+    def get_trajectory(self, phone_number, start=None, end=None, max_speed_kmh=300, tolerance_km=2):
+        # Time-ordered cells (with coordinates) of one phone in [start, end], as a Trajectory
+        # with distances, speeds, dwell times and the legs no traveller could have made
+        result = self.connector.execute_query(queries.TRAJECTORY, {
+            "phone_number": phone_number,
+            "start": to_instant(start) if start is not None else None,
+            "end": to_instant(end) if end is not None else None
+        }) or []
+        return Trajectory([record['cell_id'] for record in result],
+                          [record['latitude'] for record in result],
+                          [record['longitude'] for record in result],
+                          [record['start_ms'] for record in result],
+                          [record['end_ms'] for record in result],
+                          max_speed_kmh, tolerance_km)
+
     def find_person_location(self, name, date, time):
         phone_number = self.get_phone_by_name(name)
         if phone_number:
             return self.get_connection_coordinates(phone_number, date, time)
         return []
     
+    def reverse_geocode_comune(self, latitude, longitude, radius=1):
+        if self.geolocator is None:
+            self.geolocator = Nominatim(user_agent="criminal_tracking_app")
+        locations = self.geolocator.reverse(f"{latitude}, {longitude}", exactly_one=False)
+        if locations:
+            for location in locations:
+                dist = distance((latitude, longitude), (location.latitude, location.longitude)).km
+                if dist <= radius:
+                    address = location.raw['address']
+                    comune = address.get('city') or address.get('town') or address.get('village')
+                    if comune:
+                        return comune
+        return None
+
+    def resolve_comune(self, latitude, longitude, radius=1):
+        if self.comune_resolver is not None:
+            return self.comune_resolver.resolve(latitude, longitude)
+        if self.geocode_cache is not None:
+            cached = self.geocode_cache.get(latitude, longitude, radius)
+            if cached is not MISSING:
+                return cached or None
+        comune = self.reverse_geocode_comune(latitude, longitude, radius)
+        if self.geocode_cache is not None:
+            self.geocode_cache.put(latitude, longitude, radius, comune or "")
+        return comune
+
     def get_location_info(self, latitude, longitude, radius=1):  # radius in km
-        geolocator = Nominatim(user_agent="criminal_tracking_app")
         try:
-            locations = geolocator.reverse(f"{latitude}, {longitude}", exactly_one=False)
-            if locations:
-                for location in locations:
-                    dist = distance((latitude, longitude), (location.latitude, location.longitude)).km
-                    if dist <= radius:
-                        address = location.raw['address']
-                        comune = address.get('city') or address.get('town') or address.get('village')
-                        if comune:
-                            return f"in the comune of {comune}"
-            return f"within {radius}km of coordinates ({latitude}, {longitude})"
-        except GeocoderTimedOut:
-            return f"within {radius}km of coordinates ({latitude}, {longitude})"
-
-
-
-    def find_suspects_in_cell(self, cell_id, date, time):
-        query = """
-        MATCH (p:Person)-[:HAS_PHONE]->(ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell {id: $cell_id})
-        WHERE r.start_date = $date AND r.start_time <= $time AND r.end_time >= $time
-        RETURN p.name AS name, ph.number AS phone_number
-        """
-        result = self.connector.execute_query(query, {"cell_id": cell_id, "date": date, "time": time})
-        return [(record['name'], record['phone_number']) for record in result]
-
-
-    def find_suspects_near_location(self, latitude, longitude, date, time, radius):
-        query = """
-        MATCH (p:Person)-[:HAS_PHONE]->(ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell)
-        WHERE r.start_date = $date AND r.start_time <= $time AND r.end_time >= $time
-        AND point.distance(point({latitude: c.latitude, longitude: c.longitude}), 
-                        point({latitude: $latitude, longitude: $longitude})) / 1000 <= $radius
-        RETURN DISTINCT p.name AS name, ph.number AS phone_number
-        """
-        result = self.connector.execute_query(query, {
-            "latitude": latitude,
-            "longitude": longitude,
-            "date": date,
-            "time": time,
-            "radius": radius
+            comune = self.resolve_comune(latitude, longitude, radius)
+        except (GeocoderTimedOut, GeocoderServiceError):
+            comune = None
+        if comune:
+            return f"in the comune of {comune}"
+        return f"within {radius}km of coordinates ({latitude}, {longitude})"
+
+    def get_locations_info(self, coordinates, radius=1):
+        # One lookup per distinct coordinate pair; cells repeat a lot across a day of connections
+        resolved = {}
+        for latitude, longitude in coordinates:
+            if (latitude, longitude) not in resolved:
+                resolved[(latitude, longitude)] = self.get_location_info(latitude, longitude, radius)
+        return [resolved[(latitude, longitude)] for latitude, longitude in coordinates]
+
+
+
+    def find_suspects_in_cell(self, cell_id, date=None, time=None, window=None):
+        # Everyone connected to the cell at the instant, during the whole day (time=None)
+        # or at any point of window=(from, to)
+        parameters = window_parameters(date, time, window)
+        result = self.connector.execute_query(queries.SUSPECTS_IN_CELL, {**parameters, "cell_id": cell_id})
+        return queries.suspects(result)
+
+
+    def find_suspects_in_cells(self, cell_ids, date=None, time=None, window=None):
+        if not cell_ids:
+            return []
+        parameters = window_parameters(date, time, window)
+        result = self.connector.execute_query(queries.SUSPECTS_IN_CELLS, {**parameters, "cell_ids": list(cell_ids)})
+        return queries.suspects(result)
+
+    def find_suspects_near_location(self, latitude, longitude, date=None, time=None, radius=1, window=None):
+        if self.cell_index is not None:
+            return self.find_suspects_in_cells(self.find_cells_near(latitude, longitude, radius), date, time, window)
+        result = self.connector.execute_query(queries.SUSPECTS_NEAR_LOCATION, {
+            **window_parameters(date, time, window), **near_parameters(latitude, longitude, radius)
         })
-        return [(record['name'], record['phone_number']) for record in result]
+        return queries.suspects(result)
 
 
 if __name__ == "__main__":
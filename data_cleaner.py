@@ -1,75 +1,180 @@
 from db_connection import with_database
+from temporal import to_datetime
+from query_cache import cache_from_env
+import queries
+import events
+import time
 
 @with_database
 class DataCleaner:
-    def delete_connections(self):
-        query = "MATCH ()-[r:CONNECTED_TO]->() DELETE r"
-        self.connector.execute_query(query)
-        print("All connections deleted.")
-
-    def delete_phone_numbers(self):
-        query = "MATCH (p:PhoneNumber) DETACH DELETE p"
-        self.connector.execute_query(query)
-        print("All phone numbers deleted.")
-
-    def delete_people(self):
-        query = "MATCH (p:Person) DETACH DELETE p"
-        self.connector.execute_query(query)
-        print("All people deleted.")
-
-    def delete_traditional_cells(self):
-        query = "MATCH (c:Cell {type: 'traditional'}) DETACH DELETE c"
-        self.connector.execute_query(query)
-        print("All traditional cells deleted.")
-
-    def delete_5g_cells(self):
-        query = "MATCH (c:Cell {type: '5G'}) DETACH DELETE c"
-        self.connector.execute_query(query)
-        print("All 5G cells deleted.")
-
-    def delete_all_cells(self):
-        query = "MATCH (c:Cell) DETACH DELETE c"
-        self.connector.execute_query(query)
-        print("All cells deleted.")
-
-    def delete_all_data(self):
-        self.delete_connections()
-        self.delete_phone_numbers()
-        self.delete_people()
-        self.delete_all_cells()
-        print("All data deleted from the database.")
+    # Deletes run as a loop of bounded transactions (batch_size nodes/relationships each),
+    # so wiping a production-size graph never builds one huge transaction. The delete
+    # methods return the number deleted, or None when a batch failed part way.
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        self.query_cache = cache_from_env()
 
+    def _delete_in_batches(self, match, variable, label, parameters=None, detach=True, dry_run=False):
+        parameters = dict(parameters or {})
+        if dry_run:
+            result = self.connector.execute_query(queries.count_query(match, variable), parameters)
+            count = result[0]['count'] if result else 0
+            print(f"[dry run] {label}: {count} would be deleted.")
+            return count
+
+        query = queries.delete_batch_query(match, variable, detach)
+        parameters["batch_size"] = self.batch_size
+        total = 0
+        started = time.perf_counter()
+        while True:
+            result = self.connector.execute_query(query, parameters)
+            if result is None:
+                print(f"{label}: batch failed after {total} deletions.")
+                return None
+            deleted = result[0]['deleted'] if result else 0
+            if deleted == 0:
+                break
+            total += deleted
+            print(f"{label}: {total} deleted ({total / (time.perf_counter() - started):.0f}/s)")
+        return total
+
+    def _delete_nodes(self, node, label, dry_run=False):
+        # Relationships first, in their own batches: DETACH DELETE on a batch of nodes would
+        # remove all of their relationships (any number of them) in that one transaction.
+        # The count covers both the relationships and the nodes.
+        total = 0
+        *relationships, (match, variable) = queries.node_matches(node)
+        for relationship_match, relationship in relationships:
+            count = self._delete_in_batches(relationship_match, relationship, f"{label} relationships",
+                                            detach=False, dry_run=dry_run)
+            if count is None:
+                return None
+            total += count
+        count = self._delete_in_batches(match, variable, label, dry_run=dry_run)
+        return None if count is None else total + count
+
+    def delete_connections(self, before=None, after=None, dry_run=False):
+        # before/after: only connections that ended before `before` / started at or after `after`
+        parameters = {}
+        if before is not None:
+            parameters["before"] = to_datetime(before)
+        if after is not None:
+            parameters["after"] = to_datetime(after)
+        match = queries.connections_match(before is not None, after is not None)
+        count = self._delete_in_batches(match, "r", "Connections", parameters, detach=False, dry_run=dry_run)
+        if not dry_run:
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=None)
+            if count is None:
+                print("Connections were only partly deleted.")
+                return None
+            print("All connections deleted." if not parameters else f"{count} connections deleted.")
+        return count
+
+    def delete_phone_numbers(self, dry_run=False):
+        count = self._delete_nodes(queries.PHONE_NUMBER_NODES, "Phone numbers", dry_run)
+        if not dry_run:
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=None)
+            events.publish(events.PEOPLE_CHANGED, names=None, phone_numbers=None)
+            if count is None:
+                print("Phone numbers were only partly deleted.")
+                return None
+            print("All phone numbers deleted.")
+        return count
+
+    def delete_people(self, dry_run=False):
+        count = self._delete_nodes(queries.PERSON_NODES, "People", dry_run)
+        if not dry_run:
+            events.publish(events.PEOPLE_CHANGED, names=None, phone_numbers=None)
+            if count is None:
+                print("People were only partly deleted.")
+                return None
+            print("All people deleted.")
+        return count
+
+    def _delete_cells(self, node, label, done_message, dry_run):
+        count = self._delete_nodes(node, label, dry_run)
+        if not dry_run:
+            events.publish(events.CELLS_CHANGED, cell_ids=None)
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=None)
+            if count is None:
+                print(f"{label} were only partly deleted.")
+                return None
+            print(done_message)
+        return count
+
+    def delete_traditional_cells(self, dry_run=False):
+        return self._delete_cells(queries.TRADITIONAL_CELL_NODES, "Traditional cells", "All traditional cells deleted.", dry_run)
+
+    def delete_5g_cells(self, dry_run=False):
+        return self._delete_cells(queries.FIVE_G_CELL_NODES, "5G cells", "All 5G cells deleted.", dry_run)
+
+    def delete_all_cells(self, dry_run=False):
+        return self._delete_cells(queries.CELL_NODES, "Cells", "All cells deleted.", dry_run)
+
+    def delete_connection_stats(self, dry_run=False):
+        # The ConnectionStats node holding the longest connection duration; the creation apps
+        # forget their cached bound on the CONNECTIONS_CHANGED event and write it again
+        count = self._delete_nodes(queries.CONNECTION_STATS_NODES, "Connection stats", dry_run)
+        if not dry_run:
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=None)
+            if count is None:
+                print("Connection stats were only partly deleted.")
+                return None
+            print("Connection stats deleted.")
+        return count
+
+    def delete_all_data(self, dry_run=False):
+        # A dry run deletes nothing, so a relationship can show up in more than one step's count
+        counts = {}
+        for kind, delete in (("connections", self.delete_connections), ("phone_numbers", self.delete_phone_numbers),
+                             ("people", self.delete_people), ("cells", self.delete_all_cells),
+                             ("connection_stats", self.delete_connection_stats)):
+            counts[kind] = delete(dry_run=dry_run)
+            if counts[kind] is None:
+                print(f"Stopped: deleting {kind.replace('_', ' ')} failed.")
+                return counts
+        if not dry_run:
+            print("All data deleted from the database.")
+        return counts
+
+
+    def count_entities(self):
+        result = self.connector.execute_query(queries.COUNT_ENTITIES)
+        return dict(result[0]) if result else {}
 
     def verify_empty_database(self):
         categories = {
-            'People': 'MATCH (p:Person) RETURN COUNT(p) as count',
-            'Phone Numbers': 'MATCH (ph:PhoneNumber) RETURN COUNT(ph) as count',
-            'Traditional Cells': 'MATCH (c:Cell {type: "traditional"}) RETURN COUNT(c) as count',
-            '5G Cells': 'MATCH (c:Cell {type: "5G"}) RETURN COUNT(c) as count',
-            'Connections': 'MATCH ()-[r:CONNECTED_TO]->() RETURN COUNT(r) as count'
+            'People': 'people',
+            'Phone Numbers': 'phone_numbers',
+            'Traditional Cells': 'traditional_cells',
+            '5G Cells': 'five_g_cells',
+            'Connections': 'connections'
         }
-        
+        record = self.count_entities()
+
         total_count = 0
-        for category, query in categories.items():
-            result = self.connector.execute_query(query)
-            count = result[0]['count'] if result else 0
+        for category, key in categories.items():
+            count = record[key] if record else 0
             total_count += count
             print(f"{category}: {count}")
-        
+
         if total_count == 0:
             print("Database is completely empty.")
         else:
             print(f"Database contains a total of {total_count} nodes/relationships.")
+        return total_count
 
 if __name__ == "__main__":
     cleaner = DataCleaner()
-    
+
     cleaner.delete_connections()
+    # cleaner.delete_connections(before="2024-01-01")  # purge old connections incrementally
+    # cleaner.delete_all_data(dry_run=True)  # only report what would be deleted
     # cleaner.delete_phone_numbers()
     # cleaner.delete_people()
     # cleaner.delete_traditional_cells()
     # cleaner.delete_5g_cells()
-    
+
     # cleaner.delete_all_data()
-    
+
     cleaner.verify_empty_database()
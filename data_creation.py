@@ -1,146 +1,360 @@
 from db_connection import with_database
 from data_retrieval import DataRetrievalApp
+from temporal import to_datetime
+from geo import scatter_points
+from geocoding import load_comuni
+from query_cache import cache_from_env
+import queries
+import events
 from geopy.geocoders import Nominatim
 from geopy.distance import distance
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from neo4j.exceptions import ServiceUnavailable, AuthError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from itertools import islice
 from faker import Faker
-import random, math
+import numpy as np
+import random, time, threading, math
+
+DEFAULT_CITIES = ["Rome", "Milan", "Naples", "Turin", "Palermo", "Genoa", "Bologna", "Florence", "Bari", "Catania"]
 
 @with_database
 class UserCreationApp:
+    def __init__(self):
+        # Holding the process-wide query cache (QUERY_CACHE) subscribes it to the events
+        # below, so a shared sqlite cache is invalidated even when no reader runs here
+        self.query_cache = cache_from_env()
+        self._issued_phone_numbers = None
+
+    def iter_all_phone_numbers(self, fetch_size=1000):
+        for record in self.connector.stream_query(queries.ALL_PHONE_NUMBERS, fetch_size=fetch_size):
+            yield record['number']
+
+    def new_phone_number(self, fake):
+        # A random mobile number not issued yet: phone_number_unique rejects a duplicate,
+        # and with it the whole batch it belongs to
+        if self._issued_phone_numbers is None:
+            self._issued_phone_numbers = set(self.iter_all_phone_numbers())
+        while True:
+            phone_number = fake.numerify('3#########')
+            if phone_number not in self._issued_phone_numbers:
+                self._issued_phone_numbers.add(phone_number)
+                return phone_number
 
     def create_person(self, name):
-        query = "CREATE (p:Person {name: $name}) RETURN p"
-        result = self.connector.execute_query(query, {"name": name})
-        return result[0][0] if result else None
+        result = self.connector.execute_query(queries.CREATE_PERSON, {"name": name})
+        if not result:
+            return None
+        events.publish(events.PEOPLE_CHANGED, names=[name], phone_numbers=[])
+        return result[0]['p']
 
     def add_phone_number(self, name, phone_number):
-        query = (
-            "MATCH (p:Person {name: $name}) "
-            "CREATE (p)-[:HAS_PHONE]->(ph:PhoneNumber {number: $phone_number}) "
-            "RETURN p, ph"
-        )
-        result = self.connector.execute_query(query, {"name": name, "phone_number": phone_number})
+        result = self.connector.execute_query(queries.ADD_PHONE_NUMBER, {"name": name, "phone_number": phone_number})
+        if result:
+            events.publish(events.PEOPLE_CHANGED, names=[name], phone_numbers=[phone_number])
         return result[0] if result else None
 
     def generate_fake_people(self, count=100):
         fake = Faker('it_IT')
-        for _ in range(count):
-            name = fake.name()
-            phone_number = '3' + ''.join([str(fake.random_digit()) for _ in range(9)])
-            self.create_person(name)
-            self.add_phone_number(name, phone_number)
+        with self.connector.session():
+            for _ in range(count):
+                name = fake.name()
+                phone_number = self.new_phone_number(fake)
+                self.create_person(name)
+                self.add_phone_number(name, phone_number)
         print(f"Generated {count} fake people with phone numbers.")
 
+    def create_people_batch(self, rows):
+        result = self.connector.execute_query(queries.CREATE_PEOPLE_BATCH, {"rows": rows})
+        if not result:
+            return 0
+        events.publish(events.PEOPLE_CHANGED,
+                       names=[row["name"] for row in rows],
+                       phone_numbers=[row["phone_number"] for row in rows])
+        return result[0]['created']
+
+    def generate_fake_people_bulk(self, count=100, batch_size=5000):
+        fake = Faker('it_IT')
+        created = 0
+        started = time.perf_counter()
+        while created < count:
+            size = min(batch_size, count - created)
+            rows = [{"name": fake.name(), "phone_number": self.new_phone_number(fake)} for _ in range(size)]
+            written = self.create_people_batch(rows)
+            if not written:
+                print(f"Batch of {size} people failed, stopping after {created} rows.")
+                break
+            created += written
+        elapsed = time.perf_counter() - started
+        rate = created / elapsed if elapsed > 0 else float('inf')
+        print(f"Generated {created} fake people with phone numbers in {elapsed:.2f}s ({rate:.0f} rows/s).")
+        return {"rows": created, "seconds": elapsed, "rows_per_second": rate}
+
 @with_database
 class CellCreationApp:
-    def __init__(self):
-        self.geolocator = Nominatim(user_agent="postal_police_project")
+    def __init__(self, city_centres_path=None, seed=None):
+        self.query_cache = cache_from_env()
+        self.geolocator = None
+        self.rng = np.random.default_rng(seed)
+        comuni = load_comuni(city_centres_path)
+        self.city_names = [c["name_en"] for c in comuni]
+        self.city_centres = {}
+        for c in comuni:
+            self.city_centres[c["comune"].lower()] = c
+            self.city_centres[c["name_en"].lower()] = c
 
     def create_cell(self, cell_id, latitude, longitude, cell_type):
-        query = (
-            "CREATE (c:Cell {id: $cell_id, latitude: $latitude, longitude: $longitude, type: $cell_type}) "
-            "RETURN c"
-        )
         try:
-            result = self.connector.execute_query(query, {"cell_id": cell_id, "latitude": latitude, "longitude": longitude, "cell_type": cell_type})
-            return result[0] if result else None
+            result = self.connector.execute_query(queries.CREATE_CELL, {"cell_id": cell_id, "latitude": latitude, "longitude": longitude, "cell_type": cell_type})
+            if not result:
+                return None
+            events.publish(events.CELLS_CHANGED, cell_ids=[cell_id])
+            return result[0]
         except (ServiceUnavailable, AuthError) as e:
             print(f"Database error while creating cell {cell_id}: {str(e)}")
         except Exception as e:
             print(f"An error occurred while creating cell {cell_id}: {str(e)}")
         return None
 
-    def generate_cells_for_italy(self, total_cells=1500, ratio_5g=0.3):
-        cities = ["Rome", "Milan", "Naples", "Turin", "Palermo", "Genoa", "Bologna", "Florence", "Bari", "Catania"]
+    def create_cells_batch(self, rows):
+        result = self.connector.execute_query(queries.CREATE_CELLS_BATCH, {"rows": rows})
+        if not result or not result[0]['created']:
+            return 0
+        events.publish(events.CELLS_CHANGED, cell_ids=[row["id"] for row in rows])
+        return result[0]['created']
+
+    def create_cells_bulk(self, rows, batch_size=5000):
+        created = 0
+        with self.connector.session():
+            for i in range(0, len(rows), batch_size):
+                created += self.create_cells_batch(rows[i:i + batch_size])
+        return created
+
+    def locate_city(self, city_name):
+        centre = self.city_centres.get(city_name.lower())
+        if centre:
+            return centre["latitude"], centre["longitude"]
+        # Cities missing from the bundled table still fall back to Nominatim
+        if self.geolocator is None:
+            self.geolocator = Nominatim(user_agent="postal_police_project")
+        try:
+            location = self.geolocator.geocode(f"{city_name}, Italy")
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            print(f"Geocoding failed for {city_name}: {e}")
+            return None
+        return (location.latitude, location.longitude) if location else None
+
+    def place_cells(self, city_names, city_centers, city_radius, cells_per_city, prefix, cell_type):
+        # Positions for every city at once: one centre per cell, then a single vectorized scatter
+        center_lats = np.repeat([center[0] for center in city_centers], cells_per_city)
+        center_lons = np.repeat([center[1] for center in city_centers], cells_per_city)
+        latitudes, longitudes = scatter_points(center_lats, center_lons, city_radius, len(center_lats), self.rng)
+        ids = [f"{prefix}_{city_name.replace(' ', '_').replace(chr(39), '')}_{i}"
+               for city_name in city_names for i in range(cells_per_city)]
+        return [{"id": cell_id, "latitude": lat, "longitude": lon, "type": cell_type}
+                for cell_id, lat, lon in zip(ids, latitudes.tolist(), longitudes.tolist())]
+
+    def city_cell_rows(self, city_names, traditional_cells, five_g_cells):
+        located = []
+        for city_name in city_names:
+            city_center = self.locate_city(city_name)
+            if city_center is None:
+                print(f"Could not locate {city_name}")
+            else:
+                located.append((city_name, city_center))
+        names = [name for name, _ in located]
+        centers = [center for _, center in located]
+        city_radius = 10  # km, adjust as needed
+        # 5G cells typically have shorter range
+        return (self.place_cells(names, centers, city_radius, traditional_cells, "TRAD", "traditional") +
+                self.place_cells(names, centers, city_radius * 0.7, five_g_cells, "5G", "5G"))
+
+    def generate_cells_for_italy(self, total_cells=1500, ratio_5g=0.3, cities=DEFAULT_CITIES, batch_size=5000):
+        # cities=None spreads the cells over every comune in the city-centre table
+        if cities is None:
+            cities = self.city_names
         cells_per_city = total_cells // len(cities)
         traditional_cells_per_city = int(cells_per_city * (1 - ratio_5g))
         five_g_cells_per_city = cells_per_city - traditional_cells_per_city
 
-        for city in cities:
-            self.generate_cells_for_city(city, traditional_cells_per_city, five_g_cells_per_city)
+        started = time.perf_counter()
+        rows = self.city_cell_rows(cities, traditional_cells_per_city, five_g_cells_per_city)
+        created = self.create_cells_bulk(rows, batch_size)
+        elapsed = time.perf_counter() - started
 
-        print(f"Generated approximately {total_cells} cell towers for {len(cities)} Italian cities.")
+        print(f"Generated {created} cell towers for {len(cities)} Italian cities in {elapsed:.2f}s.")
 
     def generate_cells_for_city(self, city_name, traditional_cells, five_g_cells):
-        location = self.geolocator.geocode(f"{city_name}, Italy")
-        if location:
-            city_center = (location.latitude, location.longitude)
-            city_radius = 10  # km, adjust as needed
-            self.generate_traditional_cells(city_name, city_center, city_radius, traditional_cells)
-            self.generate_5g_cells(city_name, city_center, city_radius, five_g_cells)
-        else:
-            print(f"Could not locate {city_name}")
+        self.create_cells_bulk(self.city_cell_rows([city_name], traditional_cells, five_g_cells))
 
     def generate_traditional_cells(self, city_name, city_center, city_radius, num_cells):
-        for i in range(num_cells):
-            angle = random.uniform(0, 360)
-            radius = random.uniform(0, city_radius)
-            lat = city_center[0] + radius * math.cos(math.radians(angle))
-            lon = city_center[1] + radius * math.sin(math.radians(angle))
-            cell_id = f"TRAD_{city_name}_{i}"
-            self.create_cell(cell_id, lat, lon, "traditional")
+        self.create_cells_bulk(self.place_cells([city_name], [city_center], city_radius, num_cells, "TRAD", "traditional"))
 
     def generate_5g_cells(self, city_name, city_center, city_radius, num_cells):
-        for i in range(num_cells):
-            angle = random.uniform(0, 360)
-            radius = random.uniform(0, city_radius * 0.7)  # 5G cells typically have shorter range
-            lat = city_center[0] + radius * math.cos(math.radians(angle))
-            lon = city_center[1] + radius * math.sin(math.radians(angle))
-            cell_id = f"5G_{city_name}_{i}"
-            self.create_cell(cell_id, lat, lon, "5G")
+        self.create_cells_bulk(self.place_cells([city_name], [city_center], city_radius * 0.7, num_cells, "5G", "5G"))
 
 @with_database
 class ConnectionCreationApp:
     def __init__(self, retrieval_app):
+        self.query_cache = cache_from_env()
         self.retrieval_app = retrieval_app
+        self.max_duration_seconds = 0
+        self._stats_lock = threading.Lock()
+        events.subscribe(events.CONNECTIONS_CHANGED, self.on_connections_changed)
+
+    def on_connections_changed(self, phone_numbers=None):
+        # Bulk deletes (phone_numbers=None) may have removed the ConnectionStats node, so the
+        # next write must not skip widen_max_duration on the cached bound
+        if phone_numbers is None:
+            with self._stats_lock:
+                self.max_duration_seconds = 0
+
+    def widen_max_duration(self, seconds):
+        # Window queries bound their index seek by the longest connection (ConnectionStats),
+        # so raise it before writing a longer one. Only batches longer than anything seen
+        # so far touch the stats node.
+        if seconds <= self.max_duration_seconds:
+            return
+        result = self.connector.execute_query(queries.WIDEN_MAX_DURATION, {"seconds": int(math.ceil(seconds))})
+        if result:
+            with self._stats_lock:
+                self.max_duration_seconds = max(self.max_duration_seconds, result[0]['max_duration_seconds'])
 
     def connect_phone_to_cell(self, phone_number, cell_id, start_date, start_time, end_date, end_time):
-        query = (
-            "MATCH (ph:PhoneNumber {number: $phone_number}), (c:Cell {id: $cell_id}) "
-            "CREATE (ph)-[:CONNECTED_TO {start_date: $start_date, start_time: $start_time, end_date: $end_date, end_time: $end_time}]->(c)"
-        )
-        self.connector.execute_query(query, {
+        start_at, end_at = to_datetime(start_date, start_time), to_datetime(end_date, end_time)
+        self.widen_max_duration((end_at - start_at).total_seconds())
+        result = self.connector.execute_query(queries.CONNECT_PHONE_TO_CELL, {
             "phone_number": phone_number, 
             "cell_id": cell_id, 
-            "start_date": start_date, 
-            "start_time": start_time,
-            "end_date": end_date,
-            "end_time": end_time
+            "start_at": start_at,
+            "end_at": end_at
         })
+        if result is None:
+            return None
+        created = result[0]['created'] if result else 0
+        if created:
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=[phone_number])
+        return created
 
     def generate_fake_connections(self, connection_count=1000):
         fake = Faker()
         phone_numbers = self.retrieval_app.get_all_phone_numbers()
         cell_ids = self.get_all_cell_ids()
-        for _ in range(connection_count):
-            phone_number = random.choice(phone_numbers)
-            cell_id = random.choice(cell_ids)
-            start_datetime = fake.date_time_between(start_date='-30d', end_date='now')
-            end_datetime = start_datetime + timedelta(minutes=random.randint(1, 120))
-            self.connect_phone_to_cell(
-                phone_number, 
-                cell_id, 
-                str(start_datetime.date()), 
-                str(start_datetime.time()),
-                str(end_datetime.date()),
-                str(end_datetime.time())
-            )
+        with self.connector.session():
+            for _ in range(connection_count):
+                phone_number = random.choice(phone_numbers)
+                cell_id = random.choice(cell_ids)
+                start_datetime = fake.date_time_between(start_date='-30d', end_date='now')
+                end_datetime = start_datetime + timedelta(minutes=random.randint(1, 120))
+                self.connect_phone_to_cell(
+                    phone_number, 
+                    cell_id, 
+                    str(start_datetime.date()), 
+                    str(start_datetime.time()),
+                    str(end_datetime.date()),
+                    str(end_datetime.time())
+                )
         print(f"Generated {connection_count} fake connections between phones and cells.")
 
+    def connect_phones_to_cells_batch(self, rows):
+        if rows:
+            self.widen_max_duration(max((row["end_at"] - row["start_at"]).total_seconds() for row in rows))
+        # None when the write failed, else the number of relationships created
+        result = self.connector.execute_query(queries.CONNECT_PHONES_TO_CELLS_BATCH, {"rows": rows})
+        if result is None:
+            return None
+        created = result[0]['created'] if result else 0
+        if created:
+            events.publish(events.CONNECTIONS_CHANGED, phone_numbers=list({row["phone_number"] for row in rows}))
+        return created
+
+    def connect_phones_to_cells_bulk(self, connections, batch_size=2000, workers=4, max_in_flight=8):
+        # connections: iterable of (phone_number, cell_id, start_datetime, end_datetime)
+        rows = (
+            {"phone_number": phone_number, "cell_id": cell_id, "start_at": start, "end_at": end}
+            for phone_number, cell_id, start, end in connections
+        )
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        lock = threading.Lock()
+        latencies = []
+        totals = {"submitted": 0, "created": 0, "failed": 0}
+
+        def write(batch):
+            try:
+                batch_started = time.perf_counter()
+                created = self.connect_phones_to_cells_batch(batch)
+                with lock:
+                    if created is None:
+                        totals["failed"] += 1
+                    else:
+                        latencies.append(time.perf_counter() - batch_started)
+                        totals["created"] += created
+            finally:
+                in_flight.release()
+
+        started = time.perf_counter()
+        futures = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                in_flight.acquire()
+                totals["submitted"] += len(batch)
+                futures.append(pool.submit(write, batch))
+        elapsed = time.perf_counter() - started
+
+        # A batch fails when its write returned None or when it raised
+        failures = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(e)
+        failed = totals["failed"] + len(failures)
+        if failed:
+            print(f"{failed} of {len(futures)} batches failed" + (f": {failures[0]}" if failures else "."))
+
+        latencies.sort()
+        stats = {
+            "rows": totals["submitted"],
+            "created": totals["created"],
+            "batches": len(latencies),
+            "failed_batches": failed,
+            "seconds": elapsed,
+            "rows_per_second": totals["created"] / elapsed if elapsed > 0 else float('inf'),
+            "batch_latency_p50": latencies[len(latencies) // 2] if latencies else None,
+            "batch_latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            "batch_latency_max": latencies[-1] if latencies else None
+        }
+        print(f"Created {stats['created']} of {stats['rows']} connections in {elapsed:.2f}s "
+              f"({stats['rows_per_second']:.0f} rows/s, {stats['batches']} batches).")
+        return stats
+
+    def generate_fake_connections_bulk(self, connection_count=1000, batch_size=2000, workers=4, max_in_flight=8):
+        fake = Faker()
+        phone_numbers = self.retrieval_app.get_all_phone_numbers()
+        cell_ids = self.get_all_cell_ids()
+
+        def connections():
+            for _ in range(connection_count):
+                start_datetime = fake.date_time_between(start_date='-30d', end_date='now')
+                end_datetime = start_datetime + timedelta(minutes=random.randint(1, 120))
+                yield random.choice(phone_numbers), random.choice(cell_ids), start_datetime, end_datetime
+
+        return self.connect_phones_to_cells_bulk(connections(), batch_size, workers, max_in_flight)
+
     def get_all_cell_ids(self):
-        query = "MATCH (c:Cell) RETURN c.id AS id"
-        result = self.connector.execute_query(query)
-        return [record['id'] for record in result]
+        result = self.connector.execute_query(queries.ALL_CELL_IDS)
+        return [record['id'] for record in result or []]
 
 
 if __name__ == "__main__":
     with UserCreationApp() as user_creation, \
          CellCreationApp() as cell_creation, \
          DataRetrievalApp() as retrieval_app, \
-         ConnectionCreationApp(DataRetrievalApp()) as connection_creation:
+         ConnectionCreationApp(retrieval_app) as connection_creation:
          
 
         #user_creation.generate_fake_people(7500)
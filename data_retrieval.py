@@ -1,110 +1,159 @@
 from db_connection import with_database
+from temporal import to_datetime, day_bounds
+from query_cache import cached, cache_from_env, entity_tags, list_tags
+import queries
+import columnar_export
+from itertools import islice
 import random
 
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 @with_database
 class DataRetrievalApp:
+    def __init__(self, cache=None):
+        # cache: a query_cache.QueryCache, False for no caching, None to follow QUERY_CACHE
+        self.query_cache = cache_from_env() if cache is None else (cache or None)
 
+    @cached(lambda phone_number: entity_tags("phone", phone_number))
     def get_person_by_phone(self, phone_number):
-        query = (
-            "MATCH (p:Person)-[:HAS_PHONE]->(ph:PhoneNumber {number: $phone_number}) "
-            "RETURN p.name AS name"
-        )
-        result = self.connector.execute_query(query, {"phone_number": phone_number})
-        return result[0] if result else None
+        result = self.connector.execute_query(queries.PERSON_BY_PHONE, {"phone_number": phone_number})
+        return dict(result[0]) if result else None
 
+    @cached(lambda name: entity_tags("person", name))
     def get_phone_by_name(self, name):
-        query = (
-            "MATCH (p:Person {name: $name})-[:HAS_PHONE]->(ph:PhoneNumber) "
-            "RETURN ph.number AS phone_number"
-        )
-        result = self.connector.execute_query(query, {"name": name})
+        result = self.connector.execute_query(queries.PHONE_BY_NAME, {"name": name})
         return result[0]['phone_number'] if result else None
 
+    def get_phones_by_names(self, names):
+        # {name: phone_number} for the names that have a phone, in one round-trip
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
+        result = self.connector.execute_query(queries.PHONES_BY_NAMES, {"names": names})
+        return {record['name']: record['phone_number'] for record in result or []}
+
+    def get_people_by_phones(self, phone_numbers):
+        # {phone_number: name}, in one round-trip
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        if not phone_numbers:
+            return {}
+        result = self.connector.execute_query(queries.PEOPLE_BY_PHONES, {"phone_numbers": phone_numbers})
+        return {record['phone_number']: record['name'] for record in result or []}
+
+    def iter_all_people(self, fetch_size=1000):
+        for record in self.connector.stream_query(queries.ALL_PEOPLE, fetch_size=fetch_size):
+            yield record['name']
+
+    def iter_people_phones(self, fetch_size=1000):
+        # (name, phone_number) per Person, phone_number None for people without a phone
+        for record in self.connector.stream_query(queries.PEOPLE_PHONES, fetch_size=fetch_size):
+            yield record['name'], record['phone_number']
+
+    def iter_all_phone_numbers(self, fetch_size=1000):
+        for record in self.connector.stream_query(queries.ALL_PHONE_NUMBERS, fetch_size=fetch_size):
+            yield record['number']
+
+    def iter_all_cells(self, fetch_size=1000):
+        for record in self.connector.stream_query(queries.ALL_CELLS, fetch_size=fetch_size):
+            yield queries.cell_row(record)
+
+    def iter_all_connections(self, fetch_size=1000):
+        for record in self.connector.stream_query(queries.ALL_CONNECTIONS, fetch_size=fetch_size):
+            yield queries.connection_row(record, phone_number=record["phone_number"], cell_id=record["cell_id"])
+
+    def iter_connection_epochs(self, fetch_size=10000):
+        # (phone_number, cell_id, start_ms, end_ms)
+        for record in self.connector.stream_query(queries.CONNECTION_EPOCHS, fetch_size=fetch_size):
+            yield record["phone_number"], record["cell_id"], record["start_ms"], record["end_ms"]
+
+    def export_connections_columnar(self):
+        return columnar_export.connection_columns(self.iter_connection_epochs())
+
+    def export_cells_columnar(self):
+        return columnar_export.cell_columns(self.iter_all_cells())
+
+    def export_people_columnar(self):
+        return columnar_export.people_columns(self.iter_people_phones())
+
+    def export_snapshot(self, directory, parquet=True):
+        # Arrow IPC files (memory-mappable with columnar_export.load_snapshot) plus Parquet copies;
+        # storage.MemoryStore.load_snapshot serves the app from them without a database
+        columnar_export.write_snapshot(directory, self.export_connections_columnar(), self.export_cells_columnar(),
+                                       parquet, self.export_people_columnar())
+
+    @cached(lambda: list_tags("person"))
     def get_all_people(self):
-        query = "MATCH (p:Person) RETURN p.name AS name"
-        result = self.connector.execute_query(query)
-        return [record['name'] for record in result]
+        return list(self.iter_all_people())
 
+    @cached(lambda: list_tags("phone"))
     def get_all_phone_numbers(self):
-        query = "MATCH (ph:PhoneNumber) RETURN ph.number AS number"
-        result = self.connector.execute_query(query)
-        return [record['number'] for record in result]
+        return list(self.iter_all_phone_numbers())
     
+    @cached(lambda: list_tags("cell"))
     def get_all_cells(self):
-        query = "MATCH (c:Cell) RETURN c.id AS id, c.latitude AS latitude, c.longitude AS longitude, c.type AS type"
-        result = self.connector.execute_query(query)
-        return [{"id": record["id"], "latitude": record["latitude"], "longitude": record["longitude"], "type": record["type"]} for record in result]
-    
+        return list(self.iter_all_cells())
+
+    def get_people_page(self, after=None, limit=100):
+        after_name, after_id = after if after else (None, None)
+        result = self.connector.execute_query(queries.PEOPLE_PAGE, {"after_name": after_name, "after_id": after_id, "limit": limit}) or []
+        return queries.people_page(result, limit)
+
+    def get_phone_numbers_page(self, after=None, limit=100):
+        result = self.connector.execute_query(queries.PHONE_NUMBERS_PAGE, {"after": after, "limit": limit}) or []
+        return queries.phone_numbers_page(result, limit)
+
+    def get_cells_page(self, after=None, limit=100):
+        result = self.connector.execute_query(queries.CELLS_PAGE, {"after": after, "limit": limit}) or []
+        return queries.cells_page(result, limit)
+
+    def get_connections_page(self, after=None, limit=100):
+        after_start, after_id = after if after else (None, None)
+        result = self.connector.execute_query(queries.CONNECTIONS_PAGE, {"after_start": after_start, "after_id": after_id, "limit": limit}) or []
+        return queries.connections_page(result, limit)
+
+    @cached(lambda: list_tags("connections"))
     def get_all_connections(self):
-        query = """
-        MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell)
-        RETURN ph.number AS phone_number, c.id AS cell_id, 
-            r.start_date AS start_date, r.start_time AS start_time,
-            r.end_date AS end_date, r.end_time AS end_time
-        """
-        result = self.connector.execute_query(query)
-        return [{"phone_number": record["phone_number"], 
-                "cell_id": record["cell_id"], 
-                "start_date": record["start_date"],
-                "start_time": record["start_time"],
-                "end_date": record["end_date"],
-                "end_time": record["end_time"]} for record in result]
+        return list(self.iter_all_connections())
 
 
+    @cached(lambda phone_number: entity_tags("connections", phone_number))
     def get_connections_by_phone(self, phone_number):
-        query = """
-        MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
-        RETURN c.id AS cell_id, r.start_date AS start_date, r.start_time AS start_time,
-            r.end_date AS end_date, r.end_time AS end_time
-        ORDER BY r.start_date, r.start_time
-        """
-        result = self.connector.execute_query(query, {"phone_number": phone_number})
-        return [{"cell_id": record["cell_id"], 
-                "start_date": record["start_date"], 
-                "start_time": record["start_time"],
-                "end_date": record["end_date"],
-                "end_time": record["end_time"]} for record in result]
+        result = self.connector.execute_query(queries.CONNECTIONS_BY_PHONE, {"phone_number": phone_number})
+        return [queries.connection_row(record, cell_id=record["cell_id"]) for record in result]
+
+    @cached(lambda phone_number: entity_tags("connections", phone_number))
+    def get_connection_history(self, phone_number):
+        result = self.connector.execute_query(queries.CONNECTION_HISTORY, {"phone_number": phone_number})
+        return [queries.history_row(record) for record in result or []]
 
+    @cached(lambda phone_number: entity_tags("connections", phone_number))
     def get_connection_dates(self, phone_number):
-        query = """
-        MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->()
-        RETURN DISTINCT r.start_date AS start_date, r.end_date AS end_date
-        ORDER BY start_date, end_date
-        """
-        result = self.connector.execute_query(query, {"phone_number": phone_number})
-        return [(record['start_date'], record['end_date']) for record in result]
+        result = self.connector.execute_query(queries.CONNECTION_DATES, {"phone_number": phone_number})
+        return queries.date_pairs(result)
 
+    @cached(lambda phone_number, date: entity_tags("connections", phone_number))
     def get_connection_times(self, phone_number, date):
-        query = """
-        MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->()
-        WHERE r.start_date <= $date AND r.end_date >= $date
-        RETURN r.start_time AS start_time, r.end_time AS end_time
-        ORDER BY start_time, end_time
-        """
-        result = self.connector.execute_query(query, {"phone_number": phone_number, "date": date})
-        return [(record['start_time'], record['end_time']) for record in result]
+        day_start, day_end = day_bounds(date)
+        result = self.connector.execute_query(queries.CONNECTION_TIMES, {"phone_number": phone_number, "day_start": day_start, "day_end": day_end})
+        return queries.time_pairs(result)
 
+    @cached(lambda phone_number, date, time: entity_tags("connections", phone_number))
     def get_connection_coordinates(self, phone_number, date, time):
-        query = """
-        MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
-        WHERE r.start_date <= $date AND r.end_date >= $date
-        AND r.start_time <= $time AND r.end_time >= $time
-        RETURN c.latitude AS latitude, c.longitude AS longitude
-        """
-        result = self.connector.execute_query(query, {"phone_number": phone_number, "date": date, "time": time})
+        result = self.connector.execute_query(queries.CONNECTION_COORDINATES, {"phone_number": phone_number, "at": to_datetime(date, time)})
         return [(record['latitude'], record['longitude']) for record in result]
 
+    @cached(lambda phone_number, date, time: entity_tags("connections", phone_number))
     def get_cell_for_person_at_time(self, phone_number, date, time):
         if not phone_number:
             return None
         
-        query = """
-        MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
-        WHERE r.start_date <= $date AND r.end_date >= $date
-        AND r.start_time <= $time AND r.end_time >= $time
-        RETURN c.id AS cell_id
-        """
-        result = self.connector.execute_query(query, {"phone_number": phone_number, "date": date, "time": time})
+        result = self.connector.execute_query(queries.CELL_AT_TIME, {"phone_number": phone_number, "at": to_datetime(date, time)})
         
         return result[0]['cell_id'] if result and result[0] else None
 
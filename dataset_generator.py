@@ -0,0 +1,289 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import numpy as np
+from faker import Faker
+from geo import scatter_points
+from geocoding import load_comuni
+
+# Synthetic CDR dataset for load tests, written as neo4j-admin import files that follow the
+# graph model of data_creation.py: (:Person)-[:HAS_PHONE]->(:PhoneNumber)-[:CONNECTED_TO]->(:Cell).
+# Every shard gets its own seed, so the output only depends on --seed and --shards.
+# CSV shards share one <kind>.header.csv per file kind; Parquet shards carry the same typed
+# headers as column names and are loaded with --input-type=parquet (see import_command).
+
+HEADERS = {
+    "people": [":ID(Person)", "name"],
+    "phones": ["number:ID(PhoneNumber)"],
+    "has_phone": [":START_ID(Person)", ":END_ID(PhoneNumber)"],
+    "cells": ["id:ID(Cell)", "latitude:double", "longitude:double", "type", "location:point{crs:WGS-84}"],
+    "connected_to": [":START_ID(PhoneNumber)", ":END_ID(Cell)", "cell_id", "start_at:localdatetime", "end_at:localdatetime"],
+    "connection_stats": ["name:ID(ConnectionStats)", "max_duration_seconds:long"],
+}
+
+# (label or relationship type, file key) for the neo4j-admin command line
+IMPORT_LAYOUT = [
+    ("--nodes=Person", "people"),
+    ("--nodes=PhoneNumber", "phones"),
+    ("--nodes=Cell", "cells"),
+    ("--nodes=ConnectionStats", "connection_stats"),
+    ("--relationships=HAS_PHONE", "has_phone"),
+    ("--relationships=CONNECTED_TO", "connected_to"),
+]
+
+PHONE_SPACE = 10 ** 9
+PHONE_MULTIPLIER = 387420489  # 3**18, coprime with 10**9: index -> number is a bijection
+DAY_SECONDS = 24 * 3600
+
+
+def phone_number(index):
+    return "3" + f"{(index * PHONE_MULTIPLIER + 12345) % PHONE_SPACE:09d}"
+
+
+def is_timestamp(column):
+    return isinstance(column, np.ndarray) and np.issubdtype(column.dtype, np.datetime64)
+
+
+class ShardWriter:
+    # Streams rows of one file kind to <kind>.part-NNNNN.csv (or .parquet). Timestamp columns
+    # come in as datetime64 arrays: ISO text in CSV, timestamp columns in Parquet
+    def __init__(self, out_dir, kind, shard, fmt):
+        self.kind = kind
+        self.fmt = fmt
+        self.rows = 0
+        self.path = os.path.join(out_dir, f"{kind}.part-{shard:05d}.{fmt}")
+        if fmt == "csv":
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+        else:
+            self._file = None
+            self._writer = None
+
+    def write(self, columns):
+        count = len(columns[0]) if columns else 0
+        if not count:
+            return
+        if self.fmt == "csv":
+            columns = [np.datetime_as_string(column, unit="s").tolist() if is_timestamp(column) else column
+                       for column in columns]
+            self._writer.writerows(zip(*columns))
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # neo4j-admin reads the ID spaces and property types from the column names
+            table = pa.table({header: pa.array(column) for header, column in zip(HEADERS[self.kind], columns)})
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        self.rows += count
+
+    def close(self):
+        if self.fmt == "csv":
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+
+
+def generate_cells(total_cells, ratio_5g, seed):
+    comuni = load_comuni()
+    rng = np.random.default_rng([seed, 0])
+    per_city = max(total_cells // len(comuni), 1)
+    five_g = int(per_city * ratio_5g)
+    ids, types, lats, lons, offsets = [], [], [], [], [0]
+    for comune in comuni:
+        city_lats, city_lons = scatter_points(comune["latitude"], comune["longitude"], 10, per_city, rng)
+        key = comune["name_en"].replace(" ", "_").replace("'", "")
+        for i in range(per_city):
+            is_5g = i >= per_city - five_g
+            ids.append(f"{'5G' if is_5g else 'TRAD'}_{key}_{i}")
+            types.append("5G" if is_5g else "traditional")
+        lats.append(city_lats)
+        lons.append(city_lons)
+        offsets.append(offsets[-1] + per_city)
+    return {"ids": np.array(ids, dtype=object), "types": types,
+            "latitudes": np.concatenate(lats), "longitudes": np.concatenate(lons),
+            "city_offsets": np.array(offsets, dtype=np.int64)}
+
+
+def choose_cells(rng, hours, weekday, home, work, city_start, city_size, cell_count):
+    # Per-session cell: mostly work during weekday office hours, mostly home otherwise,
+    # sometimes elsewhere in the same city and rarely anywhere in the country
+    office = (hours >= 9) & (hours < 18) & weekday
+    roll = rng.random(hours.shape)
+    p_primary = 0.6
+    p_secondary = np.where(office, 0.2, 0.1)
+    primary = np.where(office, work, home)
+    secondary = np.where(office, home, work)
+    roam = city_start + (rng.random(hours.shape) * city_size).astype(np.int64)
+    anywhere = rng.integers(0, cell_count, hours.shape)
+    return np.select(
+        [roll < p_primary, roll < p_primary + p_secondary, roll < 0.97],
+        [primary, secondary, roam],
+        anywhere
+    )
+
+
+def generate_shard(task):
+    shard = task["shard"]
+    out_dir, fmt = task["out_dir"], task["format"]
+    cells = task["cells"]
+    rng = np.random.default_rng([task["seed"], shard + 1])
+    fake = Faker("it_IT")
+    fake.seed_instance(task["seed"] * 100003 + shard)
+
+    cell_count = len(cells["ids"])
+    city_offsets = cells["city_offsets"]
+    cell_city = np.searchsorted(city_offsets, np.arange(cell_count), side="right") - 1
+    days, k = task["days"], task["sessions_per_day"]
+    first_day = np.datetime64(task["start_date"], "s")
+    day_starts = np.arange(days, dtype=np.int64) * DAY_SECONDS
+    weekdays = ((np.arange(days) + date.fromisoformat(task["start_date"]).weekday()) % 7) < 5
+
+    writers = {kind: ShardWriter(out_dir, kind, shard, fmt) for kind in ("people", "phones", "has_phone", "connected_to")}
+    max_duration = 0
+    try:
+        for chunk_start in range(task["first_person"], task["last_person"], task["chunk_size"]):
+            chunk_end = min(chunk_start + task["chunk_size"], task["last_person"])
+            people = np.arange(chunk_start, chunk_end)
+            n = len(people)
+            person_ids = [f"P{i}" for i in people]
+            phones = [phone_number(int(i)) for i in people]
+            writers["people"].write([person_ids, [fake.name() for _ in range(n)]])
+            writers["phones"].write([phones])
+            writers["has_phone"].write([person_ids, phones])
+
+            # Mobility: a home cell and a work cell in the same city
+            home = rng.integers(0, cell_count, n)
+            city = cell_city[home]
+            city_start = city_offsets[city]
+            city_size = city_offsets[city + 1] - city_start
+            work = city_start + (rng.random(n) * city_size).astype(np.int64)
+
+            # k sorted session starts per day between 06:00 and 24:00, consecutive per person
+            offsets = np.sort(rng.uniform(6 * 3600, DAY_SECONDS - k, (n, days, k)), axis=2).astype(np.int64) + np.arange(k)
+            starts = (offsets + day_starts[None, :, None]).reshape(n, days * k)
+            durations = np.clip(rng.exponential(30 * 60, starts.shape), 60, 10 * 3600).astype(np.int64)
+            # The last session of an evening often runs overnight, across midnight
+            last = np.zeros((days, k), dtype=bool)
+            last[:, -1] = True
+            last = np.broadcast_to(last.reshape(days * k), starts.shape)
+            overnight = last & (starts % DAY_SECONDS >= 20 * 3600) & (rng.random(starts.shape) < 0.5)
+            durations = np.where(overnight, rng.integers(4 * 3600, 10 * 3600, starts.shape), durations)
+            # Sessions of one phone never overlap
+            gaps = np.diff(starts, axis=1)
+            durations[:, :-1] = np.minimum(durations[:, :-1], np.maximum(gaps - 1, 1))
+            ends = starts + durations
+            max_duration = max(max_duration, int(durations.max()))
+
+            hours = (starts % DAY_SECONDS) // 3600
+            weekday = np.repeat(weekdays, k)[None, :]
+            session_cells = choose_cells(rng, hours, weekday, home[:, None], work[:, None],
+                                         city_start[:, None], city_size[:, None], cell_count)
+
+            start_at = first_day + starts.ravel().astype("timedelta64[s]")
+            end_at = first_day + ends.ravel().astype("timedelta64[s]")
+            connection_cells = cells["ids"][session_cells.ravel()].tolist()
+            writers["connected_to"].write([
+                np.repeat(np.array(phones, dtype=object), days * k).tolist(),
+                connection_cells,
+                connection_cells,
+                start_at,
+                end_at,
+            ])
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {kind: writer.rows for kind, writer in writers.items()}, max_duration
+
+
+def write_headers(out_dir):
+    for kind, header in HEADERS.items():
+        with open(os.path.join(out_dir, f"{kind}.header.csv"), "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(header)
+
+
+def write_cells(out_dir, cells, fmt):
+    writer = ShardWriter(out_dir, "cells", 0, fmt)
+    try:
+        lats, lons = cells["latitudes"].tolist(), cells["longitudes"].tolist()
+        writer.write([cells["ids"].tolist(), lats, lons, cells["types"],
+                      [f"{{latitude:{lat}, longitude:{lon}}}" for lat, lon in zip(lats, lons)]])
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def write_connection_stats(out_dir, max_duration, fmt):
+    # The ConnectionStats node the window queries read their lookback bound from
+    writer = ShardWriter(out_dir, "connection_stats", 0, fmt)
+    try:
+        writer.write([["CONNECTED_TO"], [max_duration]])
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def import_command(out_dir, fmt="csv"):
+    parts = ["neo4j-admin database import full"]
+    if fmt == "parquet":
+        parts.append("--input-type=parquet")
+    for flag, kind in IMPORT_LAYOUT:
+        files = sorted(f for f in os.listdir(out_dir) if f.startswith(f"{kind}.part-") and f.endswith(f".{fmt}"))
+        # Parquet files name their own columns; CSV shards need the shared header file first
+        headers = [f"{kind}.header.csv"] if fmt == "csv" else []
+        paths = [os.path.join(out_dir, name) for name in headers + files]
+        parts.append(f"{flag}={','.join(paths)}")
+    return " \\\n    ".join(parts)
+
+
+def generate_dataset(out_dir, people=10000, cells=1000, days=30, sessions_per_day=4, ratio_5g=0.3,
+                     shards=8, workers=None, seed=42, start_date="2024-01-01", fmt="csv", chunk_size=2000):
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.perf_counter()
+    cell_data = generate_cells(cells, ratio_5g, seed)
+    counts = {"cells": write_cells(out_dir, cell_data, fmt)}
+    if fmt == "csv":
+        write_headers(out_dir)
+
+    bounds = np.linspace(0, people, shards + 1).astype(np.int64)
+    tasks = [{"shard": shard, "first_person": int(bounds[shard]), "last_person": int(bounds[shard + 1]),
+              "cells": cell_data, "days": days, "sessions_per_day": sessions_per_day, "seed": seed,
+              "start_date": start_date, "out_dir": out_dir, "format": fmt, "chunk_size": chunk_size}
+             for shard in range(shards)]
+    max_duration = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard_counts, shard_max_duration in pool.map(generate_shard, tasks):
+            for kind, rows in shard_counts.items():
+                counts[kind] = counts.get(kind, 0) + rows
+            max_duration = max(max_duration, shard_max_duration)
+    counts["connection_stats"] = write_connection_stats(out_dir, max_duration, fmt)
+
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {counts.get('people', 0)} people, {counts['cells']} cells and "
+          f"{counts.get('connected_to', 0)} connections to {out_dir} in {elapsed:.1f}s "
+          f"({counts.get('connected_to', 0) / elapsed:.0f} connections/s).")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic CDR dataset as bulk-import files")
+    parser.add_argument("out_dir")
+    parser.add_argument("--people", type=int, default=10000)
+    parser.add_argument("--cells", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--sessions-per-day", type=int, default=4)
+    parser.add_argument("--ratio-5g", type=float, default=0.3)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start-date", default="2024-01-01")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="parquet needs pyarrow and a neo4j-admin that accepts --input-type=parquet")
+    args = parser.parse_args()
+
+    generate_dataset(args.out_dir, args.people, args.cells, args.days, args.sessions_per_day, args.ratio_5g,
+                     args.shards, args.workers, args.seed, args.start_date, args.format)
+    print(import_command(args.out_dir, args.format))
@@ -1,30 +1,127 @@
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 from neo4j.exceptions import ServiceUnavailable
 from functools import wraps
+import instrumentation
+import storage
 
 # Load environment variables from .env file
 load_dotenv()
 
+class DriverRegistry:
+    # One driver (and connection pool) per (uri, user), shared by every connector in the process
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drivers = {}
+        self._schema_checked = set()
+
+    def acquire(self, uri, user, password):
+        key = (uri, user)
+        with self._lock:
+            entry = self._drivers.get(key)
+            if entry is None:
+                entry = {"driver": GraphDatabase.driver(uri, auth=(user, password)), "refs": 0}
+                self._drivers[key] = entry
+            entry["refs"] += 1
+            return entry["driver"]
+
+    def release(self, uri, user):
+        key = (uri, user)
+        with self._lock:
+            entry = self._drivers.get(key)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] <= 0:
+                del self._drivers[key]
+                entry["driver"].close()
+
+    def claim_schema_check(self, uri, user):
+        # True only for the first caller per driver, so start-up schema checks run once
+        with self._lock:
+            if (uri, user) in self._schema_checked:
+                return False
+            self._schema_checked.add((uri, user))
+            return True
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._drivers.values())
+            self._drivers.clear()
+        for entry in entries:
+            entry["driver"].close()
+
+driver_registry = DriverRegistry()
+
 class Neo4jConnector:
     def __init__(self):
         self.driver = None
-        uri = os.getenv("NEO4J_URI")
-        user = os.getenv("NEO4J_USER")
+        self._local = threading.local()
+        # Per connector (one per app instance); also rolled up into instrumentation.process_stats
+        self.stats = instrumentation.QueryStats()
+        self.uri = os.getenv("NEO4J_URI")
+        self.user = os.getenv("NEO4J_USER")
         password = os.getenv("NEO4J_PASSWORD")
         
-        if not all([uri, user, password]):
+        if not all([self.uri, self.user, password]):
             raise ValueError("Missing Neo4j credentials in .env file")
         
         try:
-            self.driver = GraphDatabase.driver(uri, auth=(user, password))
+            self.driver = driver_registry.acquire(self.uri, self.user, password)
         except Exception as e:
             print(f"Failed to create the driver: {e}")
+
+        # Set NEO4J_ENSURE_SCHEMA=1 to create missing constraints/indexes on start-up
+        if self.driver is not None and os.getenv("NEO4J_ENSURE_SCHEMA") == "1" \
+                and driver_registry.claim_schema_check(self.uri, self.user):
+            from schema import ensure_schema
+            ensure_schema(self, verbose=False)
         
     def close(self):
         if self.driver is not None:
-            self.driver.close()
+            self.driver = None
+            driver_registry.release(self.uri, self.user)
+
+    @contextmanager
+    def session(self, **kwargs):
+        # Every execute_query issued inside the block (on this thread) runs on the same session
+        assert self.driver is not None, "Driver not initialized!"
+        current = getattr(self._local, "session", None)
+        if current is not None:
+            yield current
+            return
+        session = self.driver.session(**kwargs)
+        self._local.session = session
+        try:
+            yield session
+        finally:
+            self._local.session = None
+            session.close()
+
+    @contextmanager
+    def transaction(self, **kwargs):
+        # Unit of work: execute_query calls inside the block commit together or not at all
+        current = getattr(self._local, "transaction", None)
+        if current is not None:
+            yield current
+            return
+        with self.session(**kwargs) as session:
+            tx = session.begin_transaction()
+            self._local.transaction = tx
+            try:
+                yield tx
+                tx.commit()
+            except Exception:
+                tx.rollback()
+                raise
+            finally:
+                self._local.transaction = None
+                tx.close()
 
     def verify_connectivity(self):
         try:
@@ -35,20 +132,175 @@ class Neo4jConnector:
             print(f"Unable to connect to Neo4j database: {e}")
             return False
 
-    def execute_query(self, query, parameters=None):
+    def stream_query(self, query, parameters=None, fetch_size=1000, name=None):
+        # Yields records as the driver pulls them in fetch_size batches; nothing is buffered
+        # beyond one batch. Uses its own session so a slow consumer never blocks other queries.
+        assert self.driver is not None, "Driver not initialized!"
+        name = name or sys._getframe(1).f_code.co_name
+        rows = 0
+        error = False
+        started = time.perf_counter()
+        try:
+            with self.driver.session(fetch_size=fetch_size) as session:
+                for record in session.run(query, parameters):
+                    rows += 1
+                    yield record
+        except Exception as e:
+            error = True
+            print(f"Query failed: {e}")
+            raise
+        finally:
+            # Also runs when the consumer stops early (GeneratorExit, not an error). Includes
+            # the consumer's time between batches
+            instrumentation.record(self.stats, name, time.perf_counter() - started, rows, error=error)
+
+    def execute_query(self, query, parameters=None, name=None):
+        # name labels the statistics; it defaults to the calling method (e.g. get_phone_by_name)
         assert self.driver is not None, "Driver not initialized!"
+        name = name or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        tx = getattr(self._local, "transaction", None)
+        if tx is not None:
+            try:
+                records, query_type = self._run(tx, query, parameters)
+            except Exception as e:
+                instrumentation.record(self.stats, name, time.perf_counter() - started, error=True)
+                print(f"Query failed: {e}")
+                raise
+            self._observe(name, query, parameters, time.perf_counter() - started, records, query_type)
+            return records
+
+        bound_session = getattr(self._local, "session", None)
         session = None
         response = None
         try:
-            session = self.driver.session()
-            response = list(session.run(query, parameters))
+            session = bound_session or self.driver.session()
+            response, query_type = self._run(session, query, parameters)
         except Exception as e:
+            instrumentation.record(self.stats, name, time.perf_counter() - started, error=True)
             print(f"Query failed: {e}")
         finally:
-            if session is not None:
+            if session is not None and session is not bound_session:
                 session.close()
+        if response is not None:
+            self._observe(name, query, parameters, time.perf_counter() - started, response, query_type)
         return response
-    
+
+    def _run(self, runner, query, parameters):
+        result = runner.run(query, parameters)
+        records = list(result)
+        return records, result.consume().query_type
+
+    def _observe(self, name, query, parameters, seconds, records, query_type):
+        instrumentation.record(self.stats, name, seconds, len(records))
+        log = instrumentation.slow_query_log
+        if log.is_slow(seconds):
+            log.add(name, query, parameters, seconds, len(records),
+                    self._plan(query, parameters, query_type) if log.capture_plans else None)
+
+    def _plan(self, query, parameters, query_type):
+        # PROFILE re-executes the statement, so only read-only ones get db hits and rows
+        profile = query_type == "r"
+        try:
+            with self.driver.session() as session:
+                summary = session.run(("PROFILE " if profile else "EXPLAIN ") + query, parameters).consume()
+            return instrumentation.plan_summary(summary.profile if profile else summary.plan)
+        except Exception as e:
+            return {"error": str(e)}
+
+    def stats_snapshot(self):
+        return self.stats.snapshot()
+
+
+class AsyncNeo4jConnector:
+    # asyncio counterpart of Neo4jConnector. Every query gets its own session from the
+    # driver pool, so independent queries can run concurrently under asyncio.gather.
+    def __init__(self, max_connection_pool_size=None):
+        self.driver = None
+        self.stats = instrumentation.QueryStats()
+        self.uri = os.getenv("NEO4J_URI")
+        self.user = os.getenv("NEO4J_USER")
+        password = os.getenv("NEO4J_PASSWORD")
+
+        if not all([self.uri, self.user, password]):
+            raise ValueError("Missing Neo4j credentials in .env file")
+
+        options = {}
+        if max_connection_pool_size:
+            options["max_connection_pool_size"] = max_connection_pool_size
+        try:
+            self.driver = AsyncGraphDatabase.driver(self.uri, auth=(self.user, password), **options)
+        except Exception as e:
+            print(f"Failed to create the driver: {e}")
+
+    async def close(self):
+        if self.driver is not None:
+            driver, self.driver = self.driver, None
+            await driver.close()
+
+    async def verify_connectivity(self):
+        try:
+            await self.driver.verify_connectivity()
+            print("Connection to Neo4j database verified successfully!")
+            return True
+        except ServiceUnavailable as e:
+            print(f"Unable to connect to Neo4j database: {e}")
+            return False
+
+    async def stream_query(self, query, parameters=None, fetch_size=1000, name=None):
+        assert self.driver is not None, "Driver not initialized!"
+        name = name or sys._getframe(1).f_code.co_name
+        rows = 0
+        error = False
+        started = time.perf_counter()
+        try:
+            async with self.driver.session(fetch_size=fetch_size) as session:
+                result = await session.run(query, parameters)
+                async for record in result:
+                    rows += 1
+                    yield record
+        except Exception as e:
+            error = True
+            print(f"Query failed: {e}")
+            raise
+        finally:
+            instrumentation.record(self.stats, name, time.perf_counter() - started, rows, error=error)
+
+    async def execute_query(self, query, parameters=None, name=None):
+        # Same statistics and slow-query log as Neo4jConnector.execute_query
+        assert self.driver is not None, "Driver not initialized!"
+        name = name or sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        try:
+            async with self.driver.session() as session:
+                result = await session.run(query, parameters)
+                records = [record async for record in result]
+                query_type = (await result.consume()).query_type
+        except Exception as e:
+            instrumentation.record(self.stats, name, time.perf_counter() - started, error=True)
+            print(f"Query failed: {e}")
+            return None
+        seconds = time.perf_counter() - started
+        instrumentation.record(self.stats, name, seconds, len(records))
+        log = instrumentation.slow_query_log
+        if log.is_slow(seconds):
+            log.add(name, query, parameters, seconds, len(records),
+                    await self._plan(query, parameters, query_type) if log.capture_plans else None)
+        return records
+
+    async def _plan(self, query, parameters, query_type):
+        profile = query_type == "r"
+        try:
+            async with self.driver.session() as session:
+                result = await session.run(("PROFILE " if profile else "EXPLAIN ") + query, parameters)
+                summary = await result.consume()
+            return instrumentation.plan_summary(summary.profile if profile else summary.plan)
+        except Exception as e:
+            return {"error": str(e)}
+
+    def stats_snapshot(self):
+        return self.stats.snapshot()
+
 
 class DatabaseContextManager:
     def __init__(self, connector):
@@ -62,10 +314,14 @@ class DatabaseContextManager:
 
 def with_database(cls):
     class Wrapped(cls):
-        def __init__(self, *args, **kwargs):
-            connector = Neo4jConnector()
-            self.db_context = DatabaseContextManager(connector)
-            self.connector = connector  # Add this line
+        def __init__(self, *args, backend=None, **kwargs):
+            # Subclasses of an already wrapped class (e.g. CriminalTrackingApp) keep the first connector.
+            # backend: a storage.MemoryStore to run on instead of Neo4j, None to follow NEO4J_BACKEND
+            if not hasattr(self, "connector"):
+                store = storage.store_from_env() if backend is None else backend
+                connector = store.connector() if store is not None else Neo4jConnector()
+                self.db_context = DatabaseContextManager(connector)
+                self.connector = connector
             super().__init__(*args, **kwargs)
 
         def __enter__(self):
@@ -77,6 +333,24 @@ def with_database(cls):
 
     return Wrapped
 
+def with_async_database(cls):
+    class Wrapped(cls):
+        def __init__(self, *args, max_connection_pool_size=None, **kwargs):
+            if not hasattr(self, "connector"):
+                self.connector = AsyncNeo4jConnector(max_connection_pool_size)
+            super().__init__(*args, **kwargs)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            await self.connector.close()
+
+        async def close(self):
+            await self.connector.close()
+
+    return Wrapped
+
 # Example usage
 if __name__ == "__main__":
     connector = Neo4jConnector()
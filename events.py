@@ -0,0 +1,39 @@
+import threading
+import weakref
+
+# In-process notifications from the write paths (creation apps, DataCleaner) to the caches
+# and indexes built on top of the read layer.
+#   cells_changed        cell_ids=[...] or None for "any cell"
+#   connections_changed  phone_numbers=[...] or None for "any phone"
+#   people_changed       names=[...], phone_numbers=[...] or None for "anyone"
+CELLS_CHANGED = "cells_changed"
+CONNECTIONS_CHANGED = "connections_changed"
+PEOPLE_CHANGED = "people_changed"
+
+_lock = threading.Lock()
+_subscribers = {}
+
+
+def subscribe(topic, callback):
+    # Bound methods are held weakly, so a discarded app or cache stops receiving events
+    if hasattr(callback, "__self__"):
+        ref = weakref.WeakMethod(callback)
+    else:
+        ref = lambda: callback
+    with _lock:
+        _subscribers.setdefault(topic, []).append(ref)
+
+
+def publish(topic, **payload):
+    with _lock:
+        refs = list(_subscribers.get(topic, []))
+    dead = []
+    for ref in refs:
+        callback = ref()
+        if callback is None:
+            dead.append(ref)
+        else:
+            callback(**payload)
+    if dead:
+        with _lock:
+            _subscribers[topic] = [ref for ref in _subscribers.get(topic, []) if ref not in dead]
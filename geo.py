@@ -0,0 +1,36 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def km_per_degree_lon(latitude):
+    return KM_PER_DEGREE_LAT * np.maximum(np.cos(np.radians(latitude)), 1e-6)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # (min_lat, min_lon, max_lat, max_lon) enclosing the circle of radius_km around the point
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    # Longitude degrees shrink towards the poles, so size the box on its poleward edge
+    dlon = min(radius_km / km_per_degree_lon(min(abs(latitude) + dlat, 90.0)), 180.0)
+    return (float(max(latitude - dlat, -90.0)), float(max(longitude - dlon, -180.0)),
+            float(min(latitude + dlat, 90.0)), float(min(longitude + dlon, 180.0)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Great-circle distance; every argument may be a scalar or a NumPy array
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def scatter_points(latitude, longitude, radius_km, count, rng=None):
+    # count random points at a uniform distance (0..radius_km) and bearing from the centre,
+    # converting the km offsets to degrees with the local longitude scale. latitude/longitude
+    # may also be arrays of length count, one centre per point.
+    rng = rng if rng is not None else np.random.default_rng()
+    bearings = rng.uniform(0, 2 * np.pi, count)
+    distances = rng.uniform(0, radius_km, count)
+    latitudes = latitude + distances * np.cos(bearings) / KM_PER_DEGREE_LAT
+    longitudes = longitude + distances * np.sin(bearings) / km_per_degree_lon(latitude)
+    return latitudes, longitudes
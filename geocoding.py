@@ -0,0 +1,126 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+from cell_index import CellIndex
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "postal_police", "geocode.sqlite")
+# Bundled comune centroids; point COMUNI_CSV at a full dataset (same columns) for complete coverage
+DEFAULT_COMUNI_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "comuni.csv")
+
+MISSING = object()
+
+
+def load_comuni(path=None):
+    path = path or os.getenv("COMUNI_CSV") or DEFAULT_COMUNI_CSV
+    with open(path, newline="", encoding="utf-8") as f:
+        return [{"comune": row["comune"],
+                 "name_en": row.get("name_en") or row["comune"],
+                 "latitude": float(row["latitude"]),
+                 "longitude": float(row["longitude"])} for row in csv.DictReader(f)]
+
+
+class ReverseGeocodeCache:
+    # Persistent comune lookups keyed by coordinates rounded to `precision` decimals
+    # (3 decimals is ~100 m, finer than any cell). Negative answers are cached too.
+    # The least recently used entries are evicted once the table exceeds max_entries.
+    # The file is opened on first use. Hits only note their key; the last_used updates
+    # are written together every touch_interval seconds (and before evicting or closing),
+    # so reads don't each commit a write.
+    def __init__(self, path=None, max_entries=200000, precision=3, touch_interval=60):
+        self.path = path or os.getenv("GEOCODE_CACHE_PATH") or DEFAULT_CACHE_PATH
+        self.max_entries = max_entries
+        self.precision = precision
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = None
+        self._touched = {}
+        self._flushed = time.monotonic()
+
+    def _connect(self):
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS reverse_geocode ("
+                "lat REAL, lon REAL, radius REAL, comune TEXT, last_used REAL, "
+                "PRIMARY KEY (lat, lon, radius))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS reverse_geocode_last_used ON reverse_geocode (last_used)")
+            self._db.commit()
+        return self._db
+
+    def key(self, latitude, longitude, radius):
+        return round(latitude, self.precision), round(longitude, self.precision), float(radius)
+
+    def get(self, latitude, longitude, radius):
+        key = self.key(latitude, longitude, radius)
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT comune FROM reverse_geocode WHERE lat = ? AND lon = ? AND radius = ?", key
+            ).fetchone()
+            if row is None:
+                return MISSING
+            self._touched[key] = time.time()
+            if time.monotonic() - self._flushed >= self.touch_interval:
+                self._flush_touched()
+                self._db.commit()
+        return row[0]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE reverse_geocode SET last_used = ? WHERE lat = ? AND lon = ? AND radius = ?",
+                [(used, *key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed = time.monotonic()
+
+    def put(self, latitude, longitude, radius, comune):
+        key = self.key(latitude, longitude, radius)
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO reverse_geocode (lat, lon, radius, comune, last_used) VALUES (?, ?, ?, ?, ?)",
+                (*key, comune, time.time())
+            )
+            self._touched.pop(key, None)
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        self._flush_touched()
+        (count,) = self._db.execute("SELECT count(*) FROM reverse_geocode").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM reverse_geocode WHERE rowid IN "
+                "(SELECT rowid FROM reverse_geocode ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._flush_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+
+class OfflineComuneResolver:
+    # Nearest-centroid comune lookup against a local dataset, no network involved
+    def __init__(self, path=None, max_km=10):
+        self.max_km = max_km
+        comuni = load_comuni(path)
+        self.index = CellIndex(lambda: [{"id": c["comune"], "latitude": c["latitude"], "longitude": c["longitude"]}
+                                        for c in comuni], grid_degrees=0.25)
+
+    def resolve(self, latitude, longitude):
+        nearest = self.index.nearest(latitude, longitude, k=1)
+        if nearest and nearest[0][1] <= self.max_km:
+            return nearest[0][0]
+        return None
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Latency histograms, row counts and round-trip counters for the queries issued through
+# the connectors, plus a log of slow statements with their plans. Every connector keeps
+# its own QueryStats (so one app's round-trips can be counted) and also feeds
+# process_stats, the process-wide view that prometheus_text() exports.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.round_trips = 0
+            self.errors = 0
+            self._queries = {}
+
+    def record(self, name, seconds, rows=0, error=False):
+        with self._lock:
+            self.round_trips += 1
+            entry = self._queries.get(name)
+            if entry is None:
+                entry = self._queries[name] = {"count": 0, "errors": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                               "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+            entry["count"] += 1
+            entry["rows"] += rows
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["buckets"][_bucket(seconds)] += 1
+            if error:
+                entry["errors"] += 1
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            queries = {}
+            for name, entry in self._queries.items():
+                queries[name] = {
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "rows": entry["rows"],
+                    "total_seconds": entry["seconds"],
+                    "mean_ms": entry["seconds"] * 1000 / entry["count"],
+                    "max_ms": entry["max_seconds"] * 1000,
+                    "p50_ms": _quantile(entry["buckets"], entry["count"], 0.50),
+                    "p95_ms": _quantile(entry["buckets"], entry["count"], 0.95),
+                    "p99_ms": _quantile(entry["buckets"], entry["count"], 0.99),
+                    "histogram": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], entry["buckets"])),
+                }
+            return {"round_trips": self.round_trips, "errors": self.errors, "queries": queries}
+
+
+def _bucket(seconds):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def _quantile(buckets, count, q):
+    # Upper bound (ms) of the histogram bucket holding the q-quantile; None past the last bound
+    target = q * count
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= target:
+            return LATENCY_BUCKETS[i] * 1000 if i < len(LATENCY_BUCKETS) else None
+    return None
+
+
+class SlowQueryLog:
+    # Most recent statements slower than threshold_ms (NEO4J_SLOW_QUERY_MS; unset disables
+    # the log). With NEO4J_SLOW_QUERY_PROFILE=1 each entry also carries the plan: PROFILE
+    # (db hits, rows) for read-only statements, EXPLAIN for anything that writes, so that
+    # capturing a plan never applies a write twice.
+    def __init__(self, threshold_ms=None, capture_plans=None, max_entries=200):
+        if threshold_ms is None and os.getenv("NEO4J_SLOW_QUERY_MS"):
+            threshold_ms = float(os.getenv("NEO4J_SLOW_QUERY_MS"))
+        if capture_plans is None:
+            capture_plans = os.getenv("NEO4J_SLOW_QUERY_PROFILE") == "1"
+        self.threshold_ms = threshold_ms
+        self.capture_plans = capture_plans
+        self._lock = threading.Lock()
+        self.entries = deque(maxlen=max_entries)
+
+    def is_slow(self, seconds):
+        return self.threshold_ms is not None and seconds * 1000 >= self.threshold_ms
+
+    def add(self, name, query, parameters, seconds, rows, plan=None):
+        entry = {
+            "at": time.time(),
+            "name": name,
+            "ms": seconds * 1000,
+            "rows": rows,
+            "query": " ".join(query.split()),
+            "parameters": sorted(parameters or {}),
+            "plan": plan,
+        }
+        with self._lock:
+            self.entries.append(entry)
+        print(f"Slow query {name}: {entry['ms']:.0f} ms, {rows} rows")
+        return entry
+
+    def recent(self, limit=20):
+        with self._lock:
+            return list(self.entries)[-limit:]
+
+
+def plan_summary(plan, depth=0):
+    # Flattens a (profiled) plan dict into indented lines and sums its db hits
+    if not plan:
+        return {"total_db_hits": None, "operators": []}
+    args = plan.get("args", {})
+    db_hits = plan.get("dbHits", args.get("DbHits"))
+    rows = plan.get("rows", args.get("Rows"))
+    line = "  " * depth + plan.get("operatorType", "?").split("@")[0]
+    if rows is not None:
+        line += f" rows={rows}"
+    if db_hits is not None:
+        line += f" db_hits={db_hits}"
+    if args.get("Details"):
+        line += f" ({args['Details']})"
+    operators, total = [line], db_hits
+    for child in plan.get("children", []):
+        child_summary = plan_summary(child, depth + 1)
+        operators.extend(child_summary["operators"])
+        if child_summary["total_db_hits"] is not None:
+            total = (total or 0) + child_summary["total_db_hits"]
+    return {"total_db_hits": total, "operators": operators}
+
+
+process_stats = QueryStats()
+slow_query_log = SlowQueryLog()
+
+
+def record(stats, name, seconds, rows=0, error=False):
+    stats.record(name, seconds, rows, error)
+    if stats is not process_stats:
+        process_stats.record(name, seconds, rows, error)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(stats=None, prefix="neo4j"):
+    # Prometheus text exposition format of a QueryStats (process_stats by default)
+    snapshot = (stats or process_stats).snapshot()
+    lines = [
+        f"# HELP {prefix}_query_duration_seconds Query latency by query name.",
+        f"# TYPE {prefix}_query_duration_seconds histogram",
+    ]
+    for name, entry in sorted(snapshot["queries"].items()):
+        cumulative = 0
+        for bound, count in entry["histogram"].items():
+            cumulative += count
+            lines.append(f'{prefix}_query_duration_seconds_bucket{{query="{_label(name)}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_query_duration_seconds_sum{{query="{_label(name)}"}} {entry["total_seconds"]}')
+        lines.append(f'{prefix}_query_duration_seconds_count{{query="{_label(name)}"}} {entry["count"]}')
+    for metric, key, description in (("rows", "rows", "Rows returned"), ("errors", "errors", "Failed queries")):
+        lines.append(f"# HELP {prefix}_query_{metric}_total {description} by query name.")
+        lines.append(f"# TYPE {prefix}_query_{metric}_total counter")
+        for name, entry in sorted(snapshot["queries"].items()):
+            lines.append(f'{prefix}_query_{metric}_total{{query="{_label(name)}"}} {entry[key]}')
+    lines.append(f"# HELP {prefix}_round_trips_total Queries sent to the database.")
+    lines.append(f"# TYPE {prefix}_round_trips_total counter")
+    lines.append(f"{prefix}_round_trips_total {snapshot['round_trips']}")
+    lines.append(f"# HELP {prefix}_slow_queries Slow queries currently in the log.")
+    lines.append(f"# TYPE {prefix}_slow_queries gauge")
+    lines.append(f"{prefix}_slow_queries {len(slow_query_log.entries)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+class PhoneIntervals:
+    # One phone's connection history as parallel arrays sorted by start, plus the running
+    # maximum of the end times so a point probe can stop scanning backwards early.
+    def __init__(self, connections):
+        connections = sorted(connections, key=lambda c: c["start_at"])
+        self.starts = [c["start_at"] for c in connections]
+        self.ends = [c["end_at"] for c in connections]
+        self.cell_ids = [c["cell_id"] for c in connections]
+        self.latitudes = [c.get("latitude") for c in connections]
+        self.longitudes = [c.get("longitude") for c in connections]
+        self.max_ends = []
+        running = None
+        for end in self.ends:
+            running = end if running is None or end > running else running
+            self.max_ends.append(running)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def at(self, instant):
+        # Indexes of the intervals with start <= instant <= end, in start order
+        i = bisect_right(self.starts, instant) - 1
+        found = []
+        while i >= 0 and self.max_ends[i] >= instant:
+            if self.ends[i] >= instant:
+                found.append(i)
+            i -= 1
+        found.reverse()
+        return found
+
+
+class PhoneIntervalCache:
+    # LRU of PhoneIntervals bounded by the total number of cached intervals
+    def __init__(self, loader, max_intervals=500000):
+        self.loader = loader
+        self.max_intervals = max_intervals
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, phone_number):
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is not None:
+                self._entries.move_to_end(phone_number)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        entry = PhoneIntervals(self.loader(phone_number) or [])
+        if len(entry) > self.max_intervals:
+            return entry
+
+        with self._lock:
+            # An invalidation during the load may have dropped what it read; don't keep it
+            if generation != self._generation:
+                return entry
+            previous = self._entries.pop(phone_number, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[phone_number] = entry
+            self._size += len(entry)
+            while self._size > self.max_intervals and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return entry
+
+    def invalidate(self, phone_numbers=None, **changes):
+        with self._lock:
+            self._generation += 1
+            if phone_numbers is None:
+                self._entries.clear()
+                self._size = 0
+                return
+            for phone_number in phone_numbers:
+                entry = self._entries.pop(phone_number, None)
+                if entry is not None:
+                    self._size -= len(entry)
+
+    def stats(self):
+        with self._lock:
+            return {"phones": len(self._entries), "intervals": self._size,
+                    "hits": self.hits, "misses": self.misses}
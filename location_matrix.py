@@ -0,0 +1,50 @@
+import numpy as np
+
+NO_CELL = -1
+
+
+class LocationMatrix:
+    # Cells of many targets at many instants. codes[i, j] is the index in cell_ids of the
+    # cell target i was connected to at instants[j], or NO_CELL. Targets are names or phone
+    # numbers (labels); phone_numbers[i] is None for a name without a phone.
+    def __init__(self, labels, phone_numbers, instants, cell_ids=None, codes=None):
+        self.labels = list(labels)
+        self.phone_numbers = list(phone_numbers)
+        self.instants = list(instants)
+        self.cell_ids = list(cell_ids or [])
+        self._cell_codes = {cell_id: code for code, cell_id in enumerate(self.cell_ids)}
+        self._rows = {label: i for i, label in enumerate(self.labels)}
+        if codes is None:
+            codes = np.full((len(self.labels), len(self.instants)), NO_CELL, dtype=np.int32)
+        self.codes = codes
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def encode(self, cell_id):
+        code = self._cell_codes.get(cell_id)
+        if code is None:
+            code = len(self.cell_ids)
+            self._cell_codes[cell_id] = code
+            self.cell_ids.append(cell_id)
+        return code
+
+    def set(self, row, column, cell_id):
+        if self.codes[row, column] == NO_CELL:
+            self.codes[row, column] = self.encode(cell_id)
+
+    def cell_at(self, label, column):
+        code = self.codes[self._rows[label], column]
+        return self.cell_ids[code] if code != NO_CELL else None
+
+    def row(self, label):
+        return [self.cell_ids[code] if code != NO_CELL else None for code in self.codes[self._rows[label]]]
+
+    def found(self):
+        # (label, instant, cell_id) for every located cell, row by row
+        rows, columns = np.nonzero(self.codes != NO_CELL)
+        return [(self.labels[i], self.instants[j], self.cell_ids[self.codes[i, j]]) for i, j in zip(rows, columns)]
+
+    def to_dict(self):
+        return {label: self.row(label) for label in self.labels}
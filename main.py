@@ -1,25 +1,12 @@
 from criminal_tracking import CriminalTrackingApp
+from name_search import NameIndex
+import events
 from datetime import datetime, date, timedelta
-from fuzzywuzzy import process
-import re, random
+import random
 
-def fuzzy_match(query, choices, limit=5):
-    return process.extract(query, choices, limit=limit)
-
-def regex_match(pattern, choices):
-    regex = re.compile(pattern, re.IGNORECASE)
-    return [choice for choice in choices if regex.search(choice)]
-
-def get_best_matches(query, choices):
-    regex_matches = regex_match(query, choices)
-    if regex_matches:
-        return regex_matches[:25]  # Limit to 25 matches
-    else:
-        fuzzy_matches = fuzzy_match(query, choices, limit=25)  # Limit fuzzy matches to 25
-        return [match[0] for match in fuzzy_matches]
-    
 def main():
     with CriminalTrackingApp() as app:
+        people_index = NameIndex(app.get_all_people, topic=events.PEOPLE_CHANGED)
         while True:
             print("\nCriminal Tracking System")
             print("1. Find a suspect's location")
@@ -30,8 +17,7 @@ def main():
 
             if choice == '1':
                 name_query = input("Enter suspect's name (or part of the name, use regex for advanced search): ")
-                all_people = app.get_all_people()
-                matches = get_best_matches(name_query, all_people)
+                matches = people_index.search(name_query, limit=25)
                 if matches:
                     print("Matching names:")
                     for i, name in enumerate(matches, 1):
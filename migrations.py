@@ -0,0 +1,104 @@
+import argparse
+import time
+from db_connection import Neo4jConnector
+
+# Converts legacy string-typed CONNECTED_TO properties (start_date, start_time, end_date, end_time)
+# into native LocalDateTime start_at/end_at. Each batch commits on its own, so the migration can be
+# interrupted and re-run: it only ever picks up relationships that still carry the string fields.
+CONNECTION_DATETIME_BATCH = """
+MATCH ()-[r:CONNECTED_TO]->()
+WHERE r.start_date IS NOT NULL
+WITH r LIMIT $batch_size
+SET r.start_at = localdatetime(r.start_date + 'T' + r.start_time),
+    r.end_at = localdatetime(r.end_date + 'T' + r.end_time)
+REMOVE r.start_date, r.start_time, r.end_date, r.end_time
+RETURN count(r) AS migrated
+"""
+
+CELL_LOCATION_BATCH = """
+MATCH (c:Cell)
+WHERE c.location IS NULL AND c.latitude IS NOT NULL
+WITH c LIMIT $batch_size
+SET c.location = point({latitude: c.latitude, longitude: c.longitude})
+RETURN count(c) AS migrated
+"""
+
+# CONNECTED_TO.cell_id duplicates the target cell id so window queries can seek the
+# (cell_id, start_at) index instead of expanding every connection of the cell
+CONNECTION_CELL_ID_BATCH = """
+MATCH ()-[r:CONNECTED_TO]->(c:Cell)
+WHERE r.cell_id IS NULL
+WITH r, c LIMIT $batch_size
+SET r.cell_id = c.id
+RETURN count(r) AS migrated
+"""
+
+CONNECTION_STATS = """
+MATCH ()-[r:CONNECTED_TO]->()
+WITH max(duration.inSeconds(r.start_at, r.end_at).seconds) AS longest
+MERGE (s:ConnectionStats {name: 'CONNECTED_TO'})
+SET s.max_duration_seconds = CASE WHEN coalesce(s.max_duration_seconds, 0) < coalesce(longest, 0)
+    THEN coalesce(longest, 0) ELSE s.max_duration_seconds END
+RETURN s.max_duration_seconds AS max_duration_seconds
+"""
+
+PENDING_CONNECTIONS = """
+MATCH ()-[r:CONNECTED_TO]->()
+WHERE r.start_date IS NOT NULL
+RETURN count(r) AS pending
+"""
+
+
+def run_batched(connector, batch_query, batch_size, label):
+    total = 0
+    started = time.perf_counter()
+    while True:
+        result = connector.execute_query(batch_query, {"batch_size": batch_size})
+        if result is None:
+            print(f"{label}: batch failed after {total} rows, re-run to resume.")
+            break
+        done = result[0][0] if result else 0
+        if done == 0:
+            break
+        total += done
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {total} rows migrated ({total / elapsed:.0f} rows/s)")
+    return total
+
+
+def migrate_connection_datetimes(connector, batch_size=10000):
+    pending = connector.execute_query(PENDING_CONNECTIONS)
+    print(f"Connections still using string dates: {pending[0]['pending'] if pending else 'unknown'}")
+    return run_batched(connector, CONNECTION_DATETIME_BATCH, batch_size, "CONNECTED_TO start_at/end_at")
+
+
+def migrate_cell_locations(connector, batch_size=10000):
+    # Cells created before Cell.location existed need the point for the cell_location index
+    return run_batched(connector, CELL_LOCATION_BATCH, batch_size, "Cell location")
+
+
+def migrate_connection_cell_ids(connector, batch_size=10000):
+    return run_batched(connector, CONNECTION_CELL_ID_BATCH, batch_size, "CONNECTED_TO cell_id")
+
+
+def migrate_connection_stats(connector):
+    # Longest connection duration, the lookback bound of the window queries
+    result = connector.execute_query(CONNECTION_STATS)
+    longest = result[0]['max_duration_seconds'] if result else None
+    print(f"Longest connection: {longest} seconds")
+    return longest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate existing graph data to the current model")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    connector = Neo4jConnector()
+    try:
+        migrate_connection_datetimes(connector, args.batch_size)
+        migrate_cell_locations(connector, args.batch_size)
+        migrate_connection_cell_ids(connector, args.batch_size)
+        migrate_connection_stats(connector)
+    finally:
+        connector.close()
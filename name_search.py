@@ -0,0 +1,129 @@
+import re
+import threading
+import numpy as np
+from fuzzywuzzy import process
+import events
+
+REGEX_METACHARS = set(".^$*+?{}[]()|\\")
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern):
+    # Literal runs every match of the regex must contain; [] when that cannot be decided simply
+    if any(ch in pattern for ch in "|\\[](){}"):
+        return []
+    literals, current = [], ""
+    for ch in pattern:
+        if ch in "*?":
+            current = current[:-1]
+            literals.append(current)
+            current = ""
+        elif ch in ".^$+":
+            literals.append(current)
+            current = ""
+        else:
+            current += ch
+    literals.append(current)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def scan_matches(query, choices, limit=25):
+    # The original full scan over every name, kept as the baseline NameIndex is measured against
+    regex = re.compile(query, re.IGNORECASE)
+    matches = [choice for choice in choices if regex.search(choice)]
+    if matches:
+        return matches[:limit]
+    return [match[0] for match in process.extract(query, choices, limit=limit)]
+
+
+class NameIndex:
+    # Trigram inverted index over a list of names (people, cell IDs). Same ranking as
+    # scan_matches: regex/substring matches first, fuzzy matches as a fallback,
+    # but both only look at the candidates the trigram postings let through.
+    def __init__(self, loader, topic=None, fuzzy_candidates=250):
+        self.loader = loader
+        self.fuzzy_candidates = fuzzy_candidates
+        self._lock = threading.Lock()
+        self._stale = True
+        self.names = []
+        self._postings = {}
+        if topic is not None:
+            events.subscribe(topic, self.mark_stale)
+
+    def mark_stale(self, **changes):
+        self._stale = True
+
+    def refresh(self):
+        self.load(self.loader() or [])
+
+    def load(self, names):
+        names = list(dict.fromkeys(names))
+        postings = {}
+        for i, name in enumerate(names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(i)
+        postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+        with self._lock:
+            self.names = names
+            self._postings = postings
+            self._stale = False
+
+    def _ensure_loaded(self):
+        if self._stale:
+            self.refresh()
+
+    def _containing(self, literals):
+        # Ids of the names holding every trigram of every literal (a superset of the real matches)
+        grams = set().union(*(trigrams(literal) for literal in literals))
+        lists = sorted((self._postings.get(gram) for gram in grams), key=lambda ids: -1 if ids is None else len(ids))
+        if lists and lists[0] is None:
+            return np.empty(0, dtype=np.int64)
+        ids = lists[0]
+        for other in lists[1:]:
+            ids = np.intersect1d(ids, other, assume_unique=True)
+            if not len(ids):
+                break
+        return ids
+
+    def regex_matches(self, query, limit=25):
+        try:
+            regex = re.compile(query, re.IGNORECASE)
+        except re.error:
+            regex = re.compile(re.escape(query), re.IGNORECASE)
+            query = re.escape(query)
+        is_literal = not any(ch in REGEX_METACHARS for ch in query)
+        literals = [query] if is_literal and len(query) >= 3 else required_literals(query)
+        candidates = (self.names[i] for i in self._containing(literals)) if literals else iter(self.names)
+        matches = []
+        for name in candidates:
+            if regex.search(name):
+                matches.append(name)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def fuzzy_matches(self, query, limit=25):
+        grams = [self._postings[gram] for gram in trigrams(query) if gram in self._postings]
+        lowered = query.lower()
+        for size in (2, 1):
+            if grams:
+                break
+            # No shared trigram: score by the trigrams sharing a shorter gram with the query
+            shorter = {lowered[i:i + size] for i in range(len(lowered) - size + 1)}
+            grams = [ids for gram, ids in self._postings.items()
+                     if any(gram[j:j + size] in shorter for j in range(4 - size))]
+        if grams:
+            counts = np.bincount(np.concatenate(grams), minlength=len(self.names))
+            top = np.argsort(-counts, kind="stable")[:self.fuzzy_candidates]
+            choices = [self.names[i] for i in top if counts[i] > 0]
+        else:
+            choices = self.names[:self.fuzzy_candidates]
+        return [match[0] for match in process.extract(query, choices, limit=limit)]
+
+    def search(self, query, limit=25):
+        self._ensure_loaded()
+        return self.regex_matches(query, limit) or self.fuzzy_matches(query, limit)
@@ -1,22 +1,8 @@
 from criminal_tracking import CriminalTrackingApp
+from name_search import NameIndex
+import events
 from datetime import datetime, date, timedelta
-from fuzzywuzzy import process
-import re, random
-
-def fuzzy_match(query, choices, limit=5):
-    return process.extract(query, choices, limit=limit)
-
-def regex_match(pattern, choices):
-    regex = re.compile(pattern, re.IGNORECASE)
-    return [choice for choice in choices if regex.search(choice)]
-
-def get_best_matches(query, choices):
-    regex_matches = regex_match(query, choices)
-    if regex_matches:
-        return regex_matches[:25]  # Limit to 25 matches
-    else:
-        fuzzy_matches = fuzzy_match(query, choices, limit=25)  # Limit fuzzy matches to 25
-        return [match[0] for match in fuzzy_matches]
+import random
 
 def parse_flexible_date_time(date_input, time_input):
     # Parse date
@@ -57,6 +43,11 @@ def get_date_time_input():
             try:
                 start_date = parse_date(start_date_str)
                 end_date = parse_date(end_date_str)
+                if not start_date or not end_date:
+                    continue
+                if end_date < start_date:
+                    print("The range ends before it starts. Please try again.")
+                    continue
                 return (str(start_date), "00:00:00"), (str(end_date), "23:59:59")
             except ValueError:
                 print("Invalid date range format. Please try again.")
@@ -76,6 +67,20 @@ def get_date_time_input():
         
         return (str(date), str(time) if time else None)
 
+def get_time_window():
+    # get_date_time_input answers a (start, end) pair of (date, time) for ranges and whole
+    # days, or a single (date, time) instant
+    first, second = get_date_time_input()
+    if isinstance(first, tuple):
+        return first, second
+    return (first, second), (first, second)
+
+def describe_window(window):
+    (start_date, start_time), (end_date, end_time) = window
+    if (start_date, start_time) == (end_date, end_time):
+        return f"on {start_date} at {start_time}"
+    return f"from {start_date} {start_time} to {end_date} {end_time}"
+
 def parse_date(date_input):
     if date_input.lower() == 'today':
         return datetime.now().date()
@@ -104,6 +109,8 @@ def parse_time(time_input):
 
 def main():
     app = CriminalTrackingApp()
+    people_index = NameIndex(app.get_all_people, topic=events.PEOPLE_CHANGED)
+    cell_id_index = NameIndex(lambda: [cell['id'] for cell in app.get_all_cells()], topic=events.CELLS_CHANGED)
 
     while True:
         print("\nCriminal Tracking System")
@@ -118,8 +125,7 @@ def main():
 
         if choice == '1':
             name_query = input("Enter suspect's name (or part of the name, use regex for advanced search): ")
-            all_people = app.get_all_people()
-            matches = get_best_matches(name_query, all_people)
+            matches = people_index.search(name_query, limit=25)
             if matches:
                 print("Matching names:")
                 for i, name in enumerate(matches, 1):
@@ -140,8 +146,7 @@ def main():
             if date:
                 locations = app.find_person_location(name, date, time)
                 if locations:
-                    for lat, lon in locations:
-                        location_info = app.get_location_info(lat, lon)
+                    for location_info in app.get_locations_info(locations):
                         print(f"{name} was located {location_info} on {date} at {time or 'any time'}")
                 else:
                     print(f"No location found for {name} on {date} at {time or 'any time'}")
@@ -150,10 +155,8 @@ def main():
 
 
         elif choice == '2':
-            all_cells = app.get_all_cells()
-            cell_ids = [cell['id'] for cell in all_cells]
             cell_query = input("Enter cell ID (or part of it, use regex for advanced search): ")
-            matches = get_best_matches(cell_query, cell_ids)
+            matches = cell_id_index.search(cell_query, limit=25)
             if matches:
                 print("Matching cell IDs:")
                 for i, cell_id in enumerate(matches, 1):
@@ -167,9 +170,9 @@ def main():
                 print("No matching cell IDs found.")
                 continue
 
-            date, time = get_date_time_input()
-            suspects = app.find_suspects_in_cell(cell_id, date, time)
-            print(f"Suspects in cell {cell_id} on {date} at {time or 'any time'}:")
+            window = get_time_window()
+            suspects = app.find_suspects_in_cell(cell_id, window=window)
+            print(f"Suspects in cell {cell_id} {describe_window(window)}:")
             for name, phone in suspects:
                 print(f"- {name} (Phone: {phone})")
 
@@ -177,9 +180,9 @@ def main():
             lat = float(input("Enter latitude: "))
             lon = float(input("Enter longitude: "))
             radius = float(input("Enter search radius (km): "))
-            date, time = get_date_time_input()
-            suspects = app.find_suspects_near_location(lat, lon, date, time, radius)
-            print(f"Suspects within {radius}km of ({lat}, {lon}) on {date} at {time or 'any time'}:")
+            window = get_time_window()
+            suspects = app.find_suspects_near_location(lat, lon, radius=radius, window=window)
+            print(f"Suspects within {radius}km of ({lat}, {lon}) {describe_window(window)}:")
             for name, phone in suspects:
                 print(f"- {name} (Phone: {phone})")
 
@@ -0,0 +1,388 @@
+from datetime import datetime
+from geo import bounding_box
+from temporal import split_datetime, from_neo4j, time_window
+
+# Cypher and result shaping of the read layer, shared by the synchronous apps
+# (DataRetrievalApp, CriminalTrackingApp) and their asyncio versions in async_tracking,
+# so a query is only ever written (and fixed) once.
+
+# DataRetrievalApp
+
+PERSON_BY_PHONE = (
+    "MATCH (p:Person)-[:HAS_PHONE]->(ph:PhoneNumber {number: $phone_number}) "
+    "RETURN p.name AS name"
+)
+
+PHONE_BY_NAME = (
+    "MATCH (p:Person {name: $name})-[:HAS_PHONE]->(ph:PhoneNumber) "
+    "RETURN ph.number AS phone_number"
+)
+
+PHONES_BY_NAMES = """
+UNWIND $names AS name
+MATCH (p:Person {name: name})-[:HAS_PHONE]->(ph:PhoneNumber)
+RETURN name, collect(ph.number)[0] AS phone_number
+"""
+
+PEOPLE_BY_PHONES = """
+UNWIND $phone_numbers AS number
+MATCH (p:Person)-[:HAS_PHONE]->(ph:PhoneNumber {number: number})
+RETURN number AS phone_number, p.name AS name
+"""
+
+ALL_PEOPLE = "MATCH (p:Person) RETURN p.name AS name"
+
+PEOPLE_PHONES = """
+MATCH (p:Person)
+OPTIONAL MATCH (p)-[:HAS_PHONE]->(ph:PhoneNumber)
+RETURN p.name AS name, ph.number AS phone_number
+"""
+
+ALL_PHONE_NUMBERS = "MATCH (ph:PhoneNumber) RETURN ph.number AS number"
+
+ALL_CELLS = "MATCH (c:Cell) RETURN c.id AS id, c.latitude AS latitude, c.longitude AS longitude, c.type AS type"
+
+ALL_CONNECTIONS = """
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell)
+RETURN ph.number AS phone_number, c.id AS cell_id, r.start_at AS start_at, r.end_at AS end_at
+"""
+
+# Datetimes converted server-side
+CONNECTION_EPOCHS = """
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell)
+RETURN ph.number AS phone_number, c.id AS cell_id,
+    datetime({datetime: r.start_at, timezone: 'UTC'}).epochMillis AS start_ms,
+    datetime({datetime: r.end_at, timezone: 'UTC'}).epochMillis AS end_ms
+"""
+
+# Keyset pagination; `after` is the "next" cursor of the previous page
+PEOPLE_PAGE = """
+MATCH (p:Person)
+WHERE $after_name IS NULL OR p.name > $after_name
+    OR (p.name = $after_name AND elementId(p) > $after_id)
+RETURN p.name AS name, elementId(p) AS element_id
+ORDER BY p.name, element_id
+LIMIT $limit
+"""
+
+PHONE_NUMBERS_PAGE = """
+MATCH (ph:PhoneNumber)
+WHERE $after IS NULL OR ph.number > $after
+RETURN ph.number AS number
+ORDER BY ph.number
+LIMIT $limit
+"""
+
+CELLS_PAGE = """
+MATCH (c:Cell)
+WHERE $after IS NULL OR c.id > $after
+RETURN c.id AS id, c.latitude AS latitude, c.longitude AS longitude, c.type AS type
+ORDER BY c.id
+LIMIT $limit
+"""
+
+CONNECTIONS_PAGE = """
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->(c:Cell)
+WHERE $after_start IS NULL OR r.start_at > $after_start
+    OR (r.start_at = $after_start AND elementId(r) > $after_id)
+RETURN ph.number AS phone_number, c.id AS cell_id, r.start_at AS start_at, r.end_at AS end_at,
+    elementId(r) AS element_id
+ORDER BY r.start_at, element_id
+LIMIT $limit
+"""
+
+CONNECTIONS_BY_PHONE = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+RETURN c.id AS cell_id, r.start_at AS start_at, r.end_at AS end_at
+ORDER BY r.start_at
+"""
+
+CONNECTION_HISTORY = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+RETURN c.id AS cell_id, c.latitude AS latitude, c.longitude AS longitude,
+    r.start_at AS start_at, r.end_at AS end_at
+ORDER BY r.start_at
+"""
+
+CONNECTION_DATES = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->()
+RETURN DISTINCT date(r.start_at) AS start_date, date(r.end_at) AS end_date
+ORDER BY start_date, end_date
+"""
+
+CONNECTION_TIMES = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->()
+WHERE r.start_at < $day_end AND r.end_at >= $day_start
+RETURN localtime(r.start_at) AS start_time, localtime(r.end_at) AS end_time
+ORDER BY start_time, end_time
+"""
+
+CONNECTION_COORDINATES = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+WHERE r.start_at <= $at AND r.end_at >= $at
+RETURN c.latitude AS latitude, c.longitude AS longitude
+"""
+
+CELL_AT_TIME = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+WHERE r.start_at <= $at AND r.end_at >= $at
+RETURN c.id AS cell_id
+"""
+
+# CriminalTrackingApp
+
+# Window queries seek connections through the (cell_id, start_at) index. A connection
+# overlapping [start, end] started at most the longest connection duration before start,
+# which bounds the seek; without ConnectionStats (older data) it falls back to no bound.
+WINDOW_LOOKBACK = """
+OPTIONAL MATCH (stats:ConnectionStats {name: 'CONNECTED_TO'})
+WITH CASE WHEN stats.max_duration_seconds IS NULL THEN $earliest
+    ELSE $start - duration({seconds: stats.max_duration_seconds}) END AS lookback
+"""
+
+CELLS_NEAR = """
+MATCH (c:Cell)
+WHERE point.withinBBox(c.location,
+                       point({latitude: $min_lat, longitude: $min_lon}),
+                       point({latitude: $max_lat, longitude: $max_lon}))
+WITH c, point.distance(c.location, point({latitude: $latitude, longitude: $longitude})) AS dist
+WHERE dist <= $radius_m
+RETURN c.id AS cell_id
+ORDER BY dist
+"""
+
+# Each phone's connections are expanded once for all instants
+LOCATE_PHONES = """
+UNWIND $phone_numbers AS number
+MATCH (ph:PhoneNumber {number: number})-[r:CONNECTED_TO]->(c:Cell)
+WHERE r.start_at <= $last AND r.end_at >= $first
+UNWIND [i IN range(0, size($instants) - 1) WHERE r.start_at <= $instants[i] AND r.end_at >= $instants[i]] AS i
+RETURN number AS phone_number, i AS column, c.id AS cell_id
+"""
+
+WINDOW_HISTORY = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+WHERE r.start_at <= $end AND r.end_at >= $start
+RETURN c.id AS cell_id, c.latitude AS latitude, c.longitude AS longitude,
+    r.start_at AS start_at, r.end_at AS end_at
+"""
+
+CELL_WINDOW_CONNECTIONS = WINDOW_LOOKBACK + """
+UNWIND $cell_ids AS cell_id
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->()
+WHERE r.cell_id = cell_id AND r.start_at >= lookback AND r.start_at <= $end AND r.end_at >= $start
+    AND ph.number <> $phone_number
+RETURN cell_id, ph.number AS phone_number, r.start_at AS start_at, r.end_at AS end_at
+"""
+
+TRAJECTORY = """
+MATCH (ph:PhoneNumber {number: $phone_number})-[r:CONNECTED_TO]->(c:Cell)
+WHERE ($start IS NULL OR r.end_at >= $start) AND ($end IS NULL OR r.start_at <= $end)
+RETURN c.id AS cell_id, c.latitude AS latitude, c.longitude AS longitude,
+    datetime({datetime: r.start_at, timezone: 'UTC'}).epochMillis AS start_ms,
+    datetime({datetime: r.end_at, timezone: 'UTC'}).epochMillis AS end_ms
+ORDER BY start_ms
+"""
+
+SUSPECTS_IN_CELL = WINDOW_LOOKBACK + """
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->()
+WHERE r.cell_id = $cell_id AND r.start_at >= lookback AND r.start_at <= $end AND r.end_at >= $start
+MATCH (p:Person)-[:HAS_PHONE]->(ph)
+RETURN DISTINCT p.name AS name, ph.number AS phone_number
+"""
+
+SUSPECTS_IN_CELLS = WINDOW_LOOKBACK + """
+UNWIND $cell_ids AS cell_id
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->()
+WHERE r.cell_id = cell_id AND r.start_at >= lookback AND r.start_at <= $end AND r.end_at >= $start
+MATCH (p:Person)-[:HAS_PHONE]->(ph)
+RETURN DISTINCT p.name AS name, ph.number AS phone_number
+"""
+
+# Narrows to the cells inside the bounding box (served by the cell_location point index),
+# keeps the ones within the exact radius, and only then seeks their connections
+SUSPECTS_NEAR_LOCATION = WINDOW_LOOKBACK + """
+MATCH (c:Cell)
+WHERE point.withinBBox(c.location,
+                       point({latitude: $min_lat, longitude: $min_lon}),
+                       point({latitude: $max_lat, longitude: $max_lon}))
+AND point.distance(c.location, point({latitude: $latitude, longitude: $longitude})) <= $radius_m
+MATCH (ph:PhoneNumber)-[r:CONNECTED_TO]->()
+WHERE r.cell_id = c.id AND r.start_at >= lookback AND r.start_at <= $end AND r.end_at >= $start
+MATCH (p:Person)-[:HAS_PHONE]->(ph)
+RETURN DISTINCT p.name AS name, ph.number AS phone_number
+"""
+
+# UserCreationApp
+
+CREATE_PERSON = "CREATE (p:Person {name: $name}) RETURN p"
+
+ADD_PHONE_NUMBER = (
+    "MATCH (p:Person {name: $name}) "
+    "CREATE (p)-[:HAS_PHONE]->(ph:PhoneNumber {number: $phone_number}) "
+    "RETURN p, ph"
+)
+
+CREATE_PEOPLE_BATCH = (
+    "UNWIND $rows AS row "
+    "CREATE (p:Person {name: row.name})-[:HAS_PHONE]->(:PhoneNumber {number: row.phone_number}) "
+    "RETURN count(p) AS created"
+)
+
+# CellCreationApp
+
+CREATE_CELL = (
+    "CREATE (c:Cell {id: $cell_id, latitude: $latitude, longitude: $longitude, type: $cell_type, "
+    "location: point({latitude: $latitude, longitude: $longitude})}) "
+    "RETURN c"
+)
+
+CREATE_CELLS_BATCH = (
+    "UNWIND $rows AS row "
+    "CREATE (c:Cell {id: row.id, latitude: row.latitude, longitude: row.longitude, type: row.type, "
+    "location: point({latitude: row.latitude, longitude: row.longitude})}) "
+    "RETURN count(c) AS created"
+)
+
+# ConnectionCreationApp
+
+WIDEN_MAX_DURATION = (
+    "MERGE (s:ConnectionStats {name: 'CONNECTED_TO'}) "
+    "SET s.max_duration_seconds = CASE WHEN coalesce(s.max_duration_seconds, 0) < $seconds "
+    "THEN $seconds ELSE s.max_duration_seconds END "
+    "RETURN s.max_duration_seconds AS max_duration_seconds"
+)
+
+CONNECT_PHONE_TO_CELL = (
+    "MATCH (ph:PhoneNumber {number: $phone_number}), (c:Cell {id: $cell_id}) "
+    "CREATE (ph)-[r:CONNECTED_TO {cell_id: $cell_id, start_at: $start_at, end_at: $end_at}]->(c) "
+    "RETURN count(r) AS created"
+)
+
+CONNECT_PHONES_TO_CELLS_BATCH = (
+    "UNWIND $rows AS row "
+    "MATCH (ph:PhoneNumber {number: row.phone_number}), (c:Cell {id: row.cell_id}) "
+    "CREATE (ph)-[r:CONNECTED_TO {cell_id: row.cell_id, start_at: row.start_at, end_at: row.end_at}]->(c) "
+    "RETURN count(r) AS created"
+)
+
+ALL_CELL_IDS = "MATCH (c:Cell) RETURN c.id AS id"
+
+# DataCleaner: every delete is a MATCH, counted on a dry run and otherwise deleted in
+# batches of $batch_size
+
+PHONE_NUMBER_NODES = "p:PhoneNumber"
+PERSON_NODES = "p:Person"
+CELL_NODES = "c:Cell"
+TRADITIONAL_CELL_NODES = "c:Cell {type: 'traditional'}"
+FIVE_G_CELL_NODES = "c:Cell {type: '5G'}"
+CONNECTION_STATS_NODES = "s:ConnectionStats"
+
+COUNT_ENTITIES = """
+CALL { MATCH (p:Person) RETURN count(p) AS people }
+CALL { MATCH (ph:PhoneNumber) RETURN count(ph) AS phone_numbers }
+CALL { MATCH (c:Cell {type: 'traditional'}) RETURN count(c) AS traditional_cells }
+CALL { MATCH (c:Cell {type: '5G'}) RETURN count(c) AS five_g_cells }
+CALL { MATCH ()-[r:CONNECTED_TO]->() RETURN count(r) AS connections }
+RETURN people, phone_numbers, traditional_cells, five_g_cells, connections
+"""
+
+
+def connections_match(before=False, after=False):
+    # Connections that ended before $before / started at or after $after
+    conditions = (["r.end_at < $before"] if before else []) + (["r.start_at >= $after"] if after else [])
+    match = "MATCH ()-[r:CONNECTED_TO]->()"
+    return match + " WHERE " + " AND ".join(conditions) if conditions else match
+
+
+def node_matches(node):
+    # (match, variable) of the node's outgoing relationships, its incoming ones and the nodes
+    return [(f"MATCH ({node})-[r]->()", "r"), (f"MATCH ()-[r]->({node})", "r"),
+            (f"MATCH ({node})", node.split(":")[0])]
+
+
+def count_query(match, variable):
+    return f"{match} RETURN count({variable}) AS count"
+
+
+def delete_batch_query(match, variable, detach):
+    delete = "DETACH DELETE" if detach else "DELETE"
+    return f"{match} WITH {variable} LIMIT $batch_size {delete} {variable} RETURN count(*) AS deleted"
+
+
+def window_parameters(date=None, time=None, window=None):
+    start, end = time_window(date, time, window)
+    return {"start": start, "end": end, "earliest": datetime.min}
+
+
+def near_parameters(latitude, longitude, radius):
+    min_lat, min_lon, max_lat, max_lon = bounding_box(latitude, longitude, radius)
+    return {"latitude": latitude, "longitude": longitude,
+            "min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon,
+            "radius_m": radius * 1000}
+
+
+def cell_row(record):
+    return {"id": record["id"], "latitude": record["latitude"], "longitude": record["longitude"], "type": record["type"]}
+
+
+def connection_row(record, **fields):
+    start_date, start_time = split_datetime(record["start_at"])
+    end_date, end_time = split_datetime(record["end_at"])
+    return {**fields,
+            "start_date": start_date,
+            "start_time": start_time,
+            "end_date": end_date,
+            "end_time": end_time}
+
+
+def history_row(record):
+    return {"cell_id": record["cell_id"],
+            "latitude": record["latitude"],
+            "longitude": record["longitude"],
+            "start_at": from_neo4j(record["start_at"]),
+            "end_at": from_neo4j(record["end_at"])}
+
+
+def people_page(result, limit):
+    items = [record['name'] for record in result]
+    next_cursor = (result[-1]['name'], result[-1]['element_id']) if len(result) == limit else None
+    return {"items": items, "next": next_cursor}
+
+
+def phone_numbers_page(result, limit):
+    items = [record['number'] for record in result]
+    return {"items": items, "next": items[-1] if len(items) == limit else None}
+
+
+def cells_page(result, limit):
+    items = [cell_row(record) for record in result]
+    return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
+
+
+def connections_page(result, limit):
+    items = [connection_row(record, phone_number=record["phone_number"], cell_id=record["cell_id"])
+             for record in result]
+    next_cursor = (from_neo4j(result[-1]['start_at']), result[-1]['element_id']) if len(result) == limit else None
+    return {"items": items, "next": next_cursor}
+
+
+def date_pairs(result):
+    return [(str(from_neo4j(record['start_date'])), str(from_neo4j(record['end_date']))) for record in result]
+
+
+def time_pairs(result):
+    return [(str(from_neo4j(record['start_time'])), str(from_neo4j(record['end_time']))) for record in result]
+
+
+def suspects(result):
+    return [(record['name'], record['phone_number']) for record in result or []]
+
+
+def window_connections(result):
+    # {cell_id: [(phone_number, start_at, end_at)]}
+    by_cell = {}
+    for record in result or []:
+        by_cell.setdefault(record['cell_id'], []).append(
+            (record['phone_number'], from_neo4j(record['start_at']), from_neo4j(record['end_at'])))
+    return by_cell
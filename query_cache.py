@@ -0,0 +1,269 @@
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import events
+
+# Read-through cache for DataRetrievalApp. Every entry carries entity tags:
+#   person:<name>  phone:<number>  cell:<id>  connections:<phone number>
+# or <kind>:list for whole collections, plus the wildcard <kind>:* on everything of
+# that kind. The events published by the write paths drop exactly the entries of the
+# entities they name (and the collections containing them); a None payload
+# ("anything may have changed") drops the whole kind.
+
+DEFAULT_SHARED_PATH = os.path.join(os.path.expanduser("~"), ".cache", "postal_police", "query_cache.sqlite")
+
+MISSING = object()
+
+
+def entity_tags(kind, key):
+    return [f"{kind}:*", f"{kind}:{key}"]
+
+
+def list_tags(kind):
+    return [f"{kind}:*", f"{kind}:list"]
+
+
+def changed_tags(kind, keys):
+    if keys is None:
+        return [f"{kind}:*"]
+    keys = list(keys)
+    return [f"{kind}:{key}" for key in keys] + ([f"{kind}:list"] if keys else [])
+
+
+class MemoryCache:
+    # In-process LRU with a per-entry TTL
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires, _ = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, tags):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set().union(*(self._tags.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+
+class SqliteCache:
+    # Cache file shared by every process on the machine (Streamlit workers, CLI scripts).
+    # An invalidation in any process is seen by all of them.
+    def __init__(self, path=None, ttl=300, max_entries=100000):
+        self.path = path or os.getenv("QUERY_CACHE_PATH") or DEFAULT_SHARED_PATH
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS query_cache_tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS query_cache_tags_key ON query_cache_tags (key)")
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM query_cache").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM query_cache WHERE key = ?", (repr(key),)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return pickle.loads(row[0])
+
+    def put(self, key, value, tags):
+        key = repr(key)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO query_cache (key, value, expires) VALUES (?, ?, ?)",
+                             (key, pickle.dumps(value), time.time() + self.ttl))
+            self._db.execute("DELETE FROM query_cache_tags WHERE key = ?", (key,))
+            self._db.executemany("INSERT OR IGNORE INTO query_cache_tags (tag, key) VALUES (?, ?)",
+                                 [(tag, key) for tag in tags])
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        now = time.time()
+        self._db.execute("DELETE FROM query_cache WHERE expires < ?", (now,))
+        (count,) = self._db.execute("SELECT count(*) FROM query_cache").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM query_cache WHERE key IN (SELECT key FROM query_cache ORDER BY expires LIMIT ?)",
+                (count - self.max_entries,)
+            )
+        self._db.execute("DELETE FROM query_cache_tags WHERE key NOT IN (SELECT key FROM query_cache)")
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        placeholders = ",".join("?" * len(tags))
+        with self._lock:
+            keys = f"SELECT key FROM query_cache_tags WHERE tag IN ({placeholders})"
+            removed = self._db.execute(f"DELETE FROM query_cache WHERE key IN ({keys})", tags).rowcount
+            self._db.execute(f"DELETE FROM query_cache_tags WHERE key IN ({keys})", tags)
+            self._db.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM query_cache")
+            self._db.execute("DELETE FROM query_cache_tags")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class QueryCache:
+    # Front of a backend (MemoryCache or SqliteCache): counts hits/misses per operation
+    # and turns write events into tag invalidations
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.invalidations = 0
+        self._generation = 0
+        events.subscribe(events.PEOPLE_CHANGED, self.on_people_changed)
+        events.subscribe(events.CELLS_CHANGED, self.on_cells_changed)
+        events.subscribe(events.CONNECTIONS_CHANGED, self.on_connections_changed)
+
+    def get_or_load(self, operation, args, tags, loader):
+        key = (operation, args)
+        value = self.backend.get(key)
+        with self._lock:
+            counter = self.misses if value is MISSING else self.hits
+            counter[operation] = counter.get(operation, 0) + 1
+        if value is MISSING:
+            generation = self._generation
+            value = loader()
+            # None also means "query failed" for execute_query; never cache it. Nor a value
+            # loaded while an invalidation ran, it may predate the write.
+            if value is not None and generation == self._generation:
+                self.backend.put(key, value, tags)
+        return value
+
+    def invalidate(self, tags):
+        if not tags:
+            return 0
+        with self._lock:
+            self._generation += 1
+        removed = self.backend.invalidate(tags)
+        with self._lock:
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        self.backend.clear()
+
+    def on_people_changed(self, names=None, phone_numbers=None, **changes):
+        self.invalidate(changed_tags("person", names) + changed_tags("phone", phone_numbers))
+
+    def on_cells_changed(self, cell_ids=None, **changes):
+        self.invalidate(changed_tags("cell", cell_ids))
+
+    def on_connections_changed(self, phone_numbers=None, **changes):
+        self.invalidate(changed_tags("connections", phone_numbers))
+
+    def stats(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            operations = sorted(set(self.hits) | set(self.misses))
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": len(self.backend),
+                "invalidations": self.invalidations,
+                "operations": {operation: {"hits": self.hits.get(operation, 0), "misses": self.misses.get(operation, 0)}
+                               for operation in operations},
+            }
+
+
+def cached(tags):
+    # Method decorator: tags(*args) -> list of tags for the entry. A no-op unless the
+    # instance has a query_cache.
+    def decorate(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, "query_cache", None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = tuple(bound.arguments.values())[1:]
+            return cache.get_or_load(method.__name__, arguments, tags(*arguments), lambda: method(self, *arguments))
+        return wrapper
+    return decorate
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def cache_from_env():
+    # QUERY_CACHE=memory|sqlite (QUERY_CACHE_TTL seconds, QUERY_CACHE_PATH for sqlite);
+    # one instance per process, so writers and readers in the same process share it
+    kind = os.getenv("QUERY_CACHE", "").lower()
+    if kind not in ("memory", "sqlite"):
+        return None
+    with _shared_lock:
+        if kind not in _shared:
+            ttl = float(os.getenv("QUERY_CACHE_TTL", "300"))
+            backend = SqliteCache(ttl=ttl) if kind == "sqlite" else MemoryCache(ttl=ttl)
+            _shared[kind] = QueryCache(backend)
+        return _shared[kind]
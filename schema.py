@@ -0,0 +1,155 @@
+import argparse
+from datetime import datetime
+
+CONSTRAINTS = {
+    "phone_number_unique": "CREATE CONSTRAINT phone_number_unique IF NOT EXISTS FOR (ph:PhoneNumber) REQUIRE ph.number IS UNIQUE",
+    "cell_id_unique": "CREATE CONSTRAINT cell_id_unique IF NOT EXISTS FOR (c:Cell) REQUIRE c.id IS UNIQUE",
+    "connection_stats_name_unique": "CREATE CONSTRAINT connection_stats_name_unique IF NOT EXISTS FOR (s:ConnectionStats) REQUIRE s.name IS UNIQUE",
+}
+
+INDEXES = {
+    "person_name": "CREATE INDEX person_name IF NOT EXISTS FOR (p:Person) ON (p.name)",
+    "cell_type": "CREATE INDEX cell_type IF NOT EXISTS FOR (c:Cell) ON (c.type)",
+    "cell_location": "CREATE POINT INDEX cell_location IF NOT EXISTS FOR (c:Cell) ON (c.location)",
+    "connected_to_start_at": "CREATE INDEX connected_to_start_at IF NOT EXISTS FOR ()-[r:CONNECTED_TO]-() ON (r.start_at)",
+    "connected_to_end_at": "CREATE INDEX connected_to_end_at IF NOT EXISTS FOR ()-[r:CONNECTED_TO]-() ON (r.end_at)",
+    # Window queries: equality on the cell, range on the start
+    "connected_to_cell_start": "CREATE INDEX connected_to_cell_start IF NOT EXISTS FOR ()-[r:CONNECTED_TO]-() ON (r.cell_id, r.start_at)",
+}
+
+# Indexes over the string-typed connection properties replaced by CONNECTED_TO.start_at/end_at
+OBSOLETE_INDEXES = ["connected_to_start_date", "connected_to_end_date"]
+
+# Representative calls used to EXPLAIN every query of the read layer
+SAMPLE_PHONE = "3000000000"
+SAMPLE_DATE = "2024-01-01"
+SAMPLE_TIME = "12:00:00"
+QUERY_SAMPLES = [
+    ("get_person_by_phone", (SAMPLE_PHONE,)),
+    ("get_phone_by_name", ("Mario Rossi",)),
+    ("get_people_by_phones", ([SAMPLE_PHONE, "3000000001"],)),
+    ("get_phones_by_names", (["Mario Rossi", "Giulia Bianchi"],)),
+    ("get_all_people", ()),
+    ("get_all_phone_numbers", ()),
+    ("get_all_cells", ()),
+    ("get_all_connections", ()),
+    ("export_connections_columnar", ()),
+    ("export_people_columnar", ()),
+    ("get_people_page", (("Mario Rossi", "4:0:0"), 100)),
+    ("get_cells_page", ("TRAD_Rome_0", 100)),
+    ("get_connections_page", ((datetime(2024, 1, 1, 12), "5:0:0"), 100)),
+    ("get_connections_by_phone", (SAMPLE_PHONE,)),
+    ("get_connection_history", (SAMPLE_PHONE,)),
+    ("get_connection_dates", (SAMPLE_PHONE,)),
+    ("get_connection_times", (SAMPLE_PHONE, SAMPLE_DATE)),
+    ("get_connection_coordinates", (SAMPLE_PHONE, SAMPLE_DATE, SAMPLE_TIME)),
+    ("get_cell_for_person_at_time", (SAMPLE_PHONE, SAMPLE_DATE, SAMPLE_TIME)),
+    ("find_suspects_in_cell", ("TRAD_Rome_0", SAMPLE_DATE, SAMPLE_TIME)),
+    ("find_suspects_near_location", (41.9028, 12.4964, SAMPLE_DATE, SAMPLE_TIME, 5)),
+    ("find_cells_near", (41.9028, 12.4964, 5)),
+    ("find_suspects_in_cells", (["TRAD_Rome_0", "5G_Rome_0"], SAMPLE_DATE, SAMPLE_TIME)),
+    ("find_suspects_in_cell", ("TRAD_Rome_0", SAMPLE_DATE)),
+    ("find_suspects_in_cell", ("TRAD_Rome_0", None, None, (datetime(2024, 1, 1), datetime(2024, 1, 8)))),
+    ("find_colocated_phones", (SAMPLE_PHONE, datetime(2024, 1, 1), datetime(2024, 1, 8))),
+    ("get_trajectory", (SAMPLE_PHONE, datetime(2024, 1, 1), datetime(2024, 1, 8))),
+    ("locate_phones_at", ([SAMPLE_PHONE, "3000000001"], [datetime(2024, 1, 1, 9), datetime(2024, 1, 1, 18)])),
+]
+
+
+def ensure_schema(connector, verbose=True):
+    for name in OBSOLETE_INDEXES:
+        with connector.driver.session() as session:
+            session.run(f"DROP INDEX {name} IF EXISTS").consume()
+
+    created = []
+    for name, statement in {**CONSTRAINTS, **INDEXES}.items():
+        try:
+            with connector.driver.session() as session:
+                session.run(statement).consume()
+            created.append(name)
+        except Exception as e:
+            # e.g. duplicated phone numbers left over from older data generators
+            print(f"Could not create {name}: {e}")
+    if verbose:
+        print(f"Schema ready: {len(created)} of {len(CONSTRAINTS) + len(INDEXES)} constraints/indexes in place.")
+    return created
+
+
+def _index_operators(plan):
+    if not plan:
+        return []
+    found = []
+    operator = plan.get("operatorType", "")
+    if "Index" in operator:
+        details = plan.get("args", {}).get("Details", "")
+        found.append(f"{operator.split('@')[0]}: {details}".rstrip(": "))
+    for child in plan.get("children", []):
+        found.extend(_index_operators(child))
+    return found
+
+
+class ExplainConnector:
+    # Stands in for Neo4jConnector: plans each query with EXPLAIN instead of running it
+    def __init__(self, connector):
+        self.connector = connector
+        self.plans = []
+
+    def execute_query(self, query, parameters=None):
+        with self.connector.driver.session() as session:
+            summary = session.run("EXPLAIN " + query, parameters).consume()
+        self.plans.append(summary.plan)
+        return []
+
+    def stream_query(self, query, parameters=None, fetch_size=1000):
+        return iter(self.execute_query(query, parameters))
+
+
+def report_index_usage(app, samples=QUERY_SAMPLES):
+    report = {}
+    original = app.connector
+    # EXPLAIN returns no rows: keep them out of (and never answer from) the query cache
+    cache = getattr(app, "query_cache", None)
+    app.query_cache = None
+    try:
+        for method_name, args in samples:
+            method = getattr(app, method_name, None)
+            if method is None:
+                continue
+            explain = ExplainConnector(original)
+            app.connector = explain
+            try:
+                method(*args)
+            except Exception as e:
+                print(f"Could not plan {method_name}: {e}")
+            finally:
+                app.connector = original
+            report[method_name] = [index for plan in explain.plans for index in _index_operators(plan)]
+    finally:
+        app.connector = original
+        app.query_cache = cache
+    return report
+
+
+def print_index_report(report):
+    for method_name, indexes in report.items():
+        print(f"{method_name}:")
+        if indexes:
+            for index in indexes:
+                print(f"  - {index}")
+        else:
+            print("  - no index used (label/relationship scan)")
+
+
+if __name__ == "__main__":
+    from criminal_tracking import CriminalTrackingApp
+
+    parser = argparse.ArgumentParser(description="Create the constraints and indexes used by the query layer")
+    parser.add_argument("--report", action="store_true", help="show which indexes each query uses")
+    parser.add_argument("--skip-create", action="store_true", help="only report, do not create anything")
+    args = parser.parse_args()
+
+    with CriminalTrackingApp() as app:
+        if not args.skip_create:
+            ensure_schema(app.connector)
+        if args.report or args.skip_create:
+            print_index_report(report_index_usage(app))
@@ -0,0 +1,660 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import events
+import instrumentation
+import queries
+from cell_index import CellIndex
+from columnar_export import DictionaryEncoder, load_snapshot
+from temporal import to_instant
+
+# In-process storage behind the apps, for offline analysis of a snapshot and for running
+# without a Neo4j server. MemoryConnector stands in for Neo4jConnector and answers the
+# queries of queries.py, reads and writes, with the records Neo4j would return, so the app
+# methods run unchanged on top of it: query cache, interval cache, cell index and events
+# included. Other Cypher fails like a query Neo4j rejects.
+# Connections are columns (phone and cell codes, int64 microsecond start/end) with two
+# start-sorted orders, per cell and per phone, the in-memory counterparts of the
+# (cell_id, start_at) index and of the phone's relationship chain.
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_us(value):
+    return int(np.datetime64(to_instant(value), "us").astype(np.int64))
+
+
+def from_us(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+class Connections:
+    # Immutable view of the connection columns with their sorted orders; rebuilt after writes
+    def __init__(self, phone, cell, start, end, ids):
+        self.phone, self.cell, self.start, self.end, self.ids = phone, cell, start, end, ids
+        self.by_cell = np.lexsort((start, cell))
+        self.cell_starts = start[self.by_cell]
+        self.cell_bounds = np.searchsorted(cell[self.by_cell], np.arange(cell.max() + 2 if len(cell) else 1))
+        self.by_phone = np.lexsort((start, phone))
+        self.phone_bounds = np.searchsorted(phone[self.by_phone], np.arange(phone.max() + 2 if len(phone) else 1))
+        self.by_start = np.lexsort((ids, start))
+        # Longest connection: bounds how far before a window a connection overlapping it can start
+        self.max_duration = int((end - start).max()) if len(start) else 0
+
+    def __len__(self):
+        return len(self.start)
+
+    def of_phone(self, code):
+        # Rows of the phone, by start
+        if code is None or code + 1 >= len(self.phone_bounds):
+            return self.by_phone[:0]
+        return self.by_phone[self.phone_bounds[code]:self.phone_bounds[code + 1]]
+
+    def in_cell(self, code, start, end):
+        # Rows of the cell overlapping [start, end], by start: a seek on the start range
+        # [start - max_duration, end], then the end filter
+        if code is None or code + 1 >= len(self.cell_bounds):
+            return self.by_cell[:0]
+        lo, hi = self.cell_bounds[code], self.cell_bounds[code + 1]
+        starts = self.cell_starts[lo:hi]
+        first = lo + np.searchsorted(starts, start - self.max_duration, "left")
+        last = lo + np.searchsorted(starts, end, "right")
+        rows = self.by_cell[first:last]
+        return rows[self.end[rows] >= start]
+
+
+class MemoryConnector:
+    # Stands in for Neo4jConnector on a store-backed app: sessions and transactions are
+    # no-ops (every write applies at once) and queries are answered by the store. Failures
+    # follow Neo4jConnector: execute_query prints them and returns None, stream_query raises.
+    def __init__(self, store):
+        self.store = store
+        self.driver = None
+        self.stats = instrumentation.QueryStats()
+
+    def close(self):
+        pass
+
+    def verify_connectivity(self):
+        return True
+
+    @contextmanager
+    def session(self, **kwargs):
+        yield None
+
+    @contextmanager
+    def transaction(self, **kwargs):
+        yield None
+
+    def _answer(self, name, query, parameters):
+        started = time.perf_counter()
+        try:
+            records = self.store.run(query, parameters)
+        except Exception as e:
+            instrumentation.record(self.stats, name, time.perf_counter() - started, error=True)
+            print(f"Query failed: {e}")
+            raise
+        instrumentation.record(self.stats, name, time.perf_counter() - started, len(records))
+        return records
+
+    def execute_query(self, query, parameters=None, name=None):
+        try:
+            return self._answer(name or sys._getframe(1).f_code.co_name, query, parameters)
+        except Exception:
+            return None
+
+    def stream_query(self, query, parameters=None, fetch_size=1000, name=None):
+        # The records are answered at once, under the store's lock, and then yielded
+        yield from self._answer(name or sys._getframe(1).f_code.co_name, query, parameters)
+
+    def stats_snapshot(self):
+        return self.stats.snapshot()
+
+
+class MemoryStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.people = []            # one name per Person node, None once deleted
+        self._people_by_name = {}   # name -> [person index]
+        self._person_phones = {}    # person index -> [phone number]
+        self.phones = {}            # phone number -> owner's person index (or None)
+        self.cells = {}             # cell id -> cell row
+        self.phone_codes = DictionaryEncoder()
+        self.cell_codes = DictionaryEncoder()
+        self._chunks = []           # (phone, cell, start, end, ids) column arrays per write
+        self._next_id = 0
+        self._connections = None
+        self.connection_stats = {}  # ConnectionStats name -> max_duration_seconds
+        self.cell_index = CellIndex(lambda: list(self.cells.values()))
+        self._handlers = {**self.query_handlers(), **self.cleaner_handlers()}
+
+    def connector(self):
+        return MemoryConnector(self)
+
+    def run(self, query, parameters=None):
+        # Answers a queries.py statement with its records; a handler sees the store unchanged
+        # for the whole query
+        handler = self._handlers.get(query)
+        if handler is None:
+            raise ValueError("the in-memory backend has no implementation of this query")
+        with self._lock:
+            return handler(**(parameters or {}))
+
+    # Columns
+
+    def _columns(self):
+        with self._lock:
+            if self._connections is None:
+                if self._chunks:
+                    columns = [np.concatenate([chunk[i] for chunk in self._chunks]) for i in range(5)]
+                else:
+                    columns = [np.empty(0, dtype=dtype) for dtype in (np.int32, np.int32, np.int64, np.int64, np.int64)]
+                self._chunks = [columns] if self._chunks else []
+                self._connections = Connections(*columns)
+            return self._connections
+
+    def _append(self, phone_codes, cell_codes, starts, ends):
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + len(starts), dtype=np.int64)
+            self._next_id += len(starts)
+            self._chunks.append((np.asarray(phone_codes, dtype=np.int32), np.asarray(cell_codes, dtype=np.int32),
+                                 np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), ids))
+            self._connections = None
+
+    def _keep(self, keep):
+        # Drops the connections where keep is False; returns how many
+        with self._lock:
+            columns = self._columns()
+            removed = int(len(keep) - keep.sum())
+            if removed:
+                self._chunks = [[column[keep] for column in (columns.phone, columns.cell, columns.start,
+                                                             columns.end, columns.ids)]]
+                self._connections = None
+            return removed
+
+    def _phone_code(self, phone_number):
+        return self.phone_codes.code_of(phone_number)
+
+    def _cell_code(self, cell_id):
+        return self.cell_codes.code_of(cell_id)
+
+    def _connection(self, columns, i):
+        cell_id = self.cell_codes.values[columns.cell[i]]
+        cell = self.cells[cell_id]
+        return {"phone_number": self.phone_codes.values[columns.phone[i]],
+                "cell_id": cell_id,
+                "latitude": cell["latitude"],
+                "longitude": cell["longitude"],
+                "start_at": from_us(columns.start[i]),
+                "end_at": from_us(columns.end[i])}
+
+    def _owner(self, phone_number):
+        person = self.phones.get(phone_number)
+        return self.people[person] if person is not None else None
+
+    # Snapshots
+
+    def load_snapshot(self, directory):
+        # Adds the cells, people and connections of a columnar_export snapshot
+        snapshot = load_snapshot(directory)
+        import pyarrow as pa
+        cells = snapshot["cells"].to_pydict()
+        with self._lock:
+            self.create_cells_batch([{"id": cell_id, "latitude": latitude, "longitude": longitude, "type": cell_type}
+                                     for cell_id, latitude, longitude, cell_type
+                                     in zip(cells["id"], cells["latitude"], cells["longitude"], cells["type"])])
+        if "people" in snapshot:
+            people = snapshot["people"].to_pydict()
+            with self._lock:
+                for name, phone_number in zip(people["name"], people["phone_number"]):
+                    person = self._add_person(name)
+                    if phone_number is not None:
+                        self._add_phone(person, phone_number)
+
+        connections = snapshot["connections"]
+        codes = {}
+        for column, encoder in (("phone_number", self.phone_codes), ("cell_id", self.cell_codes)):
+            chunks = []
+            for chunk in connections.column(column).chunks:
+                mapping = np.array([encoder.encode(value) for value in chunk.dictionary.to_pylist()], dtype=np.int32)
+                chunks.append(mapping[chunk.indices.to_numpy(zero_copy_only=False)] if len(mapping) else
+                              np.empty(0, dtype=np.int32))
+            codes[column] = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int32)
+        with self._lock:
+            # Phones only known from their connections have no owner
+            for phone_number in self.phone_codes.values:
+                self.phones.setdefault(phone_number, None)
+        starts, ends = (connections.column(column).cast(pa.int64()).to_numpy() * 1000 for column in ("start_at", "end_at"))
+        self._append(codes["phone_number"], codes["cell_id"], starts, ends)
+        events.publish(events.CELLS_CHANGED, cell_ids=None)
+        events.publish(events.PEOPLE_CHANGED, names=None, phone_numbers=None)
+        events.publish(events.CONNECTIONS_CHANGED, phone_numbers=None)
+        print(f"Loaded {len(self.cells)} cells, {len(self.phones)} phone numbers and "
+              f"{len(connections)} connections from {directory}")
+        return self
+
+    # Queries
+
+    def query_handlers(self):
+        # queries.py statement -> handler(**parameters) returning its records
+        return {
+            queries.CREATE_PERSON: self.create_person,
+            queries.ADD_PHONE_NUMBER: self.add_phone_number,
+            queries.CREATE_PEOPLE_BATCH: self.create_people_batch,
+            queries.CREATE_CELL: self.create_cell,
+            queries.CREATE_CELLS_BATCH: self.create_cells_batch,
+            queries.WIDEN_MAX_DURATION: self.widen_max_duration,
+            queries.CONNECT_PHONE_TO_CELL: self.connect_phone_to_cell,
+            queries.CONNECT_PHONES_TO_CELLS_BATCH: self.connect_phones_to_cells_batch,
+            queries.ALL_CELL_IDS: self.all_cell_ids,
+            queries.COUNT_ENTITIES: self.count_entities,
+            queries.PERSON_BY_PHONE: self.person_by_phone,
+            queries.PHONE_BY_NAME: self.phone_by_name,
+            queries.PHONES_BY_NAMES: self.phones_by_names,
+            queries.PEOPLE_BY_PHONES: self.people_by_phones,
+            queries.ALL_PEOPLE: self.all_people,
+            queries.PEOPLE_PHONES: self.people_phones,
+            queries.ALL_PHONE_NUMBERS: self.all_phone_numbers,
+            queries.ALL_CELLS: self.all_cells,
+            queries.ALL_CONNECTIONS: self.all_connections,
+            queries.CONNECTION_EPOCHS: self.connection_epochs,
+            queries.PEOPLE_PAGE: self.people_page,
+            queries.PHONE_NUMBERS_PAGE: self.phone_numbers_page,
+            queries.CELLS_PAGE: self.cells_page,
+            queries.CONNECTIONS_PAGE: self.connections_page,
+            queries.CONNECTIONS_BY_PHONE: self.connection_history,
+            queries.CONNECTION_HISTORY: self.connection_history,
+            queries.CONNECTION_DATES: self.connection_dates,
+            queries.CONNECTION_TIMES: self.connection_times,
+            queries.CONNECTION_COORDINATES: self.connections_at,
+            queries.CELL_AT_TIME: self.connections_at,
+            queries.CELLS_NEAR: self.cells_near,
+            queries.LOCATE_PHONES: self.locate_phones,
+            queries.WINDOW_HISTORY: self.window_history,
+            queries.CELL_WINDOW_CONNECTIONS: self.cell_window_connections,
+            queries.TRAJECTORY: self.trajectory,
+            queries.SUSPECTS_IN_CELL: self.suspects_in_cell,
+            queries.SUSPECTS_IN_CELLS: self.suspects_in_cells,
+            queries.SUSPECTS_NEAR_LOCATION: self.suspects_near_location,
+        }
+
+    # Reads
+
+    def person_by_phone(self, phone_number):
+        name = self._owner(phone_number)
+        return [{"name": name}] if name is not None else []
+
+    def _phones_of(self, name):
+        return [phone_number for person in self._people_by_name.get(name, [])
+                for phone_number in self._person_phones.get(person, [])]
+
+    def phone_by_name(self, name):
+        return [{"phone_number": phone_number} for phone_number in self._phones_of(name)]
+
+    def phones_by_names(self, names):
+        phones = {name: self._phones_of(name) for name in names}
+        return [{"name": name, "phone_number": numbers[0]} for name, numbers in phones.items() if numbers]
+
+    def people_by_phones(self, phone_numbers):
+        owners = [(phone_number, self._owner(phone_number)) for phone_number in phone_numbers]
+        return [{"phone_number": phone_number, "name": name} for phone_number, name in owners if name is not None]
+
+    def all_people(self):
+        return [{"name": name} for name in list(self.people) if name is not None]
+
+    def people_phones(self):
+        return [{"name": name, "phone_number": phone_number}
+                for person, name in enumerate(list(self.people)) if name is not None
+                for phone_number in self._person_phones.get(person) or [None]]
+
+    def all_phone_numbers(self):
+        return [{"number": phone_number} for phone_number in list(self.phones)]
+
+    def all_cells(self):
+        return [dict(cell) for cell in list(self.cells.values())]
+
+    def all_connections(self):
+        columns = self._columns()
+        return [self._connection(columns, i) for i in range(len(columns))]
+
+    def connection_epochs(self):
+        columns = self._columns()
+        phones, cells = self.phone_codes.values, self.cell_codes.values
+        return [{"phone_number": phones[phone], "cell_id": cells[cell], "start_ms": start, "end_ms": end}
+                for phone, cell, start, end in zip(columns.phone.tolist(), columns.cell.tolist(),
+                                                   (columns.start // 1000).tolist(), (columns.end // 1000).tolist())]
+
+    def people_page(self, after_name, after_id, limit):
+        # element_id: the person's index
+        people = sorted((name, person) for person, name in enumerate(self.people) if name is not None)
+        if after_name is not None:
+            people = [entry for entry in people if entry > (after_name, after_id)]
+        return [{"name": name, "element_id": person} for name, person in people[:limit]]
+
+    def phone_numbers_page(self, after, limit):
+        numbers = sorted(number for number in self.phones if after is None or number > after)
+        return [{"number": number} for number in numbers[:limit]]
+
+    def cells_page(self, after, limit):
+        ids = sorted(cell_id for cell_id in self.cells if after is None or cell_id > after)
+        return [dict(self.cells[cell_id]) for cell_id in ids[:limit]]
+
+    def connections_page(self, after_start, after_id, limit):
+        # element_id: the connection id
+        columns = self._columns()
+        order = columns.by_start
+        if after_start is not None:
+            after_start = to_us(after_start)
+            position = np.searchsorted(columns.start[order], after_start, "left")
+            while position < len(order) and columns.start[order[position]] == after_start \
+                    and columns.ids[order[position]] <= after_id:
+                position += 1
+            order = order[position:]
+        return [{**self._connection(columns, i), "element_id": int(columns.ids[i])} for i in order[:limit]]
+
+    def _history(self, phone_number):
+        # The phone's rows, by start
+        columns = self._columns()
+        return columns, columns.of_phone(self._phone_code(phone_number))
+
+    def connection_history(self, phone_number):
+        columns, rows = self._history(phone_number)
+        return [self._connection(columns, i) for i in rows]
+
+    def connection_dates(self, phone_number):
+        dates = {(connection["start_at"].date(), connection["end_at"].date())
+                 for connection in self.connection_history(phone_number)}
+        return [{"start_date": start, "end_date": end} for start, end in sorted(dates)]
+
+    def connection_times(self, phone_number, day_start, day_end):
+        times = sorted((connection["start_at"].time(), connection["end_at"].time())
+                       for connection in self.connection_history(phone_number)
+                       if connection["start_at"] < day_end and connection["end_at"] >= day_start)
+        return [{"start_time": start, "end_time": end} for start, end in times]
+
+    def connections_at(self, phone_number, at):
+        columns, rows = self._history(phone_number)
+        at = to_us(at)
+        return [self._connection(columns, i) for i in rows[(columns.start[rows] <= at) & (columns.end[rows] >= at)]]
+
+    def cells_near(self, latitude, longitude, radius_m, **bounding_box):
+        return [{"cell_id": cell_id} for cell_id, _ in self.cell_index.within(latitude, longitude, radius_m / 1000)]
+
+    def locate_phones(self, phone_numbers, instants, first, last):
+        # One record per (connection, instant it spans)
+        columns = self._columns()
+        instants = np.array([to_us(instant) for instant in instants], dtype=np.int64)
+        records = []
+        for phone_number in phone_numbers:
+            rows = columns.of_phone(self._phone_code(phone_number))
+            rows = rows[(columns.start[rows] <= to_us(last)) & (columns.end[rows] >= to_us(first))]
+            for i in rows:
+                spanned = np.flatnonzero((columns.start[i] <= instants) & (columns.end[i] >= instants))
+                cell_id = self.cell_codes.values[columns.cell[i]]
+                records.extend({"phone_number": phone_number, "column": int(column), "cell_id": cell_id}
+                               for column in spanned)
+        return records
+
+    def window_history(self, phone_number, start, end):
+        columns, rows = self._history(phone_number)
+        rows = rows[(columns.start[rows] <= to_us(end)) & (columns.end[rows] >= to_us(start))]
+        return [self._connection(columns, i) for i in rows]
+
+    def cell_window_connections(self, cell_ids, start, end, phone_number, earliest=None):
+        excluded = self._phone_code(phone_number)
+        columns = self._columns()
+        records = []
+        for cell_id in cell_ids:
+            for i in columns.in_cell(self._cell_code(cell_id), to_us(start), to_us(end)):
+                if columns.phone[i] != excluded:
+                    records.append({"cell_id": cell_id, "phone_number": self.phone_codes.values[columns.phone[i]],
+                                    "start_at": from_us(columns.start[i]), "end_at": from_us(columns.end[i])})
+        return records
+
+    def trajectory(self, phone_number, start, end):
+        columns, rows = self._history(phone_number)
+        if start is not None:
+            rows = rows[columns.end[rows] >= to_us(start)]
+        if end is not None:
+            rows = rows[columns.start[rows] <= to_us(end)]
+        return [{"cell_id": connection["cell_id"], "latitude": connection["latitude"],
+                 "longitude": connection["longitude"], "start_ms": int(columns.start[i]) // 1000,
+                 "end_ms": int(columns.end[i]) // 1000}
+                for i, connection in ((i, self._connection(columns, i)) for i in rows)]
+
+    def suspects_in_cells(self, cell_ids, start, end, earliest=None):
+        # Distinct (name, phone_number) of the owned phones connected to the cells during [start, end]
+        columns = self._columns()
+        suspects = {}
+        for cell_id in dict.fromkeys(cell_ids):
+            for phone in columns.phone[columns.in_cell(self._cell_code(cell_id), to_us(start), to_us(end))].tolist():
+                phone_number = self.phone_codes.values[phone]
+                name = self._owner(phone_number)
+                if name is not None:
+                    suspects.setdefault((name, phone_number), None)
+        return [{"name": name, "phone_number": phone_number} for name, phone_number in suspects]
+
+    def suspects_in_cell(self, cell_id, start, end, earliest=None):
+        return self.suspects_in_cells([cell_id], start, end)
+
+    def suspects_near_location(self, latitude, longitude, radius_m, start, end, earliest=None, **bounding_box):
+        cell_ids = [record["cell_id"] for record in self.cells_near(latitude, longitude, radius_m)]
+        return self.suspects_in_cells(cell_ids, start, end)
+
+    # Creation apps: constraint violations raise, as the phone_number_unique and
+    # cell_id_unique constraints would fail the whole statement
+
+    def _add_person(self, name):
+        person = len(self.people)
+        self.people.append(name)
+        self._people_by_name.setdefault(name, []).append(person)
+        return person
+
+    def _add_phone(self, person, phone_number):
+        self.phones[phone_number] = person
+        self._person_phones.setdefault(person, []).append(phone_number)
+
+    def _new_phone_numbers(self, numbers):
+        if len(set(numbers)) < len(numbers) or any(number in self.phones for number in numbers):
+            raise ValueError("phone_number_unique: phone number already exists")
+
+    def _new_cell_ids(self, ids):
+        if len(set(ids)) < len(ids) or any(cell_id in self.cells for cell_id in ids):
+            raise ValueError("cell_id_unique: cell id already exists")
+
+    def create_person(self, name):
+        self._add_person(name)
+        return [{"p": {"name": name}}]
+
+    def add_phone_number(self, name, phone_number):
+        people = self._people_by_name.get(name)
+        if not people:
+            return []
+        self._new_phone_numbers([phone_number])
+        self._add_phone(people[0], phone_number)
+        return [{"p": {"name": name}, "ph": {"number": phone_number}}]
+
+    def create_people_batch(self, rows):
+        self._new_phone_numbers([row["phone_number"] for row in rows])
+        for row in rows:
+            self._add_phone(self._add_person(row["name"]), row["phone_number"])
+        return [{"created": len(rows)}]
+
+    def create_cell(self, cell_id, latitude, longitude, cell_type):
+        cell = {"id": cell_id, "latitude": latitude, "longitude": longitude, "type": cell_type}
+        self.create_cells_batch([cell])
+        return [{"c": dict(cell)}]
+
+    def create_cells_batch(self, rows):
+        self._new_cell_ids([row["id"] for row in rows])
+        for row in rows:
+            self.cells[row["id"]] = {"id": row["id"], "latitude": row["latitude"],
+                                     "longitude": row["longitude"], "type": row["type"]}
+            self.cell_codes.encode(row["id"])
+        self.cell_index.mark_stale()
+        return [{"created": len(rows)}]
+
+    def widen_max_duration(self, seconds):
+        # Only recorded: the columns bound their seeks by their own longest connection
+        longest = max(self.connection_stats.get("CONNECTED_TO") or 0, seconds)
+        self.connection_stats["CONNECTED_TO"] = longest
+        return [{"max_duration_seconds": longest}]
+
+    def connect_phone_to_cell(self, phone_number, cell_id, start_at, end_at):
+        return self.connect_phones_to_cells_batch([{"phone_number": phone_number, "cell_id": cell_id,
+                                                    "start_at": start_at, "end_at": end_at}])
+
+    def connect_phones_to_cells_batch(self, rows):
+        # Rows naming an unknown phone or cell are skipped, as the MATCH would
+        rows = [row for row in rows if row["phone_number"] in self.phones and row["cell_id"] in self.cells]
+        self._append([self.phone_codes.encode(row["phone_number"]) for row in rows],
+                     [self.cell_codes.encode(row["cell_id"]) for row in rows],
+                     [to_us(row["start_at"]) for row in rows],
+                     [to_us(row["end_at"]) for row in rows])
+        return [{"created": len(rows)}]
+
+    def all_cell_ids(self):
+        return [{"id": cell_id} for cell_id in self.cells]
+
+    # DataCleaner: each MATCH of queries.py selects relationships or nodes, which its count
+    # query counts and its delete query removes batch_size at a time
+
+    def cleaner_handlers(self):
+        handlers = {}
+
+        def add(match, variable, select, delete, detach=False):
+            handlers[queries.count_query(match, variable)] = \
+                lambda **parameters: [{"count": len(select(**parameters))}]
+            handlers[queries.delete_batch_query(match, variable, detach)] = \
+                lambda batch_size, **parameters: [{"deleted": delete(select(**parameters)[:batch_size])}]
+
+        for before in (False, True):
+            for after in (False, True):
+                add(queries.connections_match(before, after), "r", self._connections_between,
+                    self._delete_connections)
+        nodes = [
+            # node, (select, delete) of its outgoing and incoming relationships and of the nodes
+            (queries.PHONE_NUMBER_NODES, (self._phone_connections, self._delete_connections),
+             (self._owned_phones, self._unlink_phones), (self._phone_numbers, self._delete_phones)),
+            (queries.PERSON_NODES, (self._owned_phones, self._unlink_phones), (self._no_relationships, self._delete_connections),
+             (self._persons, self._delete_persons)),
+            (queries.CONNECTION_STATS_NODES, (self._no_relationships, self._delete_connections), (self._no_relationships, self._delete_connections),
+             (self._stats_names, self._delete_stats)),
+        ]
+        for node, cell_type in ((queries.CELL_NODES, None), (queries.TRADITIONAL_CELL_NODES, "traditional"),
+                                (queries.FIVE_G_CELL_NODES, "5G")):
+            nodes.append((node, (self._no_relationships, self._delete_connections),
+                          (lambda cell_type=cell_type: self._cell_connections(cell_type), self._delete_connections),
+                          (lambda cell_type=cell_type: self._cell_ids(cell_type), self._delete_cells)))
+        for node, *selections in nodes:
+            for (match, variable), (select, delete) in zip(queries.node_matches(node), selections):
+                add(match, variable, select, delete, detach=variable != "r")
+        return handlers
+
+    def _no_relationships(self):
+        return []
+
+    def _connections_between(self, before=None, after=None):
+        # Row positions of the connections that ended before `before` / started at or after `after`
+        columns = self._columns()
+        selected = np.ones(len(columns), dtype=bool)
+        if before is not None:
+            selected &= columns.end < to_us(before)
+        if after is not None:
+            selected &= columns.start >= to_us(after)
+        return np.flatnonzero(selected)
+
+    def _phone_connections(self):
+        return np.arange(len(self._columns()))
+
+    def _cell_connections(self, cell_type):
+        codes = [self.cell_codes.code_of(cell_id) for cell_id in self._cell_ids(cell_type)]
+        return np.flatnonzero(np.isin(self._columns().cell, np.array(codes, dtype=np.int32)))
+
+    def _delete_connections(self, positions):
+        keep = np.ones(len(self._columns()), dtype=bool)
+        keep[positions] = False
+        return self._keep(keep)
+
+    def _owned_phones(self):
+        # The phone numbers with a HAS_PHONE relationship
+        return [phone_number for phone_number, person in self.phones.items() if person is not None]
+
+    def _unlink_phones(self, phone_numbers):
+        for phone_number in phone_numbers:
+            person = self.phones[phone_number]
+            self.phones[phone_number] = None
+            self._person_phones[person].remove(phone_number)
+        return len(phone_numbers)
+
+    def _phone_numbers(self):
+        return list(self.phones)
+
+    def _delete_phones(self, phone_numbers):
+        # DETACH DELETE: the phones' own relationships go with them
+        self._unlink_phones([phone_number for phone_number in phone_numbers if self.phones[phone_number] is not None])
+        codes = np.array([self.phone_codes.code_of(phone_number) for phone_number in phone_numbers], dtype=np.int32)
+        self._keep(~np.isin(self._columns().phone, codes))
+        for phone_number in phone_numbers:
+            del self.phones[phone_number]
+        return len(phone_numbers)
+
+    def _persons(self):
+        return [person for person, name in enumerate(self.people) if name is not None]
+
+    def _delete_persons(self, persons):
+        for person in persons:
+            self._unlink_phones(list(self._person_phones.pop(person, [])))
+            self._people_by_name[self.people[person]].remove(person)
+            if not self._people_by_name[self.people[person]]:
+                del self._people_by_name[self.people[person]]
+            self.people[person] = None
+        return len(persons)
+
+    def _cell_ids(self, cell_type):
+        return [cell_id for cell_id, cell in self.cells.items() if cell_type is None or cell["type"] == cell_type]
+
+    def _delete_cells(self, cell_ids):
+        codes = np.array([self.cell_codes.code_of(cell_id) for cell_id in cell_ids], dtype=np.int32)
+        self._keep(~np.isin(self._columns().cell, codes))
+        for cell_id in cell_ids:
+            del self.cells[cell_id]
+        self.cell_index.mark_stale()
+        return len(cell_ids)
+
+    def _stats_names(self):
+        return list(self.connection_stats)
+
+    def _delete_stats(self, names):
+        for name in names:
+            del self.connection_stats[name]
+        return len(names)
+
+    def count_entities(self):
+        types = [cell["type"] for cell in self.cells.values()]
+        return [{"people": sum(name is not None for name in self.people),
+                 "phone_numbers": len(self.phones),
+                 "traditional_cells": types.count("traditional"),
+                 "five_g_cells": types.count("5G"),
+                 "connections": len(self._columns())}]
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def store_from_env():
+    # NEO4J_BACKEND=memory serves every app of the process from one MemoryStore, loaded
+    # from the NEO4J_SNAPSHOT directory (an export_snapshot) if set; anything else is Neo4j
+    if os.getenv("NEO4J_BACKEND", "").lower() != "memory":
+        return None
+    with _shared_lock:
+        if "memory" not in _shared:
+            store = MemoryStore()
+            if os.getenv("NEO4J_SNAPSHOT"):
+                store.load_snapshot(os.getenv("NEO4J_SNAPSHOT"))
+            _shared["memory"] = store
+        return _shared["memory"]
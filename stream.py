@@ -1,10 +1,60 @@
+import atexit
 import streamlit as st
 from criminal_tracking import CriminalTrackingApp
 
+# Query results are reused across reruns and sessions for this many seconds
+CACHE_TTL_SECONDS = 300
+PAGE_SIZE = 50
+
+
+@st.cache_resource
+def get_app():
+    # One app (driver pool, geocoder, caches) per process, shared by every session
+    app = CriminalTrackingApp()
+    atexit.register(app.connector.close)
+    return app
+
+# Leading underscore: Streamlit does not hash the app, results are keyed by the other arguments
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def find_person_location(_app, name, date, time):
+    return _app.find_person_location(name, date, time)
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def get_locations_info(_app, locations):
+    return _app.get_locations_info(locations)
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def find_suspects_in_cell(_app, cell_id, date, time):
+    return _app.find_suspects_in_cell(cell_id, date, time)
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def find_suspects_near_location(_app, lat, lon, date, time, radius):
+    return _app.find_suspects_near_location(lat, lon, date, time, radius)
+
+
+def show_suspects(suspects, key):
+    # Renders one page of the list; the page selector keeps long results responsive
+    if not suspects:
+        st.info("No suspects found.")
+        return
+    pages = (len(suspects) + PAGE_SIZE - 1) // PAGE_SIZE
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    start = (page - 1) * PAGE_SIZE
+    st.caption(f"Showing {start + 1}-{min(start + PAGE_SIZE, len(suspects))} of {len(suspects)} suspects")
+    for name, phone in suspects[start:start + PAGE_SIZE]:
+        st.write(f"- {name} (Phone: {phone})")
+
+
 def main():
     st.title("Criminal Tracking System")
 
-    app = CriminalTrackingApp()
+    app = get_app()
 
     option = st.sidebar.selectbox(
         "Choose an operation",
@@ -17,10 +67,9 @@ def main():
         time = st.time_input("Select time")
 
         if st.button("Find Location"):
-            locations = app.find_person_location(name, str(date), str(time))
+            locations = find_person_location(app, name, str(date), str(time))
             if locations:
-                for lat, lon in locations:
-                    location_info = app.get_location_info(lat, lon)
+                for location_info in get_locations_info(app, locations):
                     st.success(f"{name} was located {location_info} on {date} at {time}")
             else:
                 st.warning(f"No location found for {name} on {date} at {time}")
@@ -30,11 +79,14 @@ def main():
         date = st.date_input("Select date")
         time = st.time_input("Select time")
 
+        # The search is remembered in the session so paging (a rerun) keeps showing it
         if st.button("Find Suspects"):
-            suspects = app.find_suspects_in_cell(cell_id, str(date), str(time))
+            st.session_state["cell_search"] = (cell_id, str(date), str(time))
+        if st.session_state.get("cell_search"):
+            cell_id, date, time = st.session_state["cell_search"]
+            suspects = find_suspects_in_cell(app, cell_id, date, time)
             st.write(f"Suspects in cell {cell_id} on {date} at {time}:")
-            for name, phone in suspects:
-                st.write(f"- {name} (Phone: {phone})")
+            show_suspects(suspects, "cell")
 
     elif option == "Find suspects near coordinates":
         lat = st.number_input("Enter latitude", format="%.6f")
@@ -44,10 +96,12 @@ def main():
         time = st.time_input("Select time")
 
         if st.button("Find Suspects"):
-            suspects = app.find_suspects_near_location(lat, lon, str(date), str(time), radius)
+            st.session_state["area_search"] = (lat, lon, str(date), str(time), radius)
+        if st.session_state.get("area_search"):
+            lat, lon, date, time, radius = st.session_state["area_search"]
+            suspects = find_suspects_near_location(app, lat, lon, date, time, radius)
             st.write(f"Suspects within {radius}km of ({lat}, {lon}) on {date} at {time}:")
-            for name, phone in suspects:
-                st.write(f"- {name} (Phone: {phone})")
+            show_suspects(suspects, "area")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
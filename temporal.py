@@ -0,0 +1,57 @@
+from datetime import datetime, date, time, timedelta
+
+
+def to_datetime(date_value, time_value=None):
+    # Builds the naive datetime stored as LocalDateTime on CONNECTED_TO.start_at/end_at
+    if isinstance(date_value, datetime):
+        return date_value
+    if hasattr(date_value, "to_native"):
+        date_value = date_value.to_native()
+    if isinstance(date_value, str):
+        if len(date_value) > 10:
+            return datetime.fromisoformat(date_value)
+        date_value = date.fromisoformat(date_value)
+    if time_value is None:
+        time_value = time()
+    elif hasattr(time_value, "to_native"):
+        time_value = time_value.to_native()
+    elif isinstance(time_value, str):
+        time_value = time.fromisoformat(time_value)
+    return datetime.combine(date_value, time_value)
+
+
+def to_instant(value):
+    # An instant given as a datetime, an ISO string or a (date, time) pair
+    if isinstance(value, (tuple, list)):
+        return to_datetime(*value)
+    return to_datetime(value)
+
+
+def day_bounds(date_value):
+    start = to_datetime(date_value)
+    return start, start + timedelta(days=1)
+
+
+def time_window(date=None, time=None, window=None):
+    # Inclusive (start, end): the [from, to] window if given, else the whole day of `date`
+    # when time is None, else the single instant
+    if window is not None:
+        start, end = window
+        return to_instant(start), to_instant(end)
+    if time is None:
+        start, end = day_bounds(date)
+        return start, end - timedelta(microseconds=1)
+    at = to_datetime(date, time)
+    return at, at
+
+
+def from_neo4j(value):
+    return value.to_native() if hasattr(value, "to_native") else value
+
+
+def split_datetime(value):
+    # Legacy (date, time) string pair, as the old string-typed properties were written
+    value = from_neo4j(value)
+    if value is None:
+        return None, None
+    return str(value.date()), str(value.time())
@@ -0,0 +1,361 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from criminal_tracking import CriminalTrackingApp
+from data_cleaner import DataCleaner
+from data_creation import UserCreationApp, CellCreationApp, ConnectionCreationApp
+from data_retrieval import DataRetrievalApp
+from geo import haversine_km
+from query_cache import QueryCache, MemoryCache
+from storage import MemoryStore
+from temporal import split_datetime
+
+# The apps run against a MemoryStore and are checked against brute force over the rows
+# the store was filled with
+
+START = datetime(2024, 3, 1)
+EPOCH = datetime(1970, 1, 1)
+
+
+def build_rows(seed=7, connection_count=3000):
+    rng = random.Random(seed)
+    people = [(f"Person {i:03d}", f"3{i:09d}") for i in range(60)]
+    people.append(("Person 007", "3999999999"))  # a second person of the same name
+    cells = [{"id": f"C{i:03d}", "latitude": 41.8 + rng.random() * 0.2, "longitude": 12.4 + rng.random() * 0.2,
+              "type": rng.choice(["traditional", "5G"])} for i in range(40)]
+    connections = []
+    for _ in range(connection_count):
+        start = START + timedelta(seconds=rng.randrange(7 * 86400))
+        connections.append({"phone_number": rng.choice(people)[1], "cell_id": rng.choice(cells)["id"],
+                            "start_at": start, "end_at": start + timedelta(seconds=rng.randrange(60, 4 * 3600))})
+    return people, cells, connections
+
+
+def fill(store, people, cells, connections):
+    with UserCreationApp(backend=store) as users, CellCreationApp(backend=store) as cell_app:
+        assert users.create_people_batch([{"name": name, "phone_number": phone} for name, phone in people])
+        users.create_person("Loner")
+        assert cell_app.create_cells_batch(cells) == len(cells)
+    retrieval = DataRetrievalApp(backend=store, cache=False)
+    with ConnectionCreationApp(retrieval, backend=store) as links:
+        assert links.connect_phones_to_cells_batch(connections) == len(connections)
+
+
+@pytest.fixture(scope="module")
+def world():
+    store = MemoryStore()
+    people, cells, connections = build_rows()
+    fill(store, people, cells, connections)
+    app = CriminalTrackingApp(backend=store, cache=False, geocode_cache_path=False)
+    return store, app, people, cells, connections
+
+
+def owners(people):
+    return {phone: name for name, phone in people}
+
+
+def overlapping(connections, cell_ids, start, end):
+    return [c for c in connections if c["cell_id"] in cell_ids and c["start_at"] <= end and c["end_at"] >= start]
+
+
+def midpoint(connection):
+    return (connection["start_at"] + (connection["end_at"] - connection["start_at"]) / 2).replace(microsecond=0)
+
+
+def epoch_ms(value):
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def test_person_lookups(world):
+    _, app, people, _, _ = world
+    for name, phone in people[:10]:
+        assert app.get_person_by_phone(phone) == {"name": name}
+    assert app.get_person_by_phone("0000000000") is None
+    assert app.get_phone_by_name("Person 001") == people[1][1]
+    assert app.get_phone_by_name("Person 007") in {"3000000007", "3999999999"}
+    assert app.get_phone_by_name("Loner") is None
+    assert app.get_phones_by_names(["Person 001", "Person 002", "Loner", "Nobody"]) == \
+        {"Person 001": people[1][1], "Person 002": people[2][1]}
+    assert app.get_people_by_phones([phone for _, phone in people[:5]] + ["0000000000"]) == \
+        {phone: name for name, phone in people[:5]}
+
+
+def test_collections(world):
+    _, app, people, cells, connections = world
+    assert sorted(app.get_all_people()) == sorted([name for name, _ in people] + ["Loner"])
+    assert sorted(app.iter_people_phones()) == sorted(people + [("Loner", None)])
+    assert sorted(app.get_all_phone_numbers()) == sorted(phone for _, phone in people)
+    assert sorted(app.get_all_cells(), key=lambda cell: cell["id"]) == cells
+    assert sorted(app.iter_connection_epochs()) == sorted(
+        (c["phone_number"], c["cell_id"], epoch_ms(c["start_at"]), epoch_ms(c["end_at"])) for c in connections)
+
+    def row(c):
+        return (c["phone_number"], c["cell_id"], *split_datetime(c["start_at"]), *split_datetime(c["end_at"]))
+    assert sorted((c["phone_number"], c["cell_id"], c["start_date"], c["start_time"], c["end_date"], c["end_time"])
+                  for c in app.get_all_connections()) == sorted(row(c) for c in connections)
+
+
+def read_pages(method, limit):
+    items, cursor = [], None
+    while True:
+        page = method(cursor, limit)
+        items += page["items"]
+        cursor = page["next"]
+        if cursor is None:
+            return items
+
+
+def test_pages(world):
+    _, app, people, cells, connections = world
+    assert read_pages(app.get_people_page, 7) == sorted([name for name, _ in people] + ["Loner"])
+    assert read_pages(app.get_phone_numbers_page, 9) == sorted(phone for _, phone in people)
+    assert read_pages(app.get_cells_page, 6) == cells
+    rows = read_pages(app.get_connections_page, 256)
+    assert len(rows) == len(connections)
+    assert [(r["start_date"], r["start_time"]) for r in rows] == \
+        sorted(split_datetime(c["start_at"]) for c in connections)
+
+
+def test_phone_history(world):
+    _, app, people, cells, connections = world
+    positions = {cell["id"]: (cell["latitude"], cell["longitude"]) for cell in cells}
+    phone = people[3][1]
+    mine = sorted((c for c in connections if c["phone_number"] == phone), key=lambda c: c["start_at"])
+
+    history = app.get_connection_history(phone)
+    assert [(h["cell_id"], h["start_at"], h["end_at"]) for h in history] == \
+        [(c["cell_id"], c["start_at"], c["end_at"]) for c in mine]
+    assert [(h["latitude"], h["longitude"]) for h in history] == [positions[c["cell_id"]] for c in mine]
+    assert [c["cell_id"] for c in app.get_connections_by_phone(phone)] == [c["cell_id"] for c in mine]
+    assert app.get_connection_dates(phone) == sorted(
+        {(str(c["start_at"].date()), str(c["end_at"].date())) for c in mine})
+
+    day = mine[0]["start_at"].date()
+    day_start = datetime.combine(day, datetime.min.time())
+    assert app.get_connection_times(phone, str(day)) == sorted(
+        (str(c["start_at"].time()), str(c["end_at"].time())) for c in mine
+        if c["start_at"] < day_start + timedelta(days=1) and c["end_at"] >= day_start)
+
+    for connection in mine[:20]:
+        at = midpoint(connection)
+        covering = [c for c in mine if c["start_at"] <= at <= c["end_at"]]
+        date, time = str(at.date()), str(at.time())
+        assert app.get_cell_for_person_at_time(phone, date, time) in {c["cell_id"] for c in covering}
+        assert sorted(app.get_connection_coordinates(phone, date, time)) == \
+            sorted(positions[c["cell_id"]] for c in covering)
+    assert app.find_person_cell(people[3][0], str(at.date()), str(at.time())) in {c["cell_id"] for c in covering}
+
+
+def test_suspects(world):
+    _, app, people, cells, connections = world
+    owner = owners(people)
+    positions = {cell["id"]: cell for cell in cells}
+    rng = random.Random(11)
+    for connection in rng.sample(connections, 50):
+        at = midpoint(connection)
+        cell_id = connection["cell_id"]
+        date, time = str(at.date()), str(at.time())
+
+        expected = {(owner[c["phone_number"]], c["phone_number"]) for c in overlapping(connections, {cell_id}, at, at)}
+        assert set(app.find_suspects_in_cell(cell_id, date, time)) == expected
+
+        window = (at - timedelta(hours=3), at)
+        expected = {(owner[c["phone_number"]], c["phone_number"])
+                    for c in overlapping(connections, {cell_id, "C000"}, *window)}
+        assert set(app.find_suspects_in_cells([cell_id, "C000"], window=window)) == expected
+
+        latitude, longitude = positions[cell_id]["latitude"], positions[cell_id]["longitude"]
+        near = {cell["id"] for cell in cells
+                if haversine_km(latitude, longitude, cell["latitude"], cell["longitude"]) <= 3}
+        assert set(app.find_cells_near(latitude, longitude, 3)) == near
+        expected = {(owner[c["phone_number"]], c["phone_number"]) for c in overlapping(connections, near, at, at)}
+        assert set(app.find_suspects_near_location(latitude, longitude, date, time, 3)) == expected
+    assert app.find_suspects_in_cells([]) == []
+
+
+def test_locate_phones_at(world):
+    _, app, people, _, connections = world
+    phones = [phone for _, phone in people[:20]]
+    instants = [midpoint(c) for c in connections[:5]]
+    matrix = app.locate_phones_at(phones, instants)
+    expected = {(c["phone_number"], at) for c in connections for at in instants
+                if c["phone_number"] in phones and c["start_at"] <= at <= c["end_at"]}
+    found = matrix.found()
+    assert {(phone, at) for phone, at, _ in found} == expected
+    for phone, at, cell_id in found:
+        assert any(c["phone_number"] == phone and c["cell_id"] == cell_id and c["start_at"] <= at <= c["end_at"]
+                   for c in connections)
+
+
+def merged(intervals):
+    result = []
+    for start, end in sorted(intervals):
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((start, end))
+    return result
+
+
+def test_find_colocated_phones(world):
+    _, app, people, _, connections = world
+    phone = people[5][1]
+    start, end = START + timedelta(days=1), START + timedelta(days=3)
+    targets = {}
+    for c in overlapping([c for c in connections if c["phone_number"] == phone], {c["cell_id"] for c in connections},
+                         start, end):
+        targets.setdefault(c["cell_id"], []).append((c["start_at"], c["end_at"]))
+    expected = {}
+    for cell_id, intervals in targets.items():
+        for target_start, target_end in merged(intervals):
+            for c in overlapping(connections, {cell_id}, target_start, target_end):
+                if c["phone_number"] == phone:
+                    continue
+                overlap = min(c["end_at"], target_end, end) - max(c["start_at"], target_start, start)
+                if overlap >= timedelta(0):
+                    expected[c["phone_number"]] = expected.get(c["phone_number"], 0) + overlap.total_seconds()
+
+    found = app.find_colocated_phones(phone, start, end)
+    assert {row["phone_number"]: row["overlap_seconds"] for row in found} == pytest.approx(expected)
+    assert all(row["name"] == owners(people)[row["phone_number"]] for row in found)
+
+
+def test_get_trajectory(world):
+    _, app, people, _, connections = world
+    phone = people[8][1]
+    mine = sorted((c for c in connections if c["phone_number"] == phone), key=lambda c: c["start_at"])
+    trajectory = app.get_trajectory(phone)
+    assert trajectory.connections.sum() == len(mine)
+    assert trajectory.start_ms[0] == epoch_ms(mine[0]["start_at"])
+    window = app.get_trajectory(phone, START + timedelta(days=2), START + timedelta(days=4))
+    assert window.connections.sum() == len(overlapping(mine, {c["cell_id"] for c in mine},
+                                                       START + timedelta(days=2), START + timedelta(days=4)))
+
+
+def test_cell_index_and_interval_cache_paths(world):
+    store, app, people, _, connections = world
+    fast = CriminalTrackingApp(backend=store, cache=False, use_cell_index=True, interval_cache_size=100000,
+                               geocode_cache_path=False)
+    for connection in connections[:30]:
+        at = midpoint(connection)
+        phone = connection["phone_number"]
+        date, time = str(at.date()), str(at.time())
+        assert fast.get_cell_for_person_at_time(phone, date, time) in \
+            {c["cell_id"] for c in connections if c["phone_number"] == phone and c["start_at"] <= at <= c["end_at"]}
+        assert sorted(fast.get_connection_coordinates(phone, date, time)) == \
+            sorted(app.get_connection_coordinates(phone, date, time))
+        assert set(fast.find_suspects_near_location(41.9, 12.5, date, time, 5)) == \
+            set(app.find_suspects_near_location(41.9, 12.5, date, time, 5))
+    queries = fast.connector.stats_snapshot()["queries"]
+    # Point lookups went through the interval cache, radius lookups through the cell index
+    assert "get_cell_for_person_at_time" not in queries and "get_connection_coordinates" not in queries
+    assert "find_suspects_near_location" not in queries and "find_cells_near" not in queries
+    assert fast.interval_cache.stats()["hits"] > 0
+    assert not fast.cell_index.stale
+
+
+def test_query_cache_is_used_and_invalidated():
+    store = MemoryStore()
+    fill(store, [("Anna", "3000000001")], [], [])
+    cache = QueryCache(MemoryCache())
+    app = DataRetrievalApp(backend=store, cache=cache)
+    assert app.get_person_by_phone("3000000001") == {"name": "Anna"}
+    assert app.get_person_by_phone("3000000001") == {"name": "Anna"}
+    assert app.connector.stats_snapshot()["queries"]["get_person_by_phone"]["count"] == 1
+    assert cache.hits["get_person_by_phone"] == 1
+    DataCleaner(backend=store).delete_people()
+    assert app.get_person_by_phone("3000000001") is None
+
+
+def test_unported_queries_fail(world):
+    store, app, _, _, _ = world
+    # Like Neo4jConnector: execute_query reports the failure and returns None, stream_query raises
+    assert app.connector.execute_query("MATCH (n) RETURN n") is None
+    with pytest.raises(ValueError):
+        list(app.connector.stream_query("MATCH (n) RETURN n"))
+    assert app.connector.stats_snapshot()["errors"] == 2
+    # Nothing is replaced on the apps: every method goes through the connector
+    for instance in (app, UserCreationApp(backend=store), DataCleaner(backend=store)):
+        assert not [name for name in vars(instance) if callable(getattr(type(instance), name, None))]
+
+
+def test_snapshot_round_trip(world, tmp_path):
+    _, app, _, _, connections = world
+    app.export_snapshot(str(tmp_path), parquet=False)
+    copy = CriminalTrackingApp(backend=MemoryStore().load_snapshot(str(tmp_path)), cache=False,
+                               geocode_cache_path=False)
+    assert sorted(copy.iter_connection_epochs()) == sorted(app.iter_connection_epochs())
+    assert sorted(copy.iter_people_phones()) == sorted(app.iter_people_phones())
+    connection = connections[0]
+    window = (connection["start_at"], connection["end_at"])
+    assert set(copy.find_suspects_in_cell(connection["cell_id"], window=window)) == \
+        set(app.find_suspects_in_cell(connection["cell_id"], window=window))
+
+
+def test_cleaner():
+    store = MemoryStore()
+    people, cells, connections = build_rows(seed=3, connection_count=500)
+    fill(store, people, cells, connections)
+    cleaner = DataCleaner(backend=store)
+    types = [cell["type"] for cell in cells]
+    assert cleaner.count_entities() == {"people": len(people) + 1, "phone_numbers": len(people),
+                                        "traditional_cells": types.count("traditional"),
+                                        "five_g_cells": types.count("5G"), "connections": len(connections)}
+
+    before = START + timedelta(days=3)
+    assert cleaner.delete_connections(before=before, dry_run=True) == \
+        sum(c["end_at"] < before for c in connections)
+    assert cleaner.delete_connections(before=before) == sum(c["end_at"] < before for c in connections)
+    remaining = [c for c in connections if c["end_at"] >= before]
+    five_g = {cell["id"] for cell in cells if cell["type"] == "5G"}
+    assert cleaner.delete_5g_cells(dry_run=True) == len(five_g) + sum(c["cell_id"] in five_g for c in remaining)
+    assert cleaner.delete_5g_cells() == len(five_g) + sum(c["cell_id"] in five_g for c in remaining)
+    assert cleaner.count_entities()["connections"] == sum(c["cell_id"] not in five_g for c in remaining)
+
+    assert store.connection_stats["CONNECTED_TO"] >= max((c["end_at"] - c["start_at"]).total_seconds()
+                                                         for c in connections)
+    entities = cleaner.count_entities()
+    owned = len(people)
+    assert cleaner.delete_all_data(dry_run=True) == {
+        "connections": entities["connections"],
+        "phone_numbers": entities["connections"] + owned + entities["phone_numbers"],
+        "people": owned + entities["people"],
+        "cells": entities["connections"] + entities["traditional_cells"],
+        "connection_stats": 1}
+    cleaner.batch_size = 7
+    cleaner.delete_all_data()
+    assert cleaner.verify_empty_database() == 0
+    assert store.connection_stats == {}
+
+
+def test_per_row_writes():
+    store = MemoryStore()
+    retrieval = DataRetrievalApp(backend=store, cache=False)
+    with UserCreationApp(backend=store) as users, CellCreationApp(seed=1, backend=store) as cell_app, \
+            ConnectionCreationApp(retrieval, backend=store) as links:
+        users.create_person("Anna")
+        assert users.add_phone_number("Anna", "3000000001")
+        assert users.add_phone_number("Anna", "3000000001") is None
+        assert users.add_phone_number("Nobody", "3000000002") is None
+        assert cell_app.create_cell("C1", 41.9, 12.5, "traditional")
+        assert cell_app.create_cell("C1", 41.9, 12.5, "traditional") is None
+        links.connect_phone_to_cell("3000000001", "C1", "2024-03-01", "10:00:00", "2024-03-01", "11:00:00")
+        assert links.get_all_cell_ids() == ["C1"]
+
+        users.generate_fake_people(20)
+        cell_app.generate_cells_for_italy(total_cells=30)
+        links.generate_fake_connections(50)
+        links.generate_fake_connections_bulk(500, batch_size=100)
+
+    assert retrieval.get_person_by_phone("3000000001") == {"name": "Anna"}
+    assert retrieval.get_cell_for_person_at_time("3000000001", "2024-03-01", "10:30:00") == "C1"
+    assert len(retrieval.get_all_phone_numbers()) == 21
+    assert len(retrieval.get_all_cells()) == 31
+    assert len(retrieval.get_all_connections()) == 551
+    # The writes ran their Cypher through the connector
+    written = links.connector.stats_snapshot()["queries"]
+    assert {"connect_phone_to_cell", "connect_phones_to_cells_batch", "widen_max_duration",
+            "get_all_cell_ids"} <= set(written)
+    assert {"create_person", "add_phone_number"} <= set(users.connector.stats_snapshot()["queries"])